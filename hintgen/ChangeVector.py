@@ -1,5 +1,5 @@
 import ast, copy
-from .astTools import compareASTs, deepcopy
+from .astTools import compareASTs, sameAST, clearCache, deepcopy, shallowcopy
 from .display import printFunction
 from .tools import log
 
@@ -115,9 +115,55 @@ class ChangeVector:
 				return -99
 		return treeSpot
 
+	def copyPath(self, t, path=None, copied=None):
+		"""Copy t for making this change. Only the nodes and lists on the way down to the change are copied, and the
+			rest is shared with t, which is fine as long as trees are only changed through ChangeVectors.
+			Returns the new tree and its spot as in traverseTree (-99 if the path doesn't fit t).
+			Nodes whose ids are in copied are already copies, and are used as they are."""
+		if path == None:
+			path = self.path
+		if self.traverseTree(t, path) == -99:
+			return None, -99
+		if copied == None:
+			copied = set()
+		tree = t if id(t) in copied else shallowcopy(t)
+		copied.add(id(tree))
+		treeSpot = tree
+		for i in range(len(path)-1, 0, -1):
+			move = path[i]
+			if type(move) == tuple:
+				child = getattr(treeSpot, move[0])
+				if id(child) not in copied:
+					child = shallowcopy(child)
+					copied.add(id(child))
+					setattr(treeSpot, move[0], child)
+			else:
+				child = treeSpot[move]
+				if id(child) not in copied:
+					child = shallowcopy(child)
+					copied.add(id(child))
+					treeSpot[move] = child
+			treeSpot = child
+		return tree, treeSpot
+
+	def clearPathCache(self, t, path=None):
+		"""Forget the structural hashes and weights on the way from the root of t down to the change, which are out of date once it's made"""
+		if path == None:
+			path = self.path
+		treeSpot = t
+		clearCache(treeSpot)
+		for i in range(len(path)-1, 0, -1):
+			move = path[i]
+			if type(move) == tuple and hasattr(treeSpot, move[0]):
+				treeSpot = getattr(treeSpot, move[0])
+			elif type(move) == int and type(treeSpot) == list and move >= 0 and move < len(treeSpot):
+				treeSpot = treeSpot[move]
+			else:
+				return
+			clearCache(treeSpot)
+
 	def applyChange(self, caller=None):
-		tree = deepcopy(self.start)
-		treeSpot = self.traverseTree(tree)
+		(tree, treeSpot) = self.copyPath(self.start)
 		if treeSpot == -99:
 			return None
 
@@ -161,6 +207,7 @@ class ChangeVector:
 				log("ChangeVector\tapplyChange\tDoesn't fit in list: " + str(location) + "\n" + printFunction(self.start), "bug")
 		else:
 			log("ChangeVector\tapplyChange\t\tBroken at: " + str(location), "bug")
+		self.clearPathCache(tree)
 		return tree
 
 	def isReplaceVector(self):
@@ -232,8 +279,7 @@ class AddVector(ChangeVector):
 		return c
 
 	def applyChange(self, caller=None):
-		tree = deepcopy(self.start)
-		treeSpot = self.traverseTree(tree)
+		(tree, treeSpot) = self.copyPath(self.start)
 		if treeSpot == -99:
 			return None
 
@@ -245,6 +291,7 @@ class AddVector(ChangeVector):
 		else:
 			log("AddVector\tapplyChange\t\tBroken at: " + str(location), "bug")
 			return None
+		self.clearPathCache(tree)
 		return tree
 
 	def update(self, newStart, mapDict): 
@@ -302,8 +349,7 @@ class DeleteVector(ChangeVector):
 		return c
 
 	def applyChange(self, caller=None):
-		tree = deepcopy(self.start)
-		treeSpot = self.traverseTree(tree)
+		(tree, treeSpot) = self.copyPath(self.start)
 		if treeSpot == -99:
 			return None
 
@@ -321,6 +367,7 @@ class DeleteVector(ChangeVector):
 		else:
 			log("DeleteVector\tapplyChange\t\tBroken at: " + str(location), "bug")
 			return None
+		self.clearPathCache(tree)
 		return tree
 
 	def update(self, newStart, mapDict):
@@ -369,10 +416,8 @@ class SwapVector(ChangeVector):
 		return c
 
 	def applyChange(self, caller=None):
-		tree = deepcopy(self.start)
-
 		if self.oldPath == None:
-			treeSpot = self.traverseTree(tree)
+			(tree, treeSpot) = self.copyPath(self.start)
 			if treeSpot == -99:
 				return None
 
@@ -383,9 +428,12 @@ class SwapVector(ChangeVector):
 				log("SwapVector\tapplyChange\t\tBroken at: " + str(treeSpot), "bug")
 				return None
 		else:
-			oldTreeSpot = self.traverseTree(tree, path=self.oldPath)
-			newTreeSpot = self.traverseTree(tree, path=self.newPath)
-			if oldTreeSpot == -99 or newTreeSpot == -99:
+			copied = set()
+			(tree, oldTreeSpot) = self.copyPath(self.start, path=self.oldPath, copied=copied)
+			if oldTreeSpot == -99:
+				return None
+			(tree, newTreeSpot) = self.copyPath(tree, path=self.newPath, copied=copied)
+			if newTreeSpot == -99:
 				return None
 
 			if type(self.oldPath[0]) == int:
@@ -407,6 +455,11 @@ class SwapVector(ChangeVector):
 				newTreeSpot[self.newPath[0]] = tmpOldValue
 			else:
 				setattr(newTreeSpot, self.newPath[0][0], tmpOldValue)
+		if self.oldPath == None:
+			self.clearPathCache(tree)
+		else:
+			self.clearPathCache(tree, path=self.oldPath)
+			self.clearPathCache(tree, path=self.newPath)
 		return tree
 
 	def update(self, newStart, mapDict): 
@@ -499,8 +552,7 @@ class MoveVector(ChangeVector):
 		return c
 
 	def applyChange(self, caller=None):
-		tree = deepcopy(self.start)
-		treeSpot = self.traverseTree(tree)
+		(tree, treeSpot) = self.copyPath(self.start)
 		if treeSpot == -99:
 			return None
 
@@ -511,6 +563,7 @@ class MoveVector(ChangeVector):
 		else:
 			log("MoveVector\tapplyChange\t\tBroken at: " + str(treeSpot), "bug")
 			return None
+		self.clearPathCache(tree)
 		return tree
 
 	def update(self, newStart, mapDict):
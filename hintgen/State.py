@@ -8,7 +8,6 @@ class State:
 	feedback = None
 
 	fun = None 
-	loadedFun = None
 	tree = None
 
 	def __cmp__(this, other):
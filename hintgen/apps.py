@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class HintgenConfig(AppConfig):
     name = 'hintgen'
+
+    def ready(self):
+        from . import test # connects the signals that keep the test caches up to date
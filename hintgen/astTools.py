@@ -1,18 +1,31 @@
-import ast, copy, pickle
+import ast, copy, copyreg, hashlib, io, pickle, zlib
 from .tools import log
 from .namesets import *
 from .display import printFunction
 
+TREE_COMPRESSION = 6 # the zlib level stored trees are compressed with, from 1 (fastest) to 9 (smallest); 0 stores them as plain pickles
+HASH_SIZE = 16 # the number of bytes in a structural hash
+
 def cmp(a, b):
 	if type(a) == type(b) == complex:
 		return (a.real > b.real) - (a.real < b.real)
 	return (a > b) - (a < b)
 
 def tree_to_str(a):
-	return repr(pickle.dumps(a))
+	"""Serialize a tree for a tree_source field: pickled (without the values cached on its nodes), then compressed"""
+	f = io.BytesIO()
+	pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+	pickler.dispatch_table = nodeReducers
+	pickler.dump(a)
+	data = f.getvalue()
+	return zlib.compress(data, TREE_COMPRESSION) if TREE_COMPRESSION > 0 else data
+
+def tree_pickle(s):
+	"""The pickled tree in a tree_source field, which is only compressed if it doesn't start like a pickle does"""
+	return s if bytes(s[:1]) == b"\x80" else zlib.decompress(s)
 
 def str_to_tree(s):
-	return pickle.loads(eval(s))
+	return pickle.loads(tree_pickle(s))
 
 def builtInName(id):
 	"""Determines whether the given id is a built-in name"""
@@ -97,20 +110,12 @@ def applyToChildren(a, f):
 
 def occursIn(sub, super):
 	"""Does the first AST occur as a subtree of the second?"""
-	superStatementTypes = [	ast.Module, ast.Interactive, ast.Suite,
-							ast.FunctionDef, ast.ClassDef, ast.For, 
-							ast.While, ast.If, ast.With, ast.Try, 
-							ast.ExceptHandler ]
-	if (not isinstance(super, ast.AST)):
+	if (not isinstance(sub, ast.AST)) or (not isinstance(super, ast.AST)):
 		return False
-	if type(sub) == type(super) and compareASTs(sub, super, checkEquality=True) == 0:
-		return True
-	# we know that a statement can never occur in an expression 
-	# (or in a non-statement-holding statement), so cut the search off now to save time.
-	if isStatement(sub) and type(super) not in superStatementTypes:
-		return False 
-	for child in ast.iter_child_nodes(super):
-		if occursIn(sub, child):
+	target = structuralHash(sub)
+	structuralHash(super) # this hashes every node in super, so the search only has to look the hashes up
+	for node in ast.walk(super):
+		if type(node) == type(sub) and structuralHash(node) == target:
 			return True
 	return False
 
@@ -848,6 +853,69 @@ def depthOfAST(a):
 			m = tmp
 	return m + 1
 
+def treeSignature(a):
+	"""A quick fingerprint of the tree's structure, for telling whether a pass changed it.
+		Trees with the same signature are the same code, so a pass will do the same thing to both."""
+	return ast.dump(a)
+
+# The fields compareASTs looks at for each type of node (any others, like Load/Store contexts, don't matter)
+compareFields = { ast.Module : ["body"], ast.Interactive : ["body"],
+			ast.Expression : ["body"], ast.Suite : ["body"],
+
+			ast.FunctionDef : ["name", "args", "body", "decorator_list", "returns"],
+			ast.ClassDef : ["name", "bases", "keywords", "body", "decorator_list"],
+			ast.Return : ["value"],
+			ast.Delete : ["targets"],
+			ast.Assign : ["targets", "value"],
+			ast.AugAssign : ["target", "op", "value"],
+			ast.For : ["target", "iter", "body", "orelse"],
+			ast.While : ["test", "body", "orelse"],
+			ast.If : ["test", "body", "orelse"],
+			ast.With : ["items", "body"],
+			ast.Raise : ["exc", "cause"],
+			ast.Try : ["body", "handlers", "orelse", "finalbody"],
+			ast.Assert : ["test", "msg"],
+			ast.Import : ["names"],
+			ast.ImportFrom : ["module", "names", "level"],
+			ast.Global : ["names"],
+			ast.Expr : ["value"],
+
+			ast.BoolOp : ["op", "values"],
+			ast.BinOp : ["left", "op", "right"],
+			ast.UnaryOp : ["op", "operand"],
+			ast.Lambda : ["args", "body"],
+			ast.IfExp : ["test", "body", "orelse"],
+			ast.Dict : ["keys", "values"],
+			ast.Set : ["elts"],
+			ast.ListComp : ["elt", "generators"],
+			ast.SetComp : ["elt", "generators"],
+			ast.DictComp : ["key", "value", "generators"],
+			ast.GeneratorExp : ["elt", "generators"],
+			ast.Yield : ["value"],
+			ast.Compare : ["left", "ops", "comparators"],
+			ast.Call : ["func", "args", "keywords"],
+			ast.Num : ["n"],
+			ast.Str : ["s"],
+			ast.Bytes : ["s"],
+			ast.NameConstant : ["value"],
+			ast.Attribute : ["value", "attr"],
+			ast.Subscript : ["value", "slice"],
+			ast.List : ["elts"],
+			ast.Tuple : ["elts"],
+			ast.Starred : ["value"],
+
+			ast.Slice : ["lower", "upper", "step"],
+			ast.ExtSlice : ["dims"],
+			ast.Index : ["value"],
+
+			ast.comprehension : ["target", "iter", "ifs"],
+			ast.ExceptHandler : ["type", "name", "body"],
+			ast.arguments : ["args", "vararg", "kwonlyargs", "kw_defaults", "kwarg", "defaults"],
+			ast.arg : ["arg", "annotation"],
+			ast.keyword : ["arg", "value"],
+			ast.alias : ["name", "asname"],
+			ast.withitem : ["context_expr", "optional_vars"] }
+
 def compareASTs(a, b, checkEquality=False):
 	"""A comparison function for ASTs"""
 	# None before others
@@ -948,70 +1016,81 @@ def compareASTs(a, b, checkEquality=False):
 		return 0
 
 	# Now compare based on the attributes in the identical types
-	attrMap = { ast.Module : ["body"], ast.Interactive : ["body"],
-				ast.Expression : ["body"], ast.Suite : ["body"],
-
-				ast.FunctionDef : ["name", "args", "body", "decorator_list", "returns"],
-				ast.ClassDef : ["name", "bases", "keywords", "body", "decorator_list"],
-				ast.Return : ["value"],
-				ast.Delete : ["targets"],
-				ast.Assign : ["targets", "value"],
-				ast.AugAssign : ["target", "op", "value"],
-				ast.For : ["target", "iter", "body", "orelse"],
-				ast.While : ["test", "body", "orelse"],
-				ast.If : ["test", "body", "orelse"],
-				ast.With : ["items", "body"],
-				ast.Raise : ["exc", "cause"],
-				ast.Try : ["body", "handlers", "orelse", "finalbody"],
-				ast.Assert : ["test", "msg"],
-				ast.Import : ["names"],
-				ast.ImportFrom : ["module", "names", "level"],
-				ast.Global : ["names"],
-				ast.Expr : ["value"],
-
-				ast.BoolOp : ["op", "values"],
-				ast.BinOp : ["left", "op", "right"],
-				ast.UnaryOp : ["op", "operand"],
-				ast.Lambda : ["args", "body"],
-				ast.IfExp : ["test", "body", "orelse"],
-				ast.Dict : ["keys", "values"],
-				ast.Set : ["elts"],
-				ast.ListComp : ["elt", "generators"],
-				ast.SetComp : ["elt", "generators"],
-				ast.DictComp : ["key", "value", "generators"],
-				ast.GeneratorExp : ["elt", "generators"],
-				ast.Yield : ["value"],
-				ast.Compare : ["left", "ops", "comparators"],
-				ast.Call : ["func", "args", "keywords"],
-				ast.Num : ["n"],
-				ast.Str : ["s"],
-				ast.Bytes : ["s"],
-				ast.NameConstant : ["value"],
-				ast.Attribute : ["value", "attr"],
-				ast.Subscript : ["value", "slice"],
-				ast.List : ["elts"],
-				ast.Tuple : ["elts"],
-				ast.Starred : ["value"],
-
-				ast.Slice : ["lower", "upper", "step"],
-				ast.ExtSlice : ["dims"],
-				ast.Index : ["value"],
-
-				ast.comprehension : ["target", "iter", "ifs"],
-				ast.ExceptHandler : ["type", "name", "body"],
-				ast.arguments : ["args", "vararg", "kwonlyargs", "kw_defaults", "kwarg", "defaults"],
-				ast.arg : ["arg", "annotation"],
-				ast.keyword : ["arg", "value"],
-				ast.alias : ["name", "asname"],
-				ast.withitem : ["context_expr", "optional_vars"] }
-
-	for attr in attrMap[type(a)]:
+
+	for attr in compareFields[type(a)]:
 		r = compareASTs(getattr(a, attr), getattr(b, attr), checkEquality=checkEquality)
 		if r != 0:
 			return r
 	# If all attributes are identical, they're equal
 	return 0
 
+def structuralHash(a, ignoreIds=False, cache=True):
+	"""A Merkle hash of the tree, where each node's hash is made from its type, its values, and its children's hashes.
+		It follows the rules of compareASTs(checkEquality=True), so equal trees have the same hash and different trees
+		(almost certainly) don't; Load/Store contexts are left out. With ignoreIds, the names of variables are left out
+		too, the same way diffAsts does with ignoreVariables.
+		The hashes are kept on the nodes. deepcopy doesn't copy them, and ChangeVectors clear them on the path they
+		change, but anything else that changes a hashed tree in place has to call clearCache on the way down to the
+		change. Use cache=False for trees that are being changed in place (as in canonicalizing)."""
+	if a == None:
+		return noneHash
+	elif type(a) == list:
+		h = hashlib.blake2b(b"list", digest_size=HASH_SIZE)
+		for child in a:
+			addToHash(h, child, ignoreIds, cache)
+		return h.digest()
+	elif not isinstance(a, ast.AST):
+		h = hashlib.blake2b(b"value", digest_size=HASH_SIZE)
+		addToHash(h, a, ignoreIds, cache)
+		return h.digest()
+	elif type(a) in contextTypes:
+		return contextHash
+
+	key = "anonHash" if ignoreIds else "structHash"
+	if cache and key in a.__dict__:
+		return a.__dict__[key]
+	h = hashlib.blake2b(type(a).__name__.encode("utf-8"), digest_size=HASH_SIZE)
+	if type(a) == ast.Name:
+		if not (ignoreIds and not builtInName(a.id)):
+			addToHash(h, a.id, ignoreIds, cache)
+	else:
+		fields = compareFields[type(a)] if type(a) in compareFields else [f for f in a._fields if f != "ctx"]
+		for field in fields:
+			addToHash(h, getattr(a, field, None), ignoreIds, cache)
+	value = h.digest()
+	if cache:
+		a.__dict__[key] = value
+	return value
+
+def addToHash(h, x, ignoreIds, cache):
+	"""Add one child to a structural hash: subtrees go in by their own hashes, and values go in directly"""
+	if x == None or type(x) == list or isinstance(x, ast.AST):
+		h.update(b"t")
+		h.update(structuralHash(x, ignoreIds=ignoreIds, cache=cache))
+	else:
+		if type(x) == float and x == 0:
+			x = 0.0 # -0.0 is equal to 0.0 as well
+		data = (type(x).__name__ + ":" + repr(x)).encode("utf-8", "surrogatepass")
+		h.update(b"v")
+		h.update(len(data).to_bytes(4, "little"))
+		h.update(data)
+
+noneHash = hashlib.blake2b(b"None", digest_size=HASH_SIZE).digest()
+contextHash = hashlib.blake2b(b"context", digest_size=HASH_SIZE).digest()
+contextTypes = [ ast.Load, ast.Store, ast.Del, ast.AugLoad, ast.AugStore, ast.Param ]
+
+def sameAST(a, b, ignoreIds=False):
+	"""Are the two trees equal (as in compareASTs(a, b, checkEquality=True) == 0)? This compares structural hashes, so it's
+		only for trees that aren't changed in place afterwards (see structuralHash)."""
+	return a is b or structuralHash(a, ignoreIds=ignoreIds) == structuralHash(b, ignoreIds=ignoreIds)
+
+def clearCache(a):
+	"""Forget the structural hashes and weight cached on this node (but not its children), once it's been changed"""
+	if isinstance(a, ast.AST):
+		for prop in ["structHash", "anonHash", "treeWeight"]:
+			if hasattr(a, prop):
+				delattr(a, prop)
+
 def deepcopyList(l):
 	"""Deepcopy of a list"""
 	if l == None:
@@ -1021,175 +1100,84 @@ def deepcopyList(l):
 	if type(l) != list:
 		log("astTools\tdeepcopyList\tNot a list: " + str(type(l)), "bug")
 		return copy.deepcopy(l)
-
-	newList = []
-	for line in l:
-		newList.append(deepcopy(line))
-	return newList
+	return [deepcopy(line) for line in l]
 
 def deepcopy(a):
-	"""Let's try to keep this as quick as possible"""
-	if a == None:
+	"""Copy the tree, along with each node's metadata (but not cached values, like hashes and weights).
+		Each type of node has its own copier, made by makeCopier."""
+	copier = nodeCopiers.get(type(a))
+	if copier != None:
+		return copier(a)
+	elif a == None:
 		return None
-	if type(a) == list:
-		return deepcopyList(a)
+	elif type(a) == list:
+		return [deepcopy(x) for x in a]
 	elif type(a) in [int, float, str, bool]:
 		return a
-	if not isinstance(a, ast.AST):
+	elif not isinstance(a, ast.AST):
 		log("astTools\tdeepcopy\tNot an AST: " + str(type(a)), "bug")
 		return copy.deepcopy(a)
-
-	g = a.global_id if hasattr(a, "global_id") else None
-	cp = None
-	# Objects without lineno, col_offset
-	if type(a) in [	ast.And, ast.Or, ast.Add, ast.Sub, ast.Mult, ast.Div,
-						ast.Mod, ast.Pow, ast.LShift, ast.RShift, ast.BitOr,
-						ast.BitXor, ast.BitAnd, ast.FloorDiv, ast.Invert,
-						ast.Not, ast.UAdd, ast.USub, ast.Eq, ast.NotEq, ast.Lt,
-						ast.LtE, ast.Gt, ast.GtE, ast.Is, ast.IsNot, ast.In,
-						ast.NotIn, ast.Load, ast.Store, ast.Del, ast.AugLoad,
-						ast.AugStore, ast.Param
-					]:
-		return a
-	elif type(a) == ast.Module:
-		cp = ast.Module(deepcopyList(a.body))
-	elif type(a) == ast.Interactive:
-		cp = ast.Interactive(deepcopyList(a.body))
-	elif type(a) == ast.Expression:
-		cp = ast.Expression(deepcopy(a.body))
-	elif type(a) == ast.Suite:
-		cp = ast.Suite(deepcopyList(a.body))
-
-	elif type(a) == ast.FunctionDef:
-		cp = ast.FunctionDef(a.name, deepcopy(a.args), deepcopyList(a.body),
-			deepcopyList(a.decorator_list), deepcopy(a.returns))
-	elif type(a) == ast.ClassDef:
-		cp = ast.ClassDef(a.name, deepcopyList(a.bases), deepcopyList(a.keywords), deepcopyList(a.body),
-			deepcopyList(a.decorator_list))
-	elif type(a) == ast.Return:
-		cp = ast.Return(deepcopy(a.value))
-	elif type(a) == ast.Delete:
-		cp = ast.Delete(deepcopyList(a.targets))
-	elif type(a) == ast.Assign:
-		cp = ast.Assign(deepcopyList(a.targets), deepcopy(a.value))
-	elif type(a) == ast.AugAssign:
-		cp = ast.AugAssign(deepcopy(a.target), deepcopy(a.op),
-			deepcopy(a.value))
-	elif type(a) == ast.For:
-		cp = ast.For(deepcopy(a.target), deepcopy(a.iter),
-			deepcopyList(a.body), deepcopyList(a.orelse))
-	elif type(a) == ast.While:
-		cp = ast.While(deepcopy(a.test), deepcopyList(a.body),
-			deepcopyList(a.orelse))
-	elif type(a) == ast.If:
-		cp = ast.If(deepcopy(a.test), deepcopyList(a.body),
-			deepcopyList(a.orelse))
-	elif type(a) == ast.With:
-		cp = ast.With(deepcopyList(a.items),deepcopyList(a.body))
-	elif type(a) == ast.Raise:
-		cp = ast.Raise(deepcopy(a.exc), deepcopy(a.cause))
-	elif type(a) == ast.Try:
-		cp = ast.Try(deepcopyList(a.body), deepcopyList(a.handlers),
-			deepcopyList(a.orelse), deepcopyList(a.finalbody))
-	elif type(a) == ast.Assert:
-		cp = ast.Assert(deepcopy(a.test), deepcopy(a.msg))
-	elif type(a) == ast.Import:
-		cp = ast.Import(deepcopyList(a.names))
-	elif type(a) == ast.ImportFrom:
-		cp = ast.ImportFrom(a.module, deepcopyList(a.names), a.level)
-	elif type(a) == ast.Global:
-		cp = ast.Global(a.names[:])
-	elif type(a) == ast.Expr:
-		cp = ast.Expr(deepcopy(a.value))
-	elif type(a) == ast.Pass:
-		cp = ast.Pass()
-	elif type(a) == ast.Break:
-		cp = ast.Break()
-	elif type(a) == ast.Continue:
-		cp = ast.Continue()
-
-	elif type(a) == ast.BoolOp:
-		cp = ast.BoolOp(a.op, deepcopyList(a.values))
-	elif type(a) == ast.BinOp:
-		cp = ast.BinOp(deepcopy(a.left), a.op, deepcopy(a.right))
-	elif type(a) == ast.UnaryOp:
-		cp = ast.UnaryOp(a.op, deepcopy(a.operand))
-	elif type(a) == ast.Lambda:
-		cp = ast.Lambda(deepcopy(a.args), deepcopy(a.body))
-	elif type(a) == ast.IfExp:
-		cp = ast.IfExp(deepcopy(a.test), deepcopy(a.body), deepcopy(a.orelse))
-	elif type(a) == ast.Dict:
-		cp = ast.Dict(deepcopyList(a.keys), deepcopyList(a.values))
-	elif type(a) == ast.Set:
-		cp = ast.Set(deepcopyList(a.elts))
-	elif type(a) == ast.ListComp:
-		cp = ast.ListComp(deepcopy(a.elt), deepcopyList(a.generators))
-	elif type(a) == ast.SetComp:
-		cp = ast.SetComp(deepcopy(a.elt), deepcopyList(a.generators))
-	elif type(a) == ast.DictComp:
-		cp = ast.DictComp(deepcopy(a.key), deepcopy(a.value),
-			deepcopyList(a.generators))
-	elif type(a) == ast.GeneratorExp:
-		cp = ast.GeneratorExp(deepcopy(a.elt), deepcopyList(a.generators))
-	elif type(a) == ast.Yield:
-		cp = ast.Yield(deepcopy(a.value))
-	elif type(a) == ast.Compare:
-		cp = ast.Compare(deepcopy(a.left), a.ops[:],
-			deepcopyList(a.comparators))
-	elif type(a) == ast.Call:
-		cp = ast.Call(deepcopy(a.func), deepcopyList(a.args), deepcopyList(a.keywords))
-	elif type(a) == ast.Num:
-		cp = ast.Num(a.n)
-	elif type(a) == ast.Str:
-		cp = ast.Str(a.s)
-	elif type(a) == ast.Bytes:
-		cp = ast.Bytes(a.s)
-	elif type(a) == ast.NameConstant:
-		cp = ast.NameConstant(a.value)
-	elif type(a) == ast.Attribute:
-		cp = ast.Attribute(deepcopy(a.value), a.attr, a.ctx)
-	elif type(a) == ast.Subscript:
-		cp = ast.Subscript(deepcopy(a.value), deepcopy(a.slice), a.ctx)
-	elif type(a) == ast.Name:
-		cp = ast.Name(a.id, a.ctx)
-	elif type(a) == ast.List:
-		cp = ast.List(deepcopyList(a.elts), a.ctx)
-	elif type(a) == ast.Tuple:
-		cp = ast.Tuple(deepcopyList(a.elts), a.ctx)
-	elif type(a) == ast.Starred:
-		cp = ast.Starred(deepcopy(a.value), a.ctx)
-
-	elif type(a) == ast.Slice:
-		cp = ast.Slice(deepcopy(a.lower), deepcopy(a.upper), deepcopy(a.step))
-	elif type(a) == ast.ExtSlice:
-		cp = ast.ExtSlice(deepcopyList(a.dims))
-	elif type(a) == ast.Index:
-		cp = ast.Index(deepcopy(a.value))
-
-	elif type(a) == ast.comprehension:
-		cp = ast.comprehension(deepcopy(a.target), deepcopy(a.iter),
-			deepcopyList(a.ifs))
-	elif type(a) == ast.ExceptHandler:
-		cp = ast.ExceptHandler(deepcopy(a.type), a.name, deepcopyList(a.body))
-	elif type(a) == ast.arguments:
-		cp = ast.arguments(deepcopyList(a.args), deepcopy(a.vararg), 
-			deepcopyList(a.kwonlyargs), deepcopyList(a.kw_defaults), 
-			deepcopy(a.kwarg), deepcopyList(a.defaults))
-	elif type(a) == ast.arg:
-		cp = ast.arg(a.arg, deepcopy(a.annotation))
-	elif type(a) == ast.keyword:
-		cp = ast.keyword(a.arg, deepcopy(a.value))
-	elif type(a) == ast.alias:
-		cp = ast.alias(a.name, a.asname)
-	elif type(a) == ast.withitem:
-		cp = ast.withitem(deepcopy(a.context_expr), deepcopy(a.optional_vars))
-	else:
-		log("astTools\tdeepcopy\tNot implemented: " + str(type(a)), "bug")
-		cp = copy.deepcopy(a)
-
+	log("astTools\tdeepcopy\tNot implemented: " + str(type(a)), "bug")
+	cp = copy.deepcopy(a)
 	transferMetaData(a, cp)
 	return cp
 
+def shallowcopy(a):
+	"""Copy just this node (or list), sharing its children with the original. Used to copy the path down to a change."""
+	if type(a) == list:
+		return a[:]
+	copier = shallowCopiers.get(type(a))
+	if copier != None:
+		return copier(a)
+	elif isinstance(a, ast.AST):
+		return deepcopy(a)
+	return a
+
+def makeCopier(t, deep):
+	"""Make a function that copies nodes of type t, with the fields as they are (if deep is False) or copied"""
+	fields = t._fields
+	metaData = set(metaDataProperties)
+	kept = keptFields.get(t, [])
+	args = ", ".join(("deepcopy(a." + f + ")" if deep and f not in kept else "a." + f) for f in fields)
+	# Writing the constructor call out for each type is much quicker than looping over the fields
+	source = "def copier(a):\n" + \
+			"	cp = t(" + args + ")\n" + \
+			"	if len(a.__dict__) > " + str(len(fields)) + ":\n" + \
+			"		for (key, value) in a.__dict__.items():\n" + \
+			"			if key in metaData:\n" + \
+			"				setattr(cp, key, value)\n" + \
+			"	return cp\n"
+	namespace = { "t" : t, "deepcopy" : deepcopy, "metaData" : metaData }
+	exec(source, namespace)
+	return namespace["copier"]
+
+# The fields that hold plain values, operators, or contexts, none of which need copying
+keptFields = {	ast.FunctionDef : ["name"], ast.ClassDef : ["name"], ast.ImportFrom : ["module", "level"],
+				ast.AugAssign : ["op"], ast.BoolOp : ["op"], ast.BinOp : ["op"], ast.UnaryOp : ["op"],
+				ast.Num : ["n"], ast.Str : ["s"], ast.Bytes : ["s"], ast.NameConstant : ["value"],
+				ast.Attribute : ["attr", "ctx"], ast.Subscript : ["ctx"], ast.Name : ["id", "ctx"],
+				ast.List : ["ctx"], ast.Tuple : ["ctx"], ast.Starred : ["ctx"],
+				ast.ExceptHandler : ["name"], ast.arg : ["arg"], ast.keyword : ["arg"], ast.alias : ["name", "asname"] }
+# Operators and contexts have no children or metadata, so they're shared instead of copied
+sharedTypes = [	ast.And, ast.Or, ast.Add, ast.Sub, ast.Mult, ast.Div,
+				ast.Mod, ast.Pow, ast.LShift, ast.RShift, ast.BitOr,
+				ast.BitXor, ast.BitAnd, ast.FloorDiv, ast.Invert,
+				ast.Not, ast.UAdd, ast.USub, ast.Eq, ast.NotEq, ast.Lt,
+				ast.LtE, ast.Gt, ast.GtE, ast.Is, ast.IsNot, ast.In,
+				ast.NotIn, ast.Load, ast.Store, ast.Del, ast.AugLoad,
+				ast.AugStore, ast.Param ]
+copiedTypes = [	ast.Module, ast.Interactive, ast.Expression, ast.Suite,
+				ast.FunctionDef, ast.ClassDef, ast.Return, ast.Delete, ast.Assign, ast.AugAssign,
+				ast.For, ast.While, ast.If, ast.With, ast.Raise, ast.Try, ast.Assert,
+				ast.Import, ast.ImportFrom, ast.Global, ast.Expr, ast.Pass, ast.Break, ast.Continue,
+				ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Lambda, ast.IfExp, ast.Dict, ast.Set,
+				ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp, ast.Yield,
+				ast.Compare, ast.Call, ast.Num, ast.Str, ast.Bytes, ast.NameConstant,
+				ast.Attribute, ast.Subscript, ast.Name, ast.List, ast.Tuple, ast.Starred,
+				ast.Slice, ast.ExtSlice, ast.Index,
+				ast.comprehension, ast.ExceptHandler, ast.arguments, ast.arg, ast.keyword,
+				ast.alias, ast.withitem ]
+
 def exportToJson(a):
 	"""Export the ast to json format"""
 	if a == None:
@@ -1268,23 +1256,44 @@ def isDefault(a):
 				return True
 	return False
 
+# The metadata the canonicalizing passes leave on nodes, which is kept when nodes are copied
+metaDataProperties = [	"global_id", "second_global_id", "lineno", "col_offset",
+				"originalId", "varID", "variableGlobalId", 
+				"randomVar", "propagatedVariable", "loadedVariable", "dontChangeName",
+				"reversed", "negated", "inverted",
+				"augAssignVal", "augAssignBinOp",
+				"combinedConditional", "combinedConditionalOp",
+				"multiComp", "multiCompPart", "multiCompMiddle", "multiCompOp",
+				"addedNot", "addedNotOp", "addedOther", "addedOtherOp", "addedNeg",
+				"collapsedExpr", "removedLines",
+				"helperVar", "helperReturnVal", "helperParamAssign", "helperReturnAssign", 
+				"orderedBinOp", "typeCastFunction", "moved_line" ]
+
 def transferMetaData(a, b):
 	"""Transfer the metadata of a onto b"""
-	properties = [	"global_id", "second_global_id", "lineno", "col_offset",
-					"originalId", "varID", "variableGlobalId", 
-					"randomVar", "propagatedVariable", "loadedVariable", "dontChangeName",
-					"reversed", "negated", "inverted",
-					"augAssignVal", "augAssignBinOp",
-					"combinedConditional", "combinedConditionalOp",
-					"multiComp", "multiCompPart", "multiCompMiddle", "multiCompOp",
-					"addedNot", "addedNotOp", "addedOther", "addedOtherOp", "addedNeg",
-					"collapsedExpr", "removedLines",
-					"helperVar", "helperReturnVal", "helperParamAssign", "helperReturnAssign", 
-					"orderedBinOp", "typeCastFunction", "moved_line" ]
-	for prop in properties:
+	for prop in metaDataProperties:
 		if hasattr(a, prop):
 			setattr(b, prop, getattr(a, prop))
 
+nodeCopiers = { t : makeCopier(t, True) for t in copiedTypes }
+nodeCopiers.update({ t : (lambda a : a) for t in sharedTypes })
+shallowCopiers = { t : makeCopier(t, False) for t in copiedTypes }
+
+# Values cached on nodes, which are left out of stored trees; they'd go out of date whenever the way they're worked out changes
+cachedProperties = ["structHash", "anonHash", "folded"]
+
+def reduceNode(a):
+	"""Pickle a node the way pickle normally would, but without its cached values"""
+	state = a.__dict__
+	for prop in cachedProperties:
+		if prop in state:
+			state = { k : v for (k, v) in state.items() if k not in cachedProperties }
+			break
+	return (type(a), (), state)
+
+nodeReducers = copyreg.dispatch_table.copy()
+nodeReducers.update({ t : reduceNode for t in vars(ast).values() if type(t) == type and issubclass(t, ast.AST) })
+
 def assignPropertyToAll(a, prop):
 	"""Assign the provided property to all children"""
 	if type(a) == list:
@@ -0,0 +1,160 @@
+"""Timing benchmarks for the expensive parts of the hint pipeline.
+Run these from the Django shell, e.g. benchmarks.benchmark_loading(Problem.objects.get(name="is_prime"))"""
+import ast, copy, importlib.util, os, pickle, random, subprocess, time, types, uuid
+from .test.testHarness import load_code
+from .canonicalize import runGiveIds
+from .astTools import deepcopy, tree_to_str, str_to_tree
+from .path_construction.diffAsts import getChanges
+from .paths import TEST_PATH
+from .models import *
+
+def load_via_file(code, instructorFunctions):
+	"""The old way of loading code: write it into test/tmp, import it, then clean up after it"""
+	tmpFile = "tmp" + str(random.randint(0,100000))
+	tmpFull = TEST_PATH + "tmp/" + tmpFile
+	with open(tmpFull + ".py", "w") as f:
+		f.write(code)
+		if len(instructorFunctions) != 0:
+			f.write("\n\n" + instructorFunctions)
+	try:
+		spec = importlib.util.spec_from_file_location(tmpFile, tmpFull + ".py")
+		mod = importlib.util.module_from_spec(spec)
+		spec.loader.exec_module(mod)
+	except Exception as e:
+		mod = None
+	os.remove(tmpFull + ".py")
+	for version in range(10):
+		name = TEST_PATH + "tmp/__pycache__/" + tmpFile + ".cpython-3" + str(version) + ".pyc"
+		if os.path.exists(name):
+			os.remove(name)
+	return mod
+
+def time_per_state(f, states, repeat):
+	start = time.perf_counter()
+	for i in range(repeat):
+		for s in states:
+			f(s)
+	return (time.perf_counter() - start) / (repeat * len(states))
+
+def benchmark_loading(problem, repeat=20):
+	"""Compare loading each of the problem's states through a temp file against loading it in memory"""
+	# Leave out code that loops forever when loaded, since nothing here is timed out
+	states = list(State.objects.filter(problem=problem).exclude(feedback__startswith="Infinite loop"))
+	if len(states) == 0:
+		print("No states for " + problem.name)
+		return
+	given = problem.given_code
+	fileTime = time_per_state(lambda s : load_via_file(s.code, given), states, repeat)
+	memoryTime = time_per_state(lambda s : load_code(s.code, given), states, repeat)
+	print(problem.name + ": " + str(len(states)) + " states")
+	print("temp file:\t%.1f us per state" % (fileTime * 1e6))
+	print("in memory:\t%.1f us per state" % (memoryTime * 1e6))
+	print("saved:\t\t%.1f us per state (%.1fx faster)" % ((fileTime - memoryTime) * 1e6, fileTime / memoryTime))
+
+def give_uuid_ids(a):
+	"""The old way of giving ids to a tree: a uuid1 for every node"""
+	if isinstance(a, ast.AST):
+		if type(a) in [ast.Load, ast.Store, ast.Del, ast.AugLoad, ast.AugStore, ast.Param]:
+			return
+		a.global_id = uuid.uuid1()
+		for field in a._fields:
+			child = getattr(a, field)
+			if type(child) == list:
+				for i in range(len(child)):
+					if hasattr(child[i], "global_id"):
+						child[i] = copy.deepcopy(child[i])
+					give_uuid_ids(child[i])
+			else:
+				if hasattr(child, "global_id"):
+					child = copy.deepcopy(child)
+					setattr(a, field, child)
+				give_uuid_ids(child)
+
+def benchmark_ids(problem, repeat=20):
+	"""Compare giving uuid1 ids to each of the problem's cleaned trees against giving them integer ids,
+		both in time and in the size of the serialized tree"""
+	trees = []
+	for s in CleanedState.objects.filter(problem=problem):
+		try:
+			trees.append(ast.parse(s.code))
+		except:
+			pass
+	if len(trees) == 0:
+		print("No cleaned states for " + problem.name)
+		return
+	copies = [deepcopy(t) for t in trees for i in range(repeat)] # ids can only be given to a tree once
+	start = time.perf_counter()
+	for t in copies:
+		give_uuid_ids(t)
+	uuidTime = (time.perf_counter() - start) / len(copies)
+	uuidSize = sum(len(tree_to_str(t)) for t in copies[::repeat]) / len(trees)
+	copies = [deepcopy(t) for t in trees for i in range(repeat)]
+	start = time.perf_counter()
+	for t in copies:
+		runGiveIds(t)
+	intTime = (time.perf_counter() - start) / len(copies)
+	intSize = sum(len(tree_to_str(t)) for t in copies[::repeat]) / len(trees)
+	print(problem.name + ": " + str(len(trees)) + " trees")
+	print("uuid ids:\t%.1f us per tree, %d bytes serialized" % (uuidTime * 1e6, uuidSize))
+	print("integer ids:\t%.1f us per tree, %d bytes serialized" % (intTime * 1e6, intSize))
+	print("saved:\t\t%.1f us per tree (%.1fx faster), %d bytes (%.0f%%)" % ((uuidTime - intTime) * 1e6, uuidTime / intTime,
+		uuidSize - intSize, 100 * (uuidSize - intSize) / uuidSize))
+
+def benchmark_tree_storage(problem, repeat=20):
+	"""Compare storing each of the problem's trees as the repr of a pickle (and reading them back with eval) against
+		the compressed binary pickles in tree_source, both in size and in decoding time"""
+	trees = [str_to_tree(s.tree_source) for s in State.objects.filter(problem=problem).exclude(tree_source=b"")]
+	if len(trees) == 0:
+		print("No trees for " + problem.name)
+		return
+	texts = [repr(pickle.dumps(t)) for t in trees]
+	plain = [pickle.dumps(t, pickle.HIGHEST_PROTOCOL) for t in trees]
+	stored = [tree_to_str(t) for t in trees]
+	textTime = time_per_state(lambda s : pickle.loads(eval(s)), texts, repeat)
+	plainTime = time_per_state(str_to_tree, plain, repeat)
+	storedTime = time_per_state(str_to_tree, stored, repeat)
+	textSize = sum(len(s) for s in texts) / len(trees)
+	print(problem.name + ": " + str(len(trees)) + " trees")
+	for (name, data, t) in [("repr text:", texts, textTime), ("pickle:\t", plain, plainTime), ("compressed:", stored, storedTime)]:
+		size = sum(len(s) for s in data) / len(trees)
+		print("%s\t%d bytes (%.0f%%), %.1f us to decode (%.1fx faster)" % (name, size, 100 * size / textSize, t * 1e6, textTime / t))
+
+COPYING_BASELINE = "11c4c69" # the last revision where deepcopy went through a chain of type checks
+
+def load_from_git(revision, name):
+	"""Load one of this package's modules as it was at the given git revision, to compare against the current one"""
+	source = subprocess.check_output(["git", "show", revision + ":./" + name.replace(".", "/") + ".py"],
+		cwd=os.path.dirname(os.path.abspath(__file__)))
+	fullName = __package__ + "." + name
+	mod = types.ModuleType(fullName)
+	mod.__package__ = fullName.rsplit(".", 1)[0] # so that its relative imports find the current package
+	exec(compile(source, name + ".py@" + revision, "exec"), mod.__dict__)
+	return mod
+
+def benchmark_copying(problem, repeat=20, baseline=COPYING_BASELINE):
+	"""Compare copying each of the problem's trees with deepcopy as it was at the baseline revision (a chain of
+		type checks) against the generated copiers, and applying the changes between each state and its next state,
+		which used to copy the whole tree first and now only copies the path down to the change"""
+	states = list(State.objects.filter(problem=problem).exclude(tree_source=b""))
+	if len(states) == 0:
+		print("No trees for " + problem.name)
+		return
+	chain_deepcopy = load_from_git(baseline, "astTools").deepcopy
+	trees = [s.tree for s in states]
+	chainTime = time_per_state(chain_deepcopy, trees, repeat)
+	copierTime = time_per_state(deepcopy, trees, repeat)
+	print(problem.name + ": " + str(len(trees)) + " trees")
+	print("type checks:\t%.1f us per tree" % (chainTime * 1e6))
+	print("copiers:\t%.1f us per tree (%.1fx faster)" % (copierTime * 1e6, chainTime / copierTime))
+	changes = []
+	for s in states:
+		if s.next != None and s.next.tree != None:
+			changes += getChanges(s.tree, s.next.tree)
+	if len(changes) == 0:
+		print("No changes between states")
+		return
+	wholeTime = time_per_state(lambda cv : chain_deepcopy(cv.start), changes, repeat)
+	pathTime = time_per_state(lambda cv : cv.applyChange(), changes, repeat)
+	print(str(len(changes)) + " changes")
+	print("whole tree:\t%.1f us per change, just to copy the tree" % (wholeTime * 1e6))
+	print("path copy:\t%.1f us per change (%.1fx faster)" % (pathTime * 1e6, wholeTime / pathTime))
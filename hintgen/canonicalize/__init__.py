@@ -1,24 +1,39 @@
-import ast, copy, uuid
+import ast, copy, pickle, random
 from .transformations import *
 from ..namesets import allPythonFunctions
 from ..display import printFunction
 from ..test import test
-from ..astTools import tree_to_str, deepcopy
+from ..astTools import tree_to_str, deepcopy, treeSignature
 from ..tools import log
+from .passProfile import runPass
+from .functionCache import functionKey, getFunction, storeFunction
+
+# Fingerprint the tree after every canonicalizing pass, to count which passes change it and skip the ones with
+# nothing left to do. A fingerprint costs about as much as one of the cheaper passes, so this is slower overall.
+TRACK_PASS_CHANGES = False
+
+# Canonicalize modules of several functions one function at a time (along with the functions it uses), so that
+# functions that haven't changed since an earlier submission can be reused from the function cache.
+# This is off by default, since the canonical forms aren't always the same as canonicalizing the whole module: helpers
+# inlined into several functions have their variables numbered per function instead of across the module. Existing
+# canonical states wouldn't match the new forms, so after switching it, rebuild each problem's solution space with
+#	python manage.py canonicalize_submissions <submissions file> <problem> --clear
+CANONICALIZE_BY_FUNCTION = False
+
+NODE_ID_BITS = 24 # the low bits of an id count through the nodes of its tree
+TREE_TAG_BITS = 40 # the high bits are random, and shared by the whole tree, so that ids from different trees don't collide
+treeTags = random.SystemRandom() # drawn from the OS, since forked processes share the state of the random module
 
 def runGiveIds(a):
-	global idCounter
-	idCounter = 0
-	giveIds(a)
+	"""Give every node in the tree an integer id. Each call counts from its own random tag, so it's thread-safe."""
+	giveIds(a, [treeTags.getrandbits(TREE_TAG_BITS) << NODE_ID_BITS])
 
-idCounter = 0
-def giveIds(a):
-	global idCounter
+def giveIds(a, nextId):
 	if isinstance(a, ast.AST):
 		if type(a) in [ast.Load, ast.Store, ast.Del, ast.AugLoad, ast.AugStore, ast.Param]:
 			return # skip these
-		a.global_id = uuid.uuid1()
-		idCounter += 1
+		a.global_id = nextId[0]
+		nextId[0] += 1
 		for field in a._fields:
 			child = getattr(a, field)
 			if type(child) == list:
@@ -26,13 +41,13 @@ def giveIds(a):
 					# Get rid of aliased items
 					if hasattr(child[i], "global_id"):
 						child[i] = copy.deepcopy(child[i])
-					giveIds(child[i])
+					giveIds(child[i], nextId)
 			else:
 				# Get rid of aliased items
 				if hasattr(child, "global_id"):
 					child = copy.deepcopy(child)
 					setattr(a, field, child)
-				giveIds(child)
+				giveIds(child, nextId)
 
 # def exists(d):
 # 	for k in d:
@@ -161,6 +176,123 @@ def stateDiff(s, funName):
 		log(printFunction(s.tree), "bug")
 		log(printFunction(s.orig_tree), "bug")
 
+def runToFixpoint(s, passes):
+	"""Apply the (name, transformation) passes to s.tree in rounds, until a whole round leaves it unchanged.
+		Rounds are compared by signature, so the tree never needs to be copied. With TRACK_PASS_CHANGES, every
+		pass is checked, and a pass is skipped when the tree is the same as the last one it left alone.
+		Returns counters for the run: { "iterations" : rounds, "passes" : { name : [applications, changes] } },
+		where changes are only counted with TRACK_PASS_CHANGES."""
+	stats = { "iterations" : 0, "passes" : { name : [0, 0] for (name, t) in passes } }
+	signature = treeSignature(s.tree)
+	roundStarts = set()
+	quietOn = { } # pass name -> the signature of the last tree it left alone
+	clean = set() # the passes that have left the current tree alone
+	# Stop once a round ends where this one (or an earlier one) started, or once every pass is done with the tree
+	while signature not in roundStarts and len(clean) < len(passes):
+		roundStarts.add(signature)
+		stats["iterations"] += 1
+		for (name, t) in passes:
+			counts = stats["passes"][name]
+			if TRACK_PASS_CHANGES and quietOn.get(name) == signature:
+				clean.add(name)
+				continue
+			s.tree = runPass(s.problem.name, name, t, s.tree) # modify in place
+			stateDiff(s, name)
+			counts[0] += 1
+			if TRACK_PASS_CHANGES:
+				newSignature = treeSignature(s.tree)
+				if newSignature == signature:
+					quietOn[name] = signature
+					clean.add(name)
+					if len(clean) == len(passes):
+						break
+				else:
+					counts[1] += 1
+					signature = newSignature
+					clean = set()
+		if not TRACK_PASS_CHANGES:
+			signature = treeSignature(s.tree)
+	return stats
+
+def functionUnits(a):
+	"""Split a module into units, one for each function: the function along with the functions it uses, directly
+		or not, in module order. Returns (units, uses), where uses maps each function's name to the names of the
+		other functions it uses, or None if the module has fewer than two functions or anything besides functions and imports."""
+	functions = [item for item in a.body if type(item) == ast.FunctionDef]
+	names = [f.name for f in functions]
+	if len(functions) < 2 or len(set(names)) < len(names):
+		return None
+	for item in a.body:
+		if type(item) not in [ast.FunctionDef, ast.Import, ast.ImportFrom]:
+			return None
+
+	uses = { }
+	for f in functions:
+		namesUsed = set([node.id for node in ast.walk(f) if type(node) == ast.Name])
+		uses[f.name] = [name for name in names if name != f.name and name in namesUsed]
+	units = []
+	for f in functions:
+		unitNames = set([f.name])
+		toVisit = [f.name]
+		while len(toVisit) > 0:
+			for name in uses[toVisit.pop()]:
+				if name not in unitNames:
+					unitNames.add(name)
+					toVisit.append(name)
+		units.append((f, [g for g in functions if g.name in unitNames]))
+	return (units, uses)
+
+def canonicalizeByFunction(s, passes, given_names, argTypes, imports):
+	"""Canonicalize each function in s.tree in a module of its own, along with the functions it uses, and reuse
+		the canonical functions we've already made. Helpers that end up folded into every function that used them
+		are dropped, as helperFolding would. Returns the counters as runToFixpoint does, summed over the functions
+		that had to be canonicalized, plus "functions" : [canonicalized, reused]; or None if the module can't be split up."""
+	split = functionUnits(s.tree)
+	if split == None:
+		return None
+	(units, uses) = split
+	module = s.tree
+	others = [item for item in module.body if type(item) != ast.FunctionDef]
+	stats = { "iterations" : 0, "passes" : { name : [0, 0] for (name, t) in passes }, "functions" : [0, 0] }
+	canonical = { }
+	for (f, unit) in units:
+		key = functionKey(f.name, unit, s.problem.name, given_names, argTypes, imports)
+		fun = getFunction(key, unit)
+		if fun != None:
+			stats["functions"][1] += 1
+		else:
+			# Work on a copy, since the functions are shared between units
+			s.tree = ast.Module(pickle.loads(pickle.dumps(others + unit)))
+			try:
+				unitStats = runToFixpoint(s, passes)
+			finally:
+				unitModule = s.tree
+				s.tree = module
+			funs = [item for item in unitModule.body if type(item) == ast.FunctionDef and item.name == f.name]
+			if len(funs) != 1:
+				return None # folded into a function that it uses, so it has to be done along with the whole module
+			fun = funs[0]
+			storeFunction(key, unit, fun)
+			stats["functions"][0] += 1
+			stats["iterations"] = max(stats["iterations"], unitStats["iterations"])
+			for name in unitStats["passes"]:
+				for i in range(2):
+					stats["passes"][name][i] += unitStats["passes"][name][i]
+		canonical[f.name] = fun
+
+	body = []
+	for item in module.body:
+		if type(item) != ast.FunctionDef:
+			body.append(item)
+			continue
+		users = [name for name in uses if item.name in uses[name]]
+		if item.name != s.problem.name and len(users) > 0 and \
+				all(countVariables(canonical[name], item.name) == 0 for name in users):
+			continue # folded into everything that used it
+		body.append(canonical[item.name])
+	module.body = body
+	return stats
+
 def getCanonicalForm(s, given_names=None, argTypes=None, imports=None):
 	#s.tree = deepcopy(s.tree) # no shallow copying! We need to leave the old tree alone
 
@@ -195,20 +327,21 @@ def getCanonicalForm(s, given_names=None, argTypes=None, imports=None):
 				deadCodeRemoval
 				]
 
-	s.tree = propogateMetadata(s.tree, argTypes, {}, [0])
+	s.tree = runPass(s.problem.name, "propogateMetadata", propogateMetadata, s.tree, argTypes, {}, [0])
 	stateDiff(s, "propogateMetadata")
-	s.tree = simplify(s.tree)
+	s.tree = runPass(s.problem.name, "simplify", simplify, s.tree)
 	stateDiff(s, "simplify")
-	s.tree = anonymizeNames(s.tree, given_names, imports)
+	s.tree = runPass(s.problem.name, "anonymizeNames", anonymizeNames, s.tree, given_names, imports)
 	stateDiff(s, "anonymizeNames")
-	oldTree = None
-	while compareASTs(oldTree, s.tree, checkEquality=True) != 0:
-		oldTree = deepcopy(s.tree)
-		helperFolding(s.tree, s.problem.name, imports)
-		stateDiff(s, "helperFolding")
-		for t in transformations:
-			s.tree = t(s.tree) # modify in place
-			stateDiff(s, str(t).split()[1])
+	def foldHelpers(a):
+		helperFolding(a, s.problem.name, imports) # modifies in place
+		return a
+	passes = [("helperFolding", foldHelpers)] + [(str(t).split()[1], t) for t in transformations]
+	s.canonical_stats = None
+	if CANONICALIZE_BY_FUNCTION:
+		s.canonical_stats = canonicalizeByFunction(s, passes, given_names, argTypes, imports)
+	if s.canonical_stats == None:
+		s.canonical_stats = runToFixpoint(s, passes)
 	s.code = printFunction(s.tree)
 	s.score = orig_score
 	s.feedback = orig_feedback
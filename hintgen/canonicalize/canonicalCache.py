@@ -0,0 +1,117 @@
+"""A memo of canonical forms, so that code we've already canonicalized skips the whole transformation pipeline.
+Canonicalizing only depends on the anonymized code, the problem (its arguments and given code) and the imports,
+so entries are keyed on a hash of those. The canonical tree still refers to the original tree it was made from
+(by id, variable name, and location), so that is stored as well, and used to move the canonical tree's metadata
+onto the new original tree when the memo is used."""
+import ast, hashlib, pickle, threading
+from collections import OrderedDict
+from ..astTools import tree_to_str, tree_pickle, str_to_tree
+from ..tools import log
+from ..models import CanonicalMemo
+
+CANONICAL_CACHE_SIZE = 1000 # the number of canonical forms kept in memory
+PERSIST_CANONICAL = True # also keep canonical forms in the database, so they survive restarts
+CANONICAL_VERSION = "2" # change this whenever the transformations change, so that old canonical forms are ignored
+
+ID_ATTRIBUTES = ["global_id", "second_global_id", "variableGlobalId", "moved_line"] # metadata that holds the ids of original nodes
+
+canonicalCache = OrderedDict()
+canonicalLock = threading.Lock()
+
+def canonicalKey(anonCode, problem, args, imports):
+	from . import CANONICALIZE_BY_FUNCTION # read when it's used, since it can be switched after this module is loaded
+	mode = "by function" if CANONICALIZE_BY_FUNCTION else "whole module" # the two can give different canonical forms
+	h = hashlib.sha256()
+	for field in [CANONICAL_VERSION, mode, str(problem.id), problem.given_code, repr(args)] + [ast.dump(i) for i in imports] + [anonCode]:
+		h.update(field.encode("utf-8"))
+		h.update(b"\0")
+	return h.hexdigest()
+
+def nodeName(a):
+	if type(a) == ast.Name:
+		return a.id
+	elif type(a) == ast.arg:
+		return a.arg
+	elif type(a) in [ast.FunctionDef, ast.ClassDef]:
+		return a.name
+	return None
+
+def mapOntoTree(tree, oldOrig, newOrig, nameOf=nodeName):
+	"""Move the canonical tree's metadata (ids, original variable names, and locations) from the original tree
+		it was made from onto a new original tree with the same shape. Returns False if the trees don't line up.
+		nameOf gives the original variable name at a node of the original trees."""
+	oldNodes = list(ast.walk(oldOrig))
+	newNodes = list(ast.walk(newOrig))
+	if len(oldNodes) != len(newNodes):
+		return False
+	ids, names, locations = { }, { }, { }
+	for (old, new) in zip(oldNodes, newNodes):
+		if type(old) != type(new):
+			return False
+		if hasattr(old, "global_id"):
+			ids[old.global_id] = getattr(new, "global_id", None)
+		oldName = nameOf(old)
+		if oldName != None and names.setdefault(oldName, nameOf(new)) != nameOf(new):
+			return False # one old variable is several new ones, so the names can't be mapped
+		if hasattr(old, "lineno") and hasattr(new, "lineno"):
+			locations.setdefault((old.lineno, old.col_offset), (new.lineno, new.col_offset))
+	seen = set()
+	for node in ast.walk(tree):
+		if id(node) in seen:
+			continue # canonical trees can share nodes, and these must only be moved once
+		seen.add(id(node))
+		for attr in ID_ATTRIBUTES:
+			value = getattr(node, attr, None)
+			if value != None:
+				if value not in ids:
+					return False
+				setattr(node, attr, ids[value])
+		if hasattr(node, "originalId") and node.originalId in names:
+			node.originalId = names[node.originalId]
+		if hasattr(node, "lineno") and (node.lineno, node.col_offset) in locations:
+			(node.lineno, node.col_offset) = locations[(node.lineno, node.col_offset)]
+	return True
+
+def getCanonical(key, orig_tree):
+	"""Look up a canonical form, first in memory, then in the database. Returns (tree, code), with the tree's
+		metadata moved onto orig_tree, or None on a miss."""
+	with canonicalLock:
+		entry = canonicalCache.get(key)
+		if entry != None:
+			canonicalCache.move_to_end(key)
+	if entry == None and PERSIST_CANONICAL:
+		try:
+			row = CanonicalMemo.objects.filter(key=key).first()
+		except Exception as e:
+			log("canonicalCache\tgetCanonical\tCould not read canonical form: " + str(e), "bug")
+			row = None
+		if row != None:
+			entry = (tree_pickle(row.tree_source), str_to_tree(row.orig_tree_source), row.code)
+			remember(key, *entry)
+	if entry == None:
+		return None
+	(treeData, oldOrig, code) = entry
+	tree = pickle.loads(treeData) # a fresh copy, metadata and all
+	if not mapOntoTree(tree, oldOrig, orig_tree):
+		return None
+	return tree, code
+
+def storeCanonical(key, problem, orig_tree, tree, code):
+	"""Remember the canonical tree and code made from orig_tree"""
+	orig_tree = pickle.loads(pickle.dumps(orig_tree)) # our own copy, so later changes to the state don't leak in
+	treeData = pickle.dumps(tree)
+	remember(key, treeData, orig_tree, code)
+	if not PERSIST_CANONICAL:
+		return
+	try:
+		CanonicalMemo.objects.get_or_create(key=key, defaults={ "problem" : problem, "code" : code,
+			"tree_source" : tree_to_str(tree), "orig_tree_source" : tree_to_str(orig_tree) })
+	except Exception as e: # most likely another process stored the same canonical form first
+		log("canonicalCache\tstoreCanonical\tCould not save canonical form: " + str(e), "bug")
+
+def remember(key, treeData, orig_tree, code):
+	with canonicalLock:
+		canonicalCache[key] = (treeData, orig_tree, code)
+		canonicalCache.move_to_end(key)
+		while len(canonicalCache) > CANONICAL_CACHE_SIZE:
+			canonicalCache.popitem(last=False)
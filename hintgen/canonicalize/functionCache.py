@@ -0,0 +1,49 @@
+"""A cache of canonicalized functions, so that when a submission changes only some of its functions, the rest don't
+get canonicalized again. Each function is canonicalized along with the functions it uses (which may be folded into it),
+so entries are keyed on a hash of all of those functions, after anonymizing, along with everything else that
+canonicalizing depends on. Like the canonical memo, entries keep the functions they were made from, so that the
+canonical function's metadata can be moved onto the functions it's used for."""
+import ast, hashlib, pickle, threading
+from collections import OrderedDict
+from .canonicalCache import CANONICAL_VERSION, mapOntoTree
+
+FUNCTION_CACHE_SIZE = 5000 # the number of canonical functions kept in memory
+
+functionCache = OrderedDict()
+functionLock = threading.Lock()
+
+def functionKey(name, unit, mainFun, given_names, args, imports):
+	"""The key for canonicalizing the named function, where unit holds it and the functions it uses, in module order"""
+	h = hashlib.sha256()
+	for field in [CANONICAL_VERSION, name, mainFun, repr(given_names), repr(args)] + [ast.dump(i) for i in imports] + [ast.dump(f) for f in unit]:
+		h.update(field.encode("utf-8"))
+		h.update(b"\0")
+	return h.hexdigest()
+
+def originalName(a):
+	return getattr(a, "originalId", None)
+
+def getFunction(key, unit):
+	"""Look up a canonical function, with its metadata moved onto unit. Returns None on a miss."""
+	with functionLock:
+		entry = functionCache.get(key)
+		if entry == None:
+			return None
+		functionCache.move_to_end(key)
+	(funData, oldUnit) = entry
+	fun = pickle.loads(funData) # a fresh copy, metadata and all
+	if not mapOntoTree(fun, ast.Module(oldUnit), ast.Module(unit), nameOf=originalName):
+		return None
+	return fun
+
+def storeFunction(key, unit, fun):
+	"""Remember the canonical function made from unit, which shouldn't be changed afterwards"""
+	with functionLock:
+		functionCache[key] = (pickle.dumps(fun), unit)
+		functionCache.move_to_end(key)
+		while len(functionCache) > FUNCTION_CACHE_SIZE:
+			functionCache.popitem(last=False)
+
+def clearFunctions():
+	with functionLock:
+		functionCache.clear()
@@ -0,0 +1,53 @@
+"""Optional profiling for the canonicalizing passes. With PROFILE_PASSES on, every pass records how often it ran,
+how long it took, and how often it changed the code (changes to metadata alone don't count), gathered per problem,
+so that we can see which of the transformations pay for themselves. exportPassProfiles writes the numbers out."""
+import threading, time
+from ..astTools import treeSignature
+from ..paths import LOG_PATH
+
+PROFILE_PASSES = False # this fingerprints the tree before and after every pass, so leave it off in production
+
+passProfiles = { } # problem name -> pass name -> [invocations, seconds, changes]
+profileLock = threading.Lock()
+
+def runPass(problemName, passName, f, a, *args):
+	"""Apply the pass f to the tree a (along with any other arguments) and return the result,
+		recording it in the problem's profile if PROFILE_PASSES is on"""
+	if not PROFILE_PASSES:
+		return f(a, *args)
+	before = treeSignature(a) # passes modify the tree in place, so this has to come first
+	start = time.perf_counter()
+	result = f(a, *args)
+	elapsed = time.perf_counter() - start
+	changed = treeSignature(result) != before
+	with profileLock:
+		counts = passProfiles.setdefault(problemName, { }).setdefault(passName, [0, 0.0, 0])
+		counts[0] += 1
+		counts[1] += elapsed
+		if changed:
+			counts[2] += 1
+	return result
+
+def getPassProfiles():
+	"""A copy of the profiles gathered so far"""
+	with profileLock:
+		return { problem : { name : list(counts) for (name, counts) in passProfiles[problem].items() } for problem in passProfiles }
+
+def clearPassProfiles():
+	with profileLock:
+		passProfiles.clear()
+
+def exportPassProfiles(filename=None):
+	"""Write the profiles to a csv file (by default, pass_profile.csv in the log folder), one line per problem and pass"""
+	if filename == None:
+		filename = LOG_PATH + "pass_profile.csv"
+	profiles = getPassProfiles()
+	results = "problem,pass,invocations,seconds,changes,ms per invocation,change rate\n"
+	for problem in sorted(profiles):
+		for name in sorted(profiles[problem], key=lambda n : -profiles[problem][n][1]): # slowest first
+			(invocations, seconds, changes) = profiles[problem][name]
+			results += problem + "," + name + "," + str(invocations) + "," + "%.6f" % seconds + "," + str(changes) + "," + \
+						"%.3f" % (1000 * seconds / invocations) + "," + "%.3f" % (changes / invocations) + "\n"
+	with open(filename, "w") as f:
+		f.write(results)
+	return filename
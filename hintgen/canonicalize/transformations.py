@@ -1,4 +1,5 @@
-import ast, copy, functools
+import ast, copy, functools, threading
+from collections import OrderedDict
 from ..tools import log
 from ..namesets import *
 from ..astTools import *
@@ -791,17 +792,60 @@ def propogateMetadata(a, argTypes, variableMap, idNum):
 
 ### SIMPLIFYING FUNCTIONS ###
 
-def applyTransferLambda(x):
-	"""Simplify an expression by applying constant folding, re-formatting to an AST, and then tranferring the metadata appropriately."""
-	if x == None:
+FOLD_CACHE_SIZE = 10000 # the number of constant operations whose results are kept in memory
+FOLD_KEY_LIMIT = 200 # operands with longer reprs than this aren't remembered, so that the keys stay small
+
+# Constant subexpressions come up again on every pass over the tree, and in every submission that uses them, so the
+# results of evaluating them are remembered here, keyed by the operation and the constants it's applied to.
+foldCache = OrderedDict()
+foldLock = threading.Lock()
+foldFailed = object() # the result of an operation that crashed
+
+def foldOperation(f, op, l, r):
+	"""f(op, l, r), where f is doBinaryOp or doCompare and l and r are constants. Raises an exception if f does."""
+	lKey, rKey = repr(l), repr(r) # unlike the values, these tell 0.0 from -0.0
+	if len(lKey) > FOLD_KEY_LIMIT or len(rKey) > FOLD_KEY_LIMIT:
+		return f(op, l, r)
+	key = (f.__name__, type(op), type(l), lKey, type(r), rKey)
+	with foldLock:
+		result = foldCache.get(key)
+		if result != None:
+			foldCache.move_to_end(key)
+	if result == None:
+		try:
+			result = (f(op, l, r),)
+		except Exception as e:
+			result = foldFailed
+		if result == foldFailed or type(result[0]) in [bool, int, float, complex, str, bytes]:
+			with foldLock:
+				foldCache[key] = result
+				while len(foldCache) > FOLD_CACHE_SIZE:
+					foldCache.popitem(last=False)
+	if result == foldFailed:
+		raise Exception("Constant operation crashed")
+	return result[0]
+
+def refold(x, val):
+	"""Turn val, the result of folding x, back into an AST with x's metadata. The constants that folding makes are
+		marked as folded; they fold to themselves, so later passes can keep them instead of making them again."""
+	if getattr(x, "folded", False):
 		return x
-	tmp = astFormat(constantFolding(x))
-	if hasattr(tmp, "global_id") and hasattr(x, "global_id") and tmp.global_id != x.global_id:
-		return tmp # don't do the transfer, this already has its own metadata
-	else:
+	tmp = astFormat(val)
+	if tmp is not x: # otherwise it was folded in place, so the metadata is already there
 		transferMetaData(x, tmp)
+		if not isinstance(val, ast.AST) and type(tmp) in [ast.Num, ast.Str, ast.Bytes, ast.NameConstant]:
+			tmp.folded = True
 	return tmp
 
+def applyTransferLambda(x):
+	"""Simplify an expression by applying constant folding, re-formatting to an AST, and then tranferring the metadata appropriately."""
+	if x == None or getattr(x, "folded", False):
+		return x
+	val = constantFolding(x)
+	if hasattr(val, "global_id") and hasattr(x, "global_id") and val.global_id != x.global_id:
+		return val # don't do the transfer, this already has its own metadata
+	return refold(x, val)
+
 def constantFolding(a):
 	"""In constant folding, we evaluate all constant expressions instead of doing operations at runtime"""
 	if not isinstance(a, ast.AST):
@@ -875,12 +919,13 @@ def constantFolding(a):
 			return a
 		if type(l) in builtInTypes and type(r) in builtInTypes:
 			try:
-				val = doBinaryOp(a.op, l, r)
+				val = foldOperation(doBinaryOp, a.op, l, r)
 				if type(val) == float and val % 0.0001 != 0: # don't deal with trailing floats
 					pass
 				else:
 					tmp = astFormat(val)
 					transferMetaData(a, tmp)
+					tmp.folded = True
 					return tmp
 			except:
 				# We have some kind of divide-by-zero issue.
@@ -894,7 +939,7 @@ def constantFolding(a):
 				rLeft = constantFolding(r.left)
 				if type(rLeft) in builtInTypes:
 					try:
-						newLeft = astFormat(doBinaryOp(a.op, l, rLeft))
+						newLeft = astFormat(foldOperation(doBinaryOp, a.op, l, rLeft))
 						transferMetaData(r.left, newLeft)
 						return ast.BinOp(newLeft, a.op, r.right)
 					except Exception as e:
@@ -983,12 +1028,9 @@ def constantFolding(a):
 		b = constantFolding(a.body)
 		o = constantFolding(a.orelse)
 
-		aTest = astFormat(test)
-		transferMetaData(a.test, aTest)
-		aB = astFormat(b)
-		transferMetaData(a.body, aB)
-		aO = astFormat(o)
-		transferMetaData(a.orelse, aO)
+		aTest = refold(a.test, test)
+		aB = refold(a.body, b)
+		aO = refold(a.orelse, o)
 
 		if type(test) == bool:
 			return aB if test else aO # evaluate the if expression now
@@ -1006,27 +1048,27 @@ def constantFolding(a):
 		r = constantFolding(a.comparators[0])
 		# Hack to make hint chaining work- don't constant-fold filler strings!
 		if containsTokenStepString(l) or containsTokenStepString(r):
-			tmpLeft = astFormat(l)
-			transferMetaData(a.left, tmpLeft)
-			a.left = tmpLeft
-			tmpRight = astFormat(r)
-			transferMetaData(a.comparators[0], tmpRight)
-			a.comparators = [tmpRight]
+			a.left = refold(a.left, l)
+			a.comparators = [refold(a.comparators[0], r)]
 			return a
 		# Check whether the two sides are the same
 		comp = compareASTs(l, r, checkEquality=True) == 0
 		if comp and (not couldCrash(l)) and type(op) in [ast.Lt, ast.Gt, ast.NotEq]:
 			tmp = ast.NameConstant(False)
 			transferMetaData(a, tmp)
+			tmp.folded = True
 			return tmp
 		elif comp and (not couldCrash(l)) and type(op) in [ast.Eq, ast.LtE, ast.GtE]:
 			tmp = ast.NameConstant(True)
 			transferMetaData(a, tmp)
+			tmp.folded = True
 			return tmp
 		if (type(l) in builtInTypes) and (type(r) in builtInTypes):
 			try:
-				result = astFormat(doCompare(op, l, r))
+				result = astFormat(foldOperation(doCompare, op, l, r))
 				transferMetaData(a, result)
+				if type(result) in [ast.Num, ast.Str, ast.Bytes, ast.NameConstant]:
+					result.folded = True
 				return result
 			except:
 				pass
@@ -1075,12 +1117,8 @@ def constantFolding(a):
 					transferMetaData(a.comparators[0], tmpRight)
 					a.comparators = [tmpRight]
 					return constantFolding(a)
-		tmpLeft = astFormat(l)
-		transferMetaData(a.left, tmpLeft)
-		a.left = tmpLeft
-		tmpRight = astFormat(r)
-		transferMetaData(a.comparators[0], tmpRight)
-		a.comparators = [tmpRight]
+		a.left = refold(a.left, l)
+		a.comparators = [refold(a.comparators[0], r)]
 		return a
 	elif t == ast.Call:
 		# TODO: this can be done much better
@@ -1105,9 +1143,7 @@ def constantFolding(a):
 				#log("transformations\tconstantFolding\tFunction crashed: " + str(a.func.id), "bug")
 				pass
 		for i in range(len(a.args)):
-			tmpArg = astFormat(tmpArgs[i])
-			transferMetaData(a.args[i], tmpArg)
-			a.args[i] = tmpArg
+			a.args[i] = refold(a.args[i], tmpArgs[i])
 		return a
 	# This needs to be separate because the attribute is a string
 	elif t == ast.Attribute:
@@ -1172,6 +1208,102 @@ def isMutatingFunction(a):
 	# TODO: deal with student's functions
 	return funName not in funDict
 
+# copyPropagation and deadCodeRemoval (through propagateValues and clearBlockVars) keep asking which variables a piece
+# of code uses and which ones it overwrites. While one of them runs, the answers are kept here by node, so nested blocks
+# and live values aren't walked again and again. The pass forgets a node whenever it changes it.
+dataflow = threading.local()
+
+def withDataflowCache(f):
+	"""Give the pass f a def-use cache, shared by everything it calls and thrown away when it's done"""
+	@functools.wraps(f)
+	def cachedPass(*args, **kwargs):
+		if getattr(dataflow, "cache", None) != None:
+			return f(*args, **kwargs) # already in a pass
+		dataflow.cache = { }
+		try:
+			return f(*args, **kwargs)
+		finally:
+			dataflow.cache = None
+	return cachedPass
+
+def dataflowEntry(a):
+	"""The cache entry for a, [a, variables used, names used, names killed], where None means not worked out yet.
+		Returns None when no pass is running (and for Names, which are cheaper to look at than to cache)."""
+	cache = getattr(dataflow, "cache", None)
+	if cache == None or type(a) == ast.Name:
+		return None
+	if id(a) not in cache:
+		cache[id(a)] = [a, None, None, None] # keep a, so that its id can't be reused
+	return cache[id(a)]
+
+def forgetDataflow(a):
+	"""a has been changed in place, so whatever we knew about it is out of date"""
+	cache = getattr(dataflow, "cache", None)
+	if cache != None:
+		cache.pop(id(a), None)
+
+def variableNamesUsed(a):
+	"""The set of allVariableNamesUsed(a)"""
+	entry = dataflowEntry(a) if isinstance(a, ast.AST) else None
+	if entry == None:
+		return set(allVariableNamesUsed(a))
+	if entry[2] == None:
+		entry[2] = frozenset(v.id for v in allVariablesUsed(a))
+	return entry[2]
+
+def namesKilled(a):
+	"""The names of the variables that running a might overwrite or mutate, as used by clearBlockVars"""
+	if not isinstance(a, ast.AST):
+		return frozenset()
+	entry = dataflowEntry(a)
+	if entry != None and entry[3] != None:
+		return entry[3]
+
+	killed = set()
+	if type(a) in [ast.Assign, ast.AugAssign]:
+		if type(a) == ast.Assign:
+			targets = gatherAssignedVars(a.targets)
+		else:
+			targets = gatherAssignedVars([a.target])
+		for target in targets:
+			if type(target) == ast.Name:
+				killed.add(target.id)
+			elif type(target.value) == ast.Name:
+				killed.add(target.value.id)
+	elif type(a) == ast.Call and hasMutatingFunction(a):
+		for v in allVariablesUsed(a):
+			if eventualType(v) not in [int, float, bool, str]:
+				killed.add(v.id)
+	else:
+		if type(a) == ast.For:
+			if type(a.target) == ast.Name:
+				killed.add(a.target.id)
+			elif type(a.target) in [ast.Tuple, ast.List]:
+				for elt in a.target.elts:
+					if type(elt) == ast.Name:
+						killed.add(elt.id)
+					elif type(elt) == ast.Subscript:
+						if type(elt.value) == ast.Name:
+							killed.add(elt.value.id)
+						else:
+							log("transformations\tclearBlockVars\tFor target subscript not a name: " + str(type(elt.value)), "bug")
+					else:
+						log("transformations\tclearBlockVars\tFor target not a name: " + str(type(elt)), "bug")
+			elif type(a.target) == ast.Subscript:
+				if type(a.target.value) == ast.Name:
+					killed.add(a.target.value.id)
+				else:
+					log("transformations\tclearBlockVars\tFor target subscript not a name: " + str(type(a.target.value)), "bug")
+			else:
+				log("transformations\tclearBlockVars\tFor target not a name: " + str(type(a.target)), "bug")
+		for child in ast.iter_child_nodes(a):
+			killed |= namesKilled(child)
+
+	killed = frozenset(killed)
+	if entry != None:
+		entry[3] = killed
+	return killed
+
 def allVariablesUsed(a):
 	if not isinstance(a, ast.AST):
 		return []
@@ -1243,7 +1375,7 @@ def propagateValues(a, liveVars):
 						del liveVars[var.id]
 					currentLiveVars = list(liveVars.keys())
 					for liveVar in currentLiveVars:
-						varsWithin = allVariableNamesUsed(liveVars[liveVar])
+						varsWithin = variableNamesUsed(liveVars[liveVar])
 						if var.id in varsWithin:
 							del liveVars[liveVar]
 			return a
@@ -1253,12 +1385,14 @@ def propagateValues(a, liveVars):
 			# because it will cause a compiler error instead of a runtime error
 			a.args = propagateValues(a.args, liveVars)
 			a.keywords = propagateValues(a.keywords, liveVars)
+			forgetDataflow(a)
 			return a
 	elif type(a) == ast.Attribute:
 		if type(a.value) == ast.Name and a.value.id in liveVars and \
 				eventualType(liveVars[a.value.id]) in [int, float, complex, bytes, bool, type(None)]:
 			# Don't move for the same reason as above
 			return a
+	forgetDataflow(a)
 	return applyToChildren(a, lambda x: propagateValues(x, liveVars))
 
 def hasMutatingFunction(a):
@@ -1276,72 +1410,14 @@ def clearBlockVars(a, liveVars):
 	if (not isinstance(a, ast.AST)) or len(liveVars.keys()) == 0:
 		return
 
-	if type(a) in [ast.Assign, ast.AugAssign]:
-		if type(a) == ast.Assign:
-			targets = gatherAssignedVars(a.targets)
-		else:
-			targets = gatherAssignedVars([a.target])
-		for target in targets:
-			varId = None
-			if type(target) == ast.Name:
-				varId = target.id
-			elif type(target.value) == ast.Name:
-				varId = target.value.id
-			if varId in liveVars:
-				del liveVars[varId]
-
-			liveKeys = list(liveVars.keys())
-			for var in liveKeys:
-				# Remove the variable and any variables in which it is used
-				if varId in allVariableNamesUsed(liveVars[var]):
-					del liveVars[var]
-		return
-	elif type(a) == ast.Call:
-		if hasMutatingFunction(a):
-			for v in allVariablesUsed(a):
-				if eventualType(v) not in [int, float, bool, str]:
-					if v.id in liveVars:
-						del liveVars[v.id]
-					liveKeys = list(liveVars.keys())
-					for var in liveKeys:
-						if v.id in allVariableNamesUsed(liveVars[var]):
-							del liveVars[var]
-			return
-	elif type(a) == ast.For:
-		names = []
-		if type(a.target) == ast.Name:
-			names = [a.target.id]
-		elif type(a.target) in [ast.Tuple, ast.List]:
-			for elt in a.target.elts:
-				if type(elt) == ast.Name:
-					names.append(elt.id)
-				elif type(elt) == ast.Subscript:
-					if type(elt.value) == ast.Name:
-						names.append(elt.value.id)
-					else:
-						log("transformations\tclearBlockVars\tFor target subscript not a name: " + str(type(elt.value)), "bug")
-				else:
-					log("transformations\tclearBlockVars\tFor target not a name: " + str(type(elt)), "bug")
-		elif type(a.target) == ast.Subscript:
-			if type(a.target.value) == ast.Name:
-				names.append(a.target.value.id)
-			else:
-				log("transformations\tclearBlockVars\tFor target subscript not a name: " + str(type(a.target.value)), "bug")
-		else:
-			log("transformations\tclearBlockVars\tFor target not a name: " + str(type(a.target)), "bug")
-		for name in names:
-			if name in liveVars:
-				del liveVars[name]
-
-			liveKeys = list(liveVars.keys())
-			for var in liveKeys:
-				# Remove the variable and any variables in which it is used
-				if name in allVariableNamesUsed(liveVars[var]):
-					del liveVars[var]
-
-	for child in ast.iter_child_nodes(a):
-		clearBlockVars(child, liveVars)
+	killed = namesKilled(a)
+	liveKeys = list(liveVars.keys())
+	for var in liveKeys:
+		# Remove the variable and any variables in which it is used
+		if var in killed or not killed.isdisjoint(variableNamesUsed(liveVars[var])):
+			del liveVars[var]
 
+@withDataflowCache
 def copyPropagation(a, liveVars=None, inLoop=False):
 	"""Propagate variables into the tree, when possible"""
 	if liveVars == None:
@@ -1358,7 +1434,7 @@ def copyPropagation(a, liveVars=None, inLoop=False):
 		while i < len(a):
 			deleteLine = False
 			if type(a[i]) == ast.FunctionDef:
-				a[i].body = copyPropagation(a[i].body, liveVars=copy.deepcopy(liveVars))
+				a[i].body = copyPropagation(a[i].body, liveVars=dict(liveVars))
 			elif type(a[i]) == ast.ClassDef:
 				# TODO: can we propagate values through everything after here?
 				for j in range(len(a[i].body)):
@@ -1389,7 +1465,7 @@ def copyPropagation(a, liveVars=None, inLoop=False):
 					liveKeys = list(liveVars.keys())
 					for var in liveKeys:
 						# If the var we're replacing was used elsewhere, that value will no longer be the same
-						if varId in allVariableNamesUsed(liveVars[var]):
+						if varId in variableNamesUsed(liveVars[var]):
 							del liveVars[var]
 				elif type(target) in [ast.Tuple, ast.List]:
 					# Copy the values, if we can match them
@@ -1413,7 +1489,7 @@ def copyPropagation(a, liveVars=None, inLoop=False):
 
 							liveKeys = list(liveVars.keys())
 							for var in liveKeys:
-								if varId in allVariableNamesUsed(liveVars[var]):
+								if varId in variableNamesUsed(liveVars[var]):
 									del liveVars[var]
 						else:
 							log("transformations\tcopyPropagation\tWeird assign type: " + str(type(e)), "bug")
@@ -1428,6 +1504,7 @@ def copyPropagation(a, liveVars=None, inLoop=False):
 				if type(a[i].iter) != ast.Name: # if it IS a name, don't replace it!
 					# Otherwise, we propagate first since this is evaluated once
 					a[i].iter = propagateValues(a[i].iter, liveVars)
+					forgetDataflow(a[i])
 
 				# We reset the target variable, so reset the live vars
 				names = []
@@ -1455,22 +1532,22 @@ def copyPropagation(a, liveVars=None, inLoop=False):
 				for name in names:
 					liveKeys = list(liveVars.keys())
 					for var in liveKeys:
-						if name in allVariableNamesUsed(liveVars[var]):
+						if name in variableNamesUsed(liveVars[var]):
 							del liveVars[var]
 					if name in liveVars:
 						del liveVars[name]
 				clearBlockVars(a[i], liveVars)
-				a[i].body = copyPropagation(a[i].body, copy.deepcopy(liveVars), inLoop=True)
-				a[i].orelse = copyPropagation(a[i].orelse, copy.deepcopy(liveVars), inLoop=True)
+				a[i].body = copyPropagation(a[i].body, dict(liveVars), inLoop=True)
+				a[i].orelse = copyPropagation(a[i].orelse, dict(liveVars), inLoop=True)
 			elif type(a[i]) == ast.While:
 				clearBlockVars(a[i], liveVars)
 				a[i].test = propagateValues(a[i].test, liveVars)
-				a[i].body = copyPropagation(a[i].body, copy.deepcopy(liveVars), inLoop=True)
-				a[i].orelse = copyPropagation(a[i].orelse, copy.deepcopy(liveVars), inLoop=True)
+				a[i].body = copyPropagation(a[i].body, dict(liveVars), inLoop=True)
+				a[i].orelse = copyPropagation(a[i].orelse, dict(liveVars), inLoop=True)
 			elif type(a[i]) == ast.If:
 				a[i].test = propagateValues(a[i].test, liveVars)
-				liveVars1 = copy.deepcopy(liveVars)
-				liveVars2 = copy.deepcopy(liveVars)
+				liveVars1 = dict(liveVars)
+				liveVars2 = dict(liveVars)
 				a[i].body = copyPropagation(a[i].body, liveVars1)
 				a[i].orelse = copyPropagation(a[i].orelse, liveVars2)
 				liveVars.clear()
@@ -1499,12 +1576,14 @@ def copyPropagation(a, liveVars=None, inLoop=False):
 				pass
 			else:
 				log("transformations\tcopyPropagation\tNot implemented: " + str(type(a[i])), "bug")
+			forgetDataflow(a[i]) # its parts may have been replaced
 			i += 1
 		return a
 	else:
 		log("transformations\tcopyPropagation\tNot a list: " + str(type(a)), "bug")
 		return a
 
+@withDataflowCache
 def deadCodeRemoval(a, liveVars=None, keepPrints=True, inLoop=False):
 	"""Remove any code which will not be reached or used."""
 	"""LiveVars keeps track of the variables that will be necessary"""
@@ -1563,38 +1642,39 @@ def deadCodeRemoval(a, liveVars=None, keepPrints=True, inLoop=False):
 				a = a[:i+1]
 				# Replace the variables
 				liveVars.clear()
-				liveVars |= set(allVariableNamesUsed(stmt))
+				liveVars |= variableNamesUsed(stmt)
 			elif t in [ast.Delete, ast.Assert]:
 				# Just add all variables used
-				liveVars |= set(allVariableNamesUsed(stmt))
+				liveVars |= variableNamesUsed(stmt)
 			elif t == ast.Assign:
 				# Check to see if the names being assigned are in the set of live variables
 				allDead = True
 				allTargets = gatherAssignedVars(stmt.targets)
-				allNamesUsed = allVariableNamesUsed(stmt.value)
+				allNamesUsed = variableNamesUsed(stmt.value)
 				for target in allTargets:
 					if type(target) == ast.Name and (target.id in liveVars or target.id in allNamesUsed):
 						if target.id in liveVars:
 							liveVars.remove(target.id)
 						allDead = False
 					elif type(target) in [ast.Subscript, ast.Attribute]:
-						liveVars |= set(allVariableNamesUsed(target))
+						liveVars |= variableNamesUsed(target)
 						allDead = False
 				# Also, check if the variable itself is contained in the value, because that can crash too
 				# If none are used, we can delete this line. Otherwise, use the value's vars
 				if allDead and (not couldCrash(stmt)) and (not containsTokenStepString(stmt)):
 					a.pop(i)
 				else:
-					liveVars |= set(allVariableNamesUsed(stmt.value))
+					liveVars |= variableNamesUsed(stmt.value)
 			elif t == ast.AugAssign:
-				liveVars |= set(allVariableNamesUsed(stmt.target))
-				liveVars |= set(allVariableNamesUsed(stmt.value))
+				liveVars |= variableNamesUsed(stmt.target)
+				liveVars |= variableNamesUsed(stmt.value)
 			elif t == ast.For:
 				# If there is no use of break, there's no reason to use else with the loop,
 				# so move the lines outside and go over them separately
 				if len(stmt.orelse) > 0 and countOccurances(stmt, ast.Break) == 0:
 					lines = stmt.orelse
 					stmt.orelse = []
+					forgetDataflow(stmt)
 					a[i:i+1] = [stmt] + lines
 					i += len(lines)
 					continue # don't subtract one
@@ -1622,7 +1702,7 @@ def deadCodeRemoval(a, liveVars=None, keepPrints=True, inLoop=False):
 					log("transformations\tdeadCodeRemoval\tFor target not a name: " + str(type(a[i].target)) + "\t" + printFunction(a[i].target), "bug")
 
 				# We need to make ALL variables in the loop live, since they update continuously
-				liveVars |= set(allVariableNamesUsed(stmt))
+				liveVars |= variableNamesUsed(stmt)
 				gid = stmt.body[0].global_id if len(stmt.body) > 0 and hasattr(stmt.body[0], "global_id") else None
 				stmt.body = deadCodeRemoval(stmt.body, copy.deepcopy(liveVars), keepPrints=keepPrints, inLoop=True)
 				stmt.orelse = deadCodeRemoval(stmt.orelse, copy.deepcopy(liveVars), keepPrints=keepPrints, inLoop=inLoop)
@@ -1649,12 +1729,13 @@ def deadCodeRemoval(a, liveVars=None, keepPrints=True, inLoop=False):
 				if len(stmt.orelse) > 0 and countOccurances(stmt, ast.Break) == 0:
 					lines = stmt.orelse
 					stmt.orelse = []
+					forgetDataflow(stmt)
 					a[i:i+1] = [stmt] + lines
 					i += len(lines)
 					continue
 
 				# We need to make ALL variables in the loop live, since they update continuously
-				liveVars |= set(allVariableNamesUsed(stmt))
+				liveVars |= variableNamesUsed(stmt)
 				old_global_id = stmt.body[0].global_id
 				stmt.body = deadCodeRemoval(stmt.body, copy.deepcopy(liveVars), keepPrints=keepPrints, inLoop=True)
 				stmt.orelse = deadCodeRemoval(stmt.orelse, copy.deepcopy(liveVars), keepPrints=keepPrints, inLoop=inLoop)
@@ -1683,7 +1764,7 @@ def deadCodeRemoval(a, liveVars=None, keepPrints=True, inLoop=False):
 				stmt.body = deadCodeRemoval(stmt.body, liveVars1, keepPrints=keepPrints, inLoop=inLoop)
 				stmt.orelse = deadCodeRemoval(stmt.orelse, liveVars2, keepPrints=keepPrints, inLoop=inLoop)
 				liveVars.clear()
-				allVars = liveVars1 | liveVars2 | set(allVariableNamesUsed(stmt.test))
+				allVars = liveVars1 | liveVars2 | variableNamesUsed(stmt.test)
 				liveVars |= allVars
 				if len(stmt.body) == 0 and len(stmt.orelse) == 0:
 					# Get rid of the if and keep going
@@ -1724,7 +1805,7 @@ def deadCodeRemoval(a, liveVars=None, keepPrints=True, inLoop=False):
 			elif t == ast.Expr:
 				# Remove the line if it won't crash things.
 				if couldCrash(stmt) or containsTokenStepString(stmt):
-					liveVars |= set(allVariableNamesUsed(stmt))
+					liveVars |= variableNamesUsed(stmt)
 				else:
 					# check whether any of these variables might crash the program
 					# I know, it's weird, but occasionally a student might use a var before defining it
@@ -1735,12 +1816,12 @@ def deadCodeRemoval(a, liveVars=None, keepPrints=True, inLoop=False):
 								if id in allVars:
 									allVars.remove(id)
 					if len(allVars) > 0:
-						liveVars |= set(allVariableNamesUsed(stmt))
+						liveVars |= variableNamesUsed(stmt)
 					else:
 						a.pop(i)
 			# for now, just be careful with these types of statements
 			elif t in [ast.With, ast.Raise, ast.Try]:
-				liveVars |= set(allVariableNamesUsed(stmt))
+				liveVars |= variableNamesUsed(stmt)
 			elif t == ast.Pass:
 				a.pop(i) # pass does *nothing*
 			elif t in [ast.Continue, ast.Break]:
@@ -2560,6 +2641,9 @@ def allVariablesUsed(a):
 		return []
 	elif type(a) == ast.Name:
 		return [a]
+	entry = dataflowEntry(a)
+	if entry != None and entry[1] != None:
+		return list(entry[1])
 	elif type(a) == ast.Assign:
 		variables = allVariablesUsed(a.value)
 		for target in a.targets:
@@ -2573,12 +2657,13 @@ def allVariablesUsed(a):
 						variables += allVariablesUsed(elt)
 			else:
 				variables += allVariablesUsed(target)
-		return variables
 	else:
 		variables = []
 		for child in ast.iter_child_nodes(a):
 			variables += allVariablesUsed(child)
-		return variables
+	if entry != None:
+		entry[1] = list(variables)
+	return variables
 
 def conditionalRedundancy(a):
 	"""When possible, remove redundant lines from conditionals and combine conditionals."""
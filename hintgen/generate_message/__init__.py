@@ -1528,7 +1528,7 @@ def formatHints(s, edit, hintLevel, tree):
 		for e in edit:
 			e.start = tree
 			tree = e.applyChange()
-		structure = structureTree(tree)
+		structure = structureTree(deepcopy(tree)) # structureTree changes the tree in place, and the edited tree shares nodes with the student's
 		hint.message = "To correct your code, aim for the following code structure:\n<b>" + printFunction(structure, 0) + "</b>"
 		hint.message += "\nIf you need more help, ask for feedback again."
 	elif hintLevel == "solution":
@@ -1,13 +1,15 @@
 import ast, sys, io, pstats, cProfile, time, random, os
 from .canonicalize import getAllImports, getAllImportStatements, runGiveIds, anonymizeNames, getCanonicalForm, propogateMetadata, propogateNameMetadata
+from .canonicalize.canonicalCache import canonicalKey, getCanonical, storeCanonical
 from .path_construction import diffAsts, generateNextStates
 from .individualize import mapEdit
 from .generate_message import formatHints
 from .getSyntaxHint import getSyntaxHint, applyChanges
 
 from .test import test
+from .problemCache import getProblemData
 from .display import printFunction
-from .astTools import deepcopy, tree_to_str, str_to_tree
+from .astTools import deepcopy, tree_to_str
 from .tools import log, parse_table
 from .paths import LOG_PATH
 
@@ -138,16 +140,31 @@ def find_example_solutions(s, goals):
 			examples.append(closest[0])
 	return examples
 
+def get_given_names(source_state):
+	"""The names that anonymizing has to leave alone (imports and the problem's functions), and the import statements"""
+	problemData = getProblemData(source_state.problem)
+	args = problemData.arguments
+	given_code = problemData.given_tree
+	importNames = getAllImports(source_state.tree) + getAllImports(given_code)
+	inp = importNames + (list(args.keys()) if type(args) == dict else [])
+	given_names = [str(x) for x in inp]
+	imports = getAllImportStatements(source_state.tree) + getAllImportStatements(given_code)
+	return (given_names, imports)
+
+def new_cleaned_state(source_state, cleaned_code):
+	cleaned_state = CleanedState(code=cleaned_code, problem=source_state.problem, 
+								 score=source_state.score, count=1, 
+								 feedback=source_state.feedback)
+	cleaned_state.tree_source = source_state.tree_source
+	cleaned_state.treeWeight = source_state.treeWeight
+	return cleaned_state
+
 def generate_cleaned_state(source_state):
 	# First level of abstraction: convert to an AST and back. Cleans the code by removing comments, whitespace, etc.
 	cleaned_code = printFunction(source_state.tree)
 	prior_cleaned = list(CleanedState.objects.filter(problem=source_state.problem, code=cleaned_code))
 	if len(prior_cleaned) == 0:
-		cleaned_state = CleanedState(code=cleaned_code, problem=source_state.problem, 
-									 score=source_state.score, count=1, 
-									 feedback=source_state.feedback)
-		cleaned_state.tree_source = source_state.tree_source
-		cleaned_state.treeWeight = source_state.treeWeight
+		cleaned_state = new_cleaned_state(source_state, cleaned_code)
 	elif len(prior_cleaned) == 1:
 		cleaned_state = prior_cleaned[0]
 		cleaned_state.count += 1
@@ -155,20 +172,56 @@ def generate_cleaned_state(source_state):
 			log("getHint\tgenerate_cleaned_state\tCode mismatch: \n" + cleaned_state.code + "\n" + cleaned_code, "bug")
 	else:
 		log("getHint\tgenerate_cleaned_state\tDuplicate code entries in cleaned: " + cleaned_code, "bug")
+	return finish_cleaned_state(cleaned_state, source_state)
+
+def retest(s):
+	"""Test a new state, which starts out with the score of the state it was made from.
+		Unlike test(s, forceRetest=True), this still uses the result cache."""
+	s.score = None
+	s.feedback = ""
+	return test(s)
+
+def finish_cleaned_state(cleaned_state, source_state):
+	"""Attach the source tree to the cleaned state and test it"""
 	cleaned_state.tree = source_state.tree
-	cleaned_state = test(cleaned_state, forceRetest=True)
+	cleaned_state = retest(cleaned_state)
 	if cleaned_state.score != source_state.score:
 		log("getHint\tgenerate_cleaned_state\tScore mismatch: " + \
 			str(source_state.score) + "," + str(cleaned_state.score) + "\n" + \
 			source_state.code + "\n" + cleaned_state.code, "bug")
 	return cleaned_state
 
-def generate_anon_state(cleaned_state, given_names, imports):
-	# Mid-level: just anonymize the variable names TODO variableMap
-	orig_tree = deepcopy(cleaned_state.tree)
+def anonymize_tree(tree, given_names, imports):
+	"""Give a copy of the cleaned tree ids, and anonymize a copy of that. Returns (orig_tree, anon_tree)."""
+	orig_tree = deepcopy(tree)
 	runGiveIds(orig_tree)
 	anon_tree = deepcopy(orig_tree)
 	anon_tree = anonymizeNames(anon_tree, given_names, imports)
+	return (orig_tree, anon_tree)
+
+def new_anon_state(cleaned_state, anon_code, anon_tree):
+	anon_state = AnonState(code=anon_code, problem=cleaned_state.problem, 
+						   score=cleaned_state.score, count=1,
+						   feedback=cleaned_state.feedback) 
+	anon_state.treeWeight = diffAsts.getWeight(anon_tree)
+	return anon_state
+
+def finish_anon_state(anon_state, cleaned_state, orig_tree, anon_tree):
+	"""Attach the trees to the anon state and test it"""
+	anon_state.tree = anon_tree
+	anon_state.tree_source = tree_to_str(anon_tree)
+	anon_state = retest(anon_state)
+	if anon_state.score != cleaned_state.score:
+		log("getHint\tgenerate_anon_state\tScore mismatch: " + \
+			str(cleaned_state.score) + "," + str(anon_state.score) + "\n" + \
+			cleaned_state.code + "\n" + anon_state.code, "bug")
+	anon_state.orig_tree = orig_tree
+	anon_state.orig_tree_source = tree_to_str(orig_tree)
+	return anon_state
+
+def generate_anon_state(cleaned_state, given_names, imports):
+	# Mid-level: just anonymize the variable names TODO variableMap
+	(orig_tree, anon_tree) = anonymize_tree(cleaned_state.tree, given_names, imports)
 	if cleaned_state.count > 1 and cleaned_state.anon != None:
 		anon_state = cleaned_state.anon
 		anon_state.count += 1
@@ -176,52 +229,64 @@ def generate_anon_state(cleaned_state, given_names, imports):
 		anon_code = printFunction(anon_tree)
 		prior_anon = list(AnonState.objects.filter(problem=cleaned_state.problem, code=anon_code))
 		if len(prior_anon) == 0:
-			anon_state = AnonState(code=anon_code, problem=cleaned_state.problem, 
-								   score=cleaned_state.score, count=1,
-								   feedback=cleaned_state.feedback) 
-			anon_state.treeWeight = diffAsts.getWeight(anon_tree)
+			anon_state = new_anon_state(cleaned_state, anon_code, anon_tree)
 		else:
 			if len(prior_anon) > 1:
 				log("getHint\tgenerate_anon_state\tDuplicate code entries in anon: " + anon_code, "bug")
 			anon_state = prior_anon[0]
 			anon_state.count += 1
-	anon_state.tree = anon_tree
-	anon_state.tree_source = tree_to_str(anon_tree)
-	anon_state = test(anon_state, forceRetest=True)
-	if anon_state.score != cleaned_state.score:
-		log("getHint\tgenerate_anon_state\tScore mismatch: " + \
-			str(cleaned_state.score) + "," + str(anon_state.score) + "\n" + \
-			cleaned_state.code + "\n" + anon_state.code, "bug")
-	anon_state.orig_tree = orig_tree
-	anon_state.orig_tree_source = tree_to_str(orig_tree)
-	return anon_state
+	return finish_anon_state(anon_state, cleaned_state, orig_tree, anon_tree)
+
+def canonicalize(canonical_state, key, given_names, args, imports):
+	"""Fill in the canonical tree and code for the state's orig_tree, from the memo if we've seen this code before"""
+	memo = getCanonical(key, canonical_state.orig_tree)
+	if memo != None:
+		(canonical_state.tree, canonical_state.code) = memo
+		return canonical_state
+	canonical_state.tree = deepcopy(canonical_state.orig_tree)
+	canonical_state = getCanonicalForm(canonical_state, given_names, args, imports)
+	storeCanonical(key, canonical_state.problem, canonical_state.orig_tree, canonical_state.tree, canonical_state.code)
+	return canonical_state
 
-def generate_canonical_state(cleaned_state, anon_state, given_names, imports):
-	# Second level of abstraction: canonicalize the AST. Gets rid of redundancies.
-	args = eval(anon_state.problem.arguments)
+def canonical_inputs(cleaned_state, anon_state, imports):
+	"""The problem's arguments, the original tree (with ids) and the memo key for canonicalizing. Returns (args, orig_tree, key)."""
+	args = getProblemData(anon_state.problem).arguments
 	orig_tree = deepcopy(cleaned_state.tree)
 	runGiveIds(orig_tree)
 	if type(args) != dict:
 		log("getHint\tgenerate_canonical_state\tBad args format: " + anon_state.problem.arguments, "bug")
 		args = { }
+	key = canonicalKey(anon_state.code, anon_state.problem, args, imports)
+	return (args, orig_tree, key)
+
+def new_canonical_state(cleaned_state, orig_tree):
+	canonical_state = CanonicalState(code=cleaned_state.code, problem=cleaned_state.problem,
+									 score=cleaned_state.score, count=1, 
+									 feedback=cleaned_state.feedback)
+	canonical_state.orig_tree = orig_tree
+	canonical_state.orig_tree_source = tree_to_str(canonical_state.orig_tree)
+	return canonical_state
+
+def finish_canonical_state(canonical_state, cleaned_state):
+	"""Test a newly canonicalized state"""
+	canonical_state = retest(canonical_state)
+	if canonical_state.score != cleaned_state.score:
+		log("getHint\tgenerate_canonical_state\tScore mismatch: " + str(cleaned_state.score) + "," + str(canonical_state.score) + "\n" + cleaned_state.code + "\n" + canonical_state.code, "bug")
+	return canonical_state
+
+def generate_canonical_state(cleaned_state, anon_state, given_names, imports):
+	# Second level of abstraction: canonicalize the AST. Gets rid of redundancies.
+	(args, orig_tree, key) = canonical_inputs(cleaned_state, anon_state, imports)
 	if anon_state.count > 1 and anon_state.canonical != None:
 		canonical_state = anon_state.canonical
 		canonical_state.orig_tree = orig_tree
 		canonical_state.orig_tree_source = tree_to_str(canonical_state.orig_tree)
-		canonical_state.tree = deepcopy(canonical_state.orig_tree)
-		canonical_state = getCanonicalForm(canonical_state, given_names, args, imports)
+		canonical_state = canonicalize(canonical_state, key, given_names, args, imports)
 		canonical_state.count += 1
 	else:
-		canonical_state = CanonicalState(code=cleaned_state.code, problem=cleaned_state.problem,
-										 score=cleaned_state.score, count=1, 
-										 feedback=cleaned_state.feedback)
-		canonical_state.orig_tree = orig_tree
-		canonical_state.orig_tree_source = tree_to_str(canonical_state.orig_tree)
-		canonical_state.tree = deepcopy(canonical_state.orig_tree)
-		canonical_state = getCanonicalForm(canonical_state, given_names, args, imports)
-		canonical_state = test(canonical_state, forceRetest=True)
-		if canonical_state.score != cleaned_state.score:
-			log("getHint\tgenerate_canonical_state\tScore mismatch: " + str(cleaned_state.score) + "," + str(canonical_state.score) + "\n" + cleaned_state.code + "\n" + canonical_state.code, "bug")
+		canonical_state = new_canonical_state(cleaned_state, orig_tree)
+		canonical_state = canonicalize(canonical_state, key, given_names, args, imports)
+		canonical_state = finish_canonical_state(canonical_state, cleaned_state)
 		prior_canon = list(CanonicalState.objects.filter(problem=cleaned_state.problem, code=canonical_state.code))
 		if len(prior_canon) == 0:
 			canonical_state.tree_source = tree_to_str(canonical_state.tree)
@@ -253,10 +318,16 @@ def generate_states(source_state, given_names, imports):
 
 	return (cleaned_state, anon_state, canonical_state)
 
+def fill_feedback(s):
+	"""States that path construction only tested against a threshold have no feedback yet"""
+	if s.score != None and s.feedback == "":
+		test(s)
+
 def save_states(source, cleaned, anon, canonical):
 	for s in [anon, canonical]:
 		g = s.goal
 		if g != None:
+			fill_feedback(g)
 			g.save()
 			s.goal = g
 		next_chain = [s]
@@ -270,8 +341,10 @@ def save_states(source, cleaned, anon, canonical):
 				if g.goal != None:
 					log("getHint\tsave_states\tWeird goal goal: " + str(g.score) + "," + g.code, "bug")
 					log("getHint\tsave_states\tWeird goal goal: " + str(g.goal.score) + "," + g.goal.code, "bug")
+				fill_feedback(g)
 				g.save()
 				n.goal = g
+			fill_feedback(n)
 			n.save()
 			next_chain[i-1].next = n
 
@@ -301,12 +374,7 @@ def run_tests(source_state):
 	source_state = test_code(source_state)
 	source_state.code = orig_code
 
-	args = eval(source_state.problem.arguments)
-	given_code = ast.parse(source_state.problem.given_code)
-	importNames = getAllImports(source_state.tree) + getAllImports(given_code)
-	inp = importNames + (list(args.keys()) if type(args) == dict else [])
-	given_names = [str(x) for x in inp]
-	imports = getAllImportStatements(source_state.tree) + getAllImportStatements(given_code)
+	(given_names, imports) = get_given_names(source_state)
 
 	if source_state.tree != None:
 		(cleaned_state, anon_state, canonical_state) = generate_states(source_state, given_names, imports)
@@ -324,18 +392,11 @@ def get_hint(source_state, hint_level="default"):
 	if source_state.tree == None:
 		return getSyntaxHint(source_state, "syntax_" + hint_level)
 
-	args = eval(source_state.problem.arguments)
-	given_code = ast.parse(source_state.problem.given_code)
-	importNames = getAllImports(source_state.tree) + getAllImports(given_code)
-	inp = importNames + (list(args.keys()) if type(args) == dict else [])
-	given_names = [str(x) for x in inp]
-	imports = getAllImportStatements(source_state.tree) + getAllImportStatements(given_code)
+	(given_names, imports) = get_given_names(source_state)
 
 	# Setup the correct states we need for future work
 	goals = list(AnonState.objects.filter(problem=source_state.problem, score=1)) + \
 			list(CanonicalState.objects.filter(problem=source_state.problem, score=1))
-	for goal in goals:
-		goal.tree = str_to_tree(goal.tree_source)
 
 	(cleaned_state, anon_state, canonical_state) = generate_states(source_state, given_names, imports)
 
@@ -401,15 +462,10 @@ def get_hint(source_state, hint_level="default"):
 				log("getHint\tget_hint\tCould not find next state for state " + str(used_state.id), "bug")
 				break
 			next_state = used_state.next
-			if not hasattr(next_state, "tree"):
-				next_state.tree = str_to_tree(next_state.tree_source)
 			edit = diffAsts.diffAsts(used_state.tree, next_state.tree)
 			edit, _ = generateNextStates.updateChangeVectors(edit, used_state.tree, used_state.tree)
-			if not hasattr(used_state, "orig_tree"):
-				if hasattr(used_state, "orig_tree_source") and used_state.orig_tree_source != "":
-					used_state.orig_tree = str_to_tree(used_state.orig_tree_source)
-				else:
-					log("getHint\tgetHint\tWhy no orig_tree?!?!" + str(used_state), "bug")
+			if used_state.orig_tree == None:
+				log("getHint\tgetHint\tWhy no orig_tree?!?!" + str(used_state), "bug")
 			edit = mapEdit(used_state.tree, used_state.orig_tree, edit)
 			if len(edit) == 0:
 				if next_state.next != None:
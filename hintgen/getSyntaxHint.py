@@ -348,7 +348,7 @@ def getSyntaxHint(source_state, hint_level):
 		bestCode = currentCode
 	else:
 		# If that fails, do the basic path construction approach
-		allSources = SourceState.objects.filter(problem=source_state.problem).exclude(tree_source="")
+		allSources = SourceState.objects.filter(problem=source_state.problem).exclude(tree_source=b"")
 		codes = list(set([state.code for state in allSources]))
 		allChanges = []
 		bestChange = None
@@ -0,0 +1,289 @@
+"""Build a problem's solution space out of a file of historical submissions, spreading the work over several processes.
+Each submission is parsed, cleaned, anonymized, canonicalized and tested in a worker, which doesn't touch the states
+in the database. The results are then merged into the State tiers in the order the submissions came in, the same way
+running them through run_tests one at a time would, and saved in a single transaction.
+	python manage.py canonicalize_submissions hintgen/combined_data/is_prime.csv is_prime --workers 8
+The file can be a CSV (like the ones in combined_data) or JSONL, one object per line; either way, each submission
+needs a student_id and its code in fun."""
+import json, os, time
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from ...getHint import test_code, get_given_names, new_cleaned_state, finish_cleaned_state, anonymize_tree, new_anon_state, \
+	finish_anon_state, canonical_inputs, new_canonical_state, finish_canonical_state, canonicalize
+from ...analysis import clear_solution_space
+from ...problemCache import warmProblemCache
+from ...path_construction import diffAsts
+from ...display import printFunction
+from ...astTools import tree_to_str
+from ...tools import log, parse_table
+from ...models import *
+
+STATE_FIELDS = ["code", "score", "feedback", "tree_source", "treeWeight"]
+
+workerProblem = None # set before the pool starts, so that the forked workers share the parsed problem
+
+def read_submissions(filename):
+	"""A list of (student name, code) pairs, in the order they were submitted"""
+	if filename.endswith(".jsonl"):
+		submissions = []
+		with open(filename, "r") as f:
+			for line in f:
+				if line.strip() != "":
+					row = json.loads(line)
+					submissions.append((str(row["student_id"]), row["fun"]))
+		return submissions
+	table = parse_table(filename)
+	header = table[0]
+	student_index = header.index("student_id")
+	code_index = header.index("fun")
+	return [(line[student_index], line[code_index]) for line in table[1:]]
+
+def get_fields(s, names):
+	return { name : getattr(s, name) for name in names }
+
+def pick(values, names):
+	return { name : values[name] for name in names }
+
+def process_submission(code):
+	"""Run a submission through every tier as if it were the first one with its code, and return the fields of each
+		state, along with the code each one is looked up by. This doesn't use the states in the database."""
+	source_state = SourceState(code=code, problem=workerProblem, count=1)
+	source_state = test_code(source_state)
+	source_state.code = code
+	result = { "source" : get_fields(source_state, ["score", "feedback", "tree_source", "treeWeight"]) }
+	if source_state.tree == None:
+		return result
+	(given_names, imports) = get_given_names(source_state)
+
+	cleaned_code = printFunction(source_state.tree)
+	cleaned_state = new_cleaned_state(source_state, cleaned_code)
+	cleaned_state = finish_cleaned_state(cleaned_state, source_state)
+	result["cleaned"] = get_fields(cleaned_state, STATE_FIELDS)
+	result["cleaned"]["lookup"] = cleaned_code
+
+	(orig_tree, anon_tree) = anonymize_tree(cleaned_state.tree, given_names, imports)
+	anon_code = printFunction(anon_tree)
+	anon_state = new_anon_state(cleaned_state, anon_code, anon_tree)
+	anon_state = finish_anon_state(anon_state, cleaned_state, orig_tree, anon_tree)
+	result["anon"] = get_fields(anon_state, STATE_FIELDS + ["orig_tree_source"])
+	result["anon"]["lookup"] = anon_code
+
+	(args, orig_tree, key) = canonical_inputs(cleaned_state, anon_state, imports)
+	canonical_state = new_canonical_state(cleaned_state, orig_tree)
+	canonical_state = canonicalize(canonical_state, key, given_names, args, imports)
+	canonical_code = canonical_state.code # what an existing canonical state gets, since those aren't retested
+	canonical_state = finish_canonical_state(canonical_state, cleaned_state)
+	canonical_state.tree_source = tree_to_str(canonical_state.tree)
+	canonical_state.treeWeight = diffAsts.getWeight(canonical_state.tree)
+	result["canonical"] = get_fields(canonical_state, STATE_FIELDS + ["orig_tree_source"])
+	result["canonical"]["canonicalized"] = canonical_code
+	return result
+
+class Tier:
+	"""The states of one tier of a problem, held in memory while the results are merged. Looking up code gives
+		the oldest state first, like the database does, and links to the next tier are kept here until saving."""
+	def __init__(self, states, link):
+		self.link = link # the attribute holding this tier's link, e.g. "anon_id" for cleaned states
+		self.byCode = { }
+		self.byPk = { s.pk : s for s in states }
+		self.order = { } # oldest first: loaded states in id order, then new ones as they're made
+		self.links = { }
+		self.created = []
+		self.changed = { }
+		for s in states:
+			self.add(s)
+
+	def add(self, s):
+		self.order[id(s)] = len(self.order)
+		self.byCode.setdefault(s.code, []).append(s)
+
+	def create(self, s):
+		self.add(s)
+		self.created.append(s)
+
+	def find(self, code):
+		return self.byCode.get(code, [])
+
+	def update(self, s, values, names):
+		"""Overwrite some of an existing state's fields, keeping it findable by its new code"""
+		oldCode = s.code
+		for name in names:
+			setattr(s, name, values[name])
+		if s.code != oldCode:
+			self.byCode[oldCode].remove(s)
+			same = self.byCode.setdefault(s.code, [])
+			same.append(s)
+			same.sort(key=lambda t : self.order[id(t)])
+		self.touch(s)
+
+	def touch(self, s):
+		if s.pk != None:
+			self.changed[id(s)] = s
+
+	def linked(self, s, next_tier):
+		"""The state in the next tier that s links to, or None"""
+		if id(s) in self.links:
+			return self.links[id(s)]
+		return next_tier.byPk.get(getattr(s, self.link))
+
+	def set_link(self, s, target):
+		self.links[id(s)] = target
+		self.touch(s)
+
+	def save_link(self, s):
+		"""Fill in s's link, if it has one. Returns False if the state it links to hasn't been saved yet."""
+		if id(s) not in self.links:
+			return True
+		target = self.links[id(s)]
+		setattr(s, self.link, target.pk)
+		return target.pk != None
+
+class Command(BaseCommand):
+	help = "Canonicalize a CSV or JSONL file of submissions into a problem's solution space, using several processes"
+
+	def add_arguments(self, parser):
+		parser.add_argument("file", help="a .csv or .jsonl file of submissions, with student_id and fun for each")
+		parser.add_argument("problem", help="the name of the problem the submissions are for")
+		parser.add_argument("--course", type=int, default=1, help="the course to put new students in")
+		parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes to use; 0 runs everything in this one")
+		parser.add_argument("--clear", action="store_true", help="clear out the problem's solution space first")
+		parser.add_argument("--skip-repeats", action="store_true", help="skip submissions that are the same as the student's last one")
+
+	def handle(self, *args, **options):
+		global workerProblem
+		try:
+			problem = Problem.objects.get(name=options["problem"])
+			course = Course.objects.get(id=options["course"])
+		except (Problem.DoesNotExist, Course.DoesNotExist) as e:
+			raise CommandError(str(e))
+		start = time.perf_counter()
+		submissions = read_submissions(options["file"])
+		if options["skip_repeats"]:
+			last_seen = { }
+			kept = []
+			for (student_name, code) in submissions:
+				if last_seen.get(student_name) != code:
+					kept.append((student_name, code))
+				last_seen[student_name] = code
+			submissions = kept
+		if len(submissions) == 0:
+			raise CommandError("No submissions in " + options["file"])
+		if options["clear"]:
+			clear_solution_space(problem)
+		warmProblemCache([problem])
+		workerProblem = problem
+		self.report("Loading", start, len(submissions))
+
+		start = time.perf_counter()
+		codes = [code for (student_name, code) in submissions]
+		if options["workers"] > 0:
+			connections.close_all() # the workers can't share this process's connections
+			chunksize = max(1, len(codes) // (4 * options["workers"]))
+			with ProcessPoolExecutor(max_workers=options["workers"]) as pool:
+				results = list(pool.map(process_submission, codes, chunksize=chunksize))
+		else:
+			results = [process_submission(code) for code in codes]
+		self.report("Canonicalizing", start, len(submissions))
+
+		start = time.perf_counter()
+		with transaction.atomic():
+			self.merge(problem, course, submissions, results)
+		self.report("Saving", start, len(submissions))
+
+	def report(self, phase, start, n):
+		elapsed = time.perf_counter() - start
+		self.stdout.write(phase + ": " + str(n) + " submissions in " + "%.2f" % elapsed + "s (" + \
+			"%.1f" % (n / elapsed if elapsed > 0 else 0) + " per second)")
+
+	def merge(self, problem, course, submissions, results):
+		"""Add the results to the problem's states, making the same choices run_tests would if the submissions were
+			run in order. The states are all loaded up front and saved at the end. Since the tiers use multi-table
+			inheritance, they can't be bulk created, but each state is only written once or twice."""
+		canonical = Tier(list(CanonicalState.objects.filter(problem=problem).defer("tree_source", "orig_tree_source")), None)
+		anon = Tier(list(AnonState.objects.filter(problem=problem).defer("tree_source", "orig_tree_source")), "canonical_id")
+		cleaned = Tier(list(CleanedState.objects.filter(problem=problem).defer("tree_source")), "anon_id")
+		source = Tier([], "cleaned_id")
+		students = { }
+		for s in Student.objects.filter(name__in=set(name for (name, code) in submissions)):
+			students.setdefault(s.name, []).append(s)
+		created = [] # every new state, in the order run_tests would have saved them
+
+		for ((student_name, code), result) in zip(submissions, results):
+			same_name = students.setdefault(student_name, [])
+			if len(same_name) == 1:
+				student = same_name[0]
+			else:
+				student = Student(course=course, name=student_name)
+				student.save()
+				same_name.append(student)
+			source_state = SourceState(code=code, problem=problem, count=1, student=student, **result["source"])
+			if "cleaned" not in result:
+				source.create(source_state)
+				created.append(source_state)
+				continue
+
+			values = result["cleaned"]
+			prior_cleaned = cleaned.find(values["lookup"])
+			if len(prior_cleaned) == 0:
+				cleaned_state = CleanedState(problem=problem, count=1, **pick(values, STATE_FIELDS))
+				cleaned.create(cleaned_state)
+				created.append(cleaned_state)
+			else:
+				if len(prior_cleaned) > 1:
+					log("canonicalize_submissions\tmerge\tDuplicate code entries in cleaned: " + values["lookup"], "bug")
+				cleaned_state = prior_cleaned[0]
+				cleaned_state.count += 1
+				cleaned.update(cleaned_state, values, ["code", "score", "feedback"])
+
+			values = result["anon"]
+			anon_state = cleaned.linked(cleaned_state, anon) if cleaned_state.count > 1 else None
+			if anon_state == None:
+				prior_anon = anon.find(values["lookup"])
+				if len(prior_anon) > 1:
+					log("canonicalize_submissions\tmerge\tDuplicate code entries in anon: " + values["lookup"], "bug")
+				anon_state = prior_anon[0] if len(prior_anon) > 0 else None
+			if anon_state == None:
+				anon_state = AnonState(problem=problem, count=1, **pick(values, STATE_FIELDS + ["orig_tree_source"]))
+				anon.create(anon_state)
+				created.append(anon_state)
+			else:
+				anon_state.count += 1
+				anon.update(anon_state, values, ["code", "score", "feedback", "tree_source", "orig_tree_source"])
+
+			values = result["canonical"]
+			canonical_state = anon.linked(anon_state, canonical) if anon_state.count > 1 else None
+			if canonical_state != None:
+				canonical_state.count += 1
+				canonical.update(canonical_state, { "code" : values["canonicalized"], "orig_tree_source" : values["orig_tree_source"] },
+								 ["code", "orig_tree_source"])
+			else:
+				prior_canon = canonical.find(values["code"])
+				if len(prior_canon) == 0:
+					canonical_state = CanonicalState(problem=problem, count=1, **pick(values, STATE_FIELDS + ["orig_tree_source"]))
+					canonical.create(canonical_state)
+					created.append(canonical_state)
+				else:
+					if len(prior_canon) > 1:
+						log("canonicalize_submissions\tmerge\tDuplicate code entries in canon: " + values["code"], "bug")
+					canonical_state = prior_canon[0]
+					canonical_state.count += 1
+					canonical.update(canonical_state, values, ["orig_tree_source"])
+
+			source.set_link(source_state, cleaned_state)
+			cleaned.set_link(cleaned_state, anon_state)
+			anon.set_link(anon_state, canonical_state)
+			source.create(source_state)
+			created.append(source_state)
+
+		tiers = { SourceState : source, CleanedState : cleaned, AnonState : anon, CanonicalState : canonical }
+		waiting = []
+		for s in created:
+			if not tiers[type(s)].save_link(s):
+				waiting.append(s) # links to a state made later on
+			s.save()
+		for tier in [cleaned, anon, canonical]:
+			waiting += tier.changed.values()
+		for s in waiting:
+			tiers[type(s)].save_link(s)
+			s.save()
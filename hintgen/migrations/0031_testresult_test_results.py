@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hintgen', '0030_testresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testresult',
+            name='test_results',
+            field=models.TextField(blank=True),
+        ),
+    ]
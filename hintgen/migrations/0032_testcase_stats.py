@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hintgen', '0031_testresult_test_results'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testcase',
+            name='failures',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='testcase',
+            name='runs',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
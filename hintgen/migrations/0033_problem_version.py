@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hintgen', '0032_testcase_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
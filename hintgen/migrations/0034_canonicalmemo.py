@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hintgen', '0033_problem_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CanonicalMemo',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('code', models.TextField()),
+                ('tree_source', models.TextField()),
+                ('orig_tree_source', models.TextField()),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='canonical_memos', to='hintgen.Problem')),
+            ],
+        ),
+    ]
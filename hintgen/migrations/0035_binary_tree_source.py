@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import ast, zlib
+from django.db import migrations, models
+
+# The fields that hold trees, which go from repr(pickle.dumps(tree)) text to compressed pickles
+TREE_FIELDS = [('State', 'tree_source'), ('AnonState', 'orig_tree_source'), ('CanonicalState', 'orig_tree_source'),
+               ('CanonicalMemo', 'tree_source'), ('CanonicalMemo', 'orig_tree_source')]
+
+def text_to_binary(text):
+    # The text is the repr of the pickle, so the pickle can be read back without unpickling anything
+    if text == '':
+        return b''
+    return zlib.compress(ast.literal_eval(text), 6)
+
+def binary_to_text(data):
+    data = bytes(data)
+    if data == b'':
+        return ''
+    return repr(data if data[:1] == b'\x80' else zlib.decompress(data))
+
+def convert(apps, old_suffix, new_suffix, f):
+    for (model_name, field) in TREE_FIELDS:
+        model = apps.get_model('hintgen', model_name)
+        for (pk, value) in model.objects.values_list('pk', field + old_suffix).iterator():
+            model.objects.filter(pk=pk).update(**{ field + new_suffix : f(value) })
+
+def trees_to_binary(apps, schema_editor):
+    convert(apps, '_text', '', text_to_binary)
+
+def trees_to_text(apps, schema_editor):
+    convert(apps, '', '_text', binary_to_text)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hintgen', '0034_canonicalmemo'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='state',
+            old_name='tree_source',
+            new_name='tree_source_text',
+        ),
+        migrations.RenameField(
+            model_name='anonstate',
+            old_name='orig_tree_source',
+            new_name='orig_tree_source_text',
+        ),
+        migrations.RenameField(
+            model_name='canonicalstate',
+            old_name='orig_tree_source',
+            new_name='orig_tree_source_text',
+        ),
+        migrations.RenameField(
+            model_name='canonicalmemo',
+            old_name='tree_source',
+            new_name='tree_source_text',
+        ),
+        migrations.RenameField(
+            model_name='canonicalmemo',
+            old_name='orig_tree_source',
+            new_name='orig_tree_source_text',
+        ),
+        migrations.AddField(
+            model_name='state',
+            name='tree_source',
+            field=models.BinaryField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='anonstate',
+            name='orig_tree_source',
+            field=models.BinaryField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='canonicalstate',
+            name='orig_tree_source',
+            field=models.BinaryField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='canonicalmemo',
+            name='tree_source',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='canonicalmemo',
+            name='orig_tree_source',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+        migrations.RunPython(trees_to_binary, trees_to_text),
+        # Give these defaults first, so that migrating back can add them to the existing rows again
+        migrations.AlterField(
+            model_name='canonicalmemo',
+            name='tree_source_text',
+            field=models.TextField(default=''),
+        ),
+        migrations.AlterField(
+            model_name='canonicalmemo',
+            name='orig_tree_source_text',
+            field=models.TextField(default=''),
+        ),
+        migrations.RemoveField(
+            model_name='state',
+            name='tree_source_text',
+        ),
+        migrations.RemoveField(
+            model_name='anonstate',
+            name='orig_tree_source_text',
+        ),
+        migrations.RemoveField(
+            model_name='canonicalstate',
+            name='orig_tree_source_text',
+        ),
+        migrations.RemoveField(
+            model_name='canonicalmemo',
+            name='tree_source_text',
+        ),
+        migrations.RemoveField(
+            model_name='canonicalmemo',
+            name='orig_tree_source_text',
+        ),
+    ]
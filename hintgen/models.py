@@ -1,4 +1,5 @@
 from django.db import models
+from .astTools import str_to_tree
 
 class Course(models.Model):
     name = models.CharField(max_length=100)
@@ -25,6 +26,7 @@ class Problem(models.Model):
     solution = models.ForeignKey('SourceState', on_delete=models.SET_NULL, related_name="+", blank=True, null=True)
     arguments = models.CharField(max_length=500) # should be interpreted by pickle
     given_code = models.TextField(blank=True) # should be interpreted by pickle
+    version = models.IntegerField(default=0, editable=False) # goes up whenever the problem or its tests change
     def __str__(self):
         return self.name
 
@@ -36,22 +38,65 @@ class Testcase(models.Model):
     test_input = models.TextField() 
     test_output = models.TextField()
     test_extra = models.TextField(blank=True) # specific keywords specify extra tests. For example, 'checkCopy' checks if the input is modified
+    runs = models.IntegerField(default=0, editable=False) # how often the test has been run, so that we can run the most-failed tests first
+    failures = models.IntegerField(default=0, editable=False) # how many of those runs failed or timed out
     def __str__(self):
         return "Test " + str(self.id) + " for " + str(self.problem)
 
     class Meta:
         ordering = ['problem', 'id']
 
+class TestResult(models.Model):
+    problem = models.ForeignKey('Problem', on_delete=models.CASCADE, related_name="test_results")
+    key = models.CharField(max_length=64, unique=True) # hash of the code, given code, and test suite
+    score = models.FloatField()
+    feedback = models.TextField(blank=True)
+    test_results = models.TextField(blank=True) # the status of each test, one digit per test
+    def __str__(self):
+        return "Result " + self.key[:8] + " for " + str(self.problem)
+
+class CanonicalMemo(models.Model):
+    problem = models.ForeignKey('Problem', on_delete=models.CASCADE, related_name="canonical_memos")
+    key = models.CharField(max_length=64, unique=True) # hash of the anonymized code, arguments, and imports
+    code = models.TextField()
+    tree_source = models.BinaryField()
+    orig_tree_source = models.BinaryField() # the tree the canonical form was made from, for mapping it onto new ones
+    def __str__(self):
+        return "Canonical form " + self.key[:8] + " for " + str(self.problem)
+
+class LazyTree(object):
+    """A tree that's decoded from one of the instance's tree fields the first time it's used, and then kept
+    with the instance. Setting it only changes the tree, not the field; deleting it means it will be decoded again."""
+    def __init__(self, source):
+        self.source = source
+        self.name = "_" + source
+
+    def __get__(self, instance, owner):
+        if instance == None:
+            return self
+        if self.name not in instance.__dict__:
+            source = getattr(instance, self.source, b"")
+            instance.__dict__[self.name] = str_to_tree(source) if len(source) > 0 else None
+        return instance.__dict__[self.name]
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.name] = value
+
+    def __delete__(self, instance):
+        instance.__dict__.pop(self.name, None)
+
 class State(models.Model):
     code = models.TextField()
     problem = models.ForeignKey('Problem', on_delete=models.CASCADE, related_name="states")
     score = models.FloatField(blank=True, null=True)
     count = models.IntegerField(default=0)
     feedback = models.TextField(blank=True)
-    tree_source = models.TextField(blank=True) # should be interpreted by pickle
+    tree_source = models.BinaryField(blank=True) # should be interpreted by str_to_tree
     treeWeight = models.IntegerField(blank=True, null=True)
     next = models.ForeignKey('State', on_delete=models.SET_NULL, related_name="prev", blank=True, null=True)
     goal = models.ForeignKey('State', on_delete=models.SET_NULL, related_name="feeder", blank=True, null=True)
+    tree = LazyTree("tree_source")
+    orig_tree = LazyTree("orig_tree_source") # only Anon and Canonical states have an orig_tree_source
     def __str__(self):
         return str(self.problem) + " State " + str(self.id)
 
@@ -69,10 +114,10 @@ class CleanedState(State):
 
 class AnonState(State):
     canonical = models.ForeignKey('CanonicalState', on_delete=models.SET_NULL, related_name="anon_states", blank=True, null=True)
-    orig_tree_source = models.TextField(blank=True)
+    orig_tree_source = models.BinaryField(blank=True)
 
 class CanonicalState(State):
-    orig_tree_source = models.TextField(blank=True)
+    orig_tree_source = models.BinaryField(blank=True)
 
 class Hint(models.Model):
     message = models.TextField(blank=True)
@@ -6,188 +6,122 @@ from ..ChangeVector import *
 from ..State import *
 
 def getWeight(a, countTokens=True):
-	"""Get the size of the given tree"""
+	"""Get the size of the given tree. Each node's weight is kept on it as treeWeight, so weighing a tree again only
+		weighs the nodes that are new since (like the path copied by a ChangeVector)."""
 	if a == None:
 		return 0
 	elif type(a) == list:
-		return sum(map(lambda x : getWeight(x, countTokens), a))
+		return sum([getWeight(x, countTokens) for x in a])
 	elif not isinstance(a, ast.AST):
 		return 1
-	else: # Otherwise, it's an AST node
-		if hasattr(a, "treeWeight"):
-			return a.treeWeight
-		weight = 0
-		if type(a) in [ast.Module, ast.Interactive, ast.Suite]:
-			weight = getWeight(a.body, countTokens=countTokens)
-		elif type(a) == ast.Expression:
-			weight = getWeight(a.body, countTokens=countTokens)
-		elif type(a) == ast.FunctionDef:
-			# add 1 for function name
-			weight = 1 + getWeight(a.args, countTokens=countTokens) + \
-					getWeight(a.body, countTokens=countTokens) + \
-					getWeight(a.decorator_list, countTokens=countTokens) + \
-					getWeight(a.returns, countTokens=countTokens)
-		elif type(a) == ast.ClassDef:
-			# add 1 for class name
-			weight = 1 + sumWeight(a.bases, countTokens=countTokens) + \
-					sumWeight(a.keywords, countTokens=countTokens) + \
-					getWeight(a.body, countTokens=countTokens) + \
-					getWeight(a.decorator_list, countTokens=countTokens)
-		elif type(a) in [ast.Return, ast.Yield, ast.Attribute, ast.Starred]:
-			# add 1 for action name
-			weight = 1 + getWeight(a.value, countTokens=countTokens)
-		elif type(a) == ast.Delete: # add 1 for del
-			weight = 1 + getWeight(a.targets, countTokens=countTokens)
-		elif type(a) == ast.Assign: # add 1 for =
-			weight = 1 + getWeight(a.targets, countTokens=countTokens) + \
-					getWeight(a.value, countTokens=countTokens)
-		elif type(a) == ast.AugAssign:
-			weight = getWeight(a.target, countTokens=countTokens) + \
-					getWeight(a.op, countTokens=countTokens) + \
-					getWeight(a.value, countTokens=countTokens)
-		elif type(a) == ast.For: # add 1 for 'for' and 1 for 'in'
-			weight = 2 + getWeight(a.target, countTokens=countTokens) + \
-					getWeight(a.iter, countTokens=countTokens) + \
-					getWeight(a.body, countTokens=countTokens) + \
-					getWeight(a.orelse, countTokens=countTokens)
-		elif type(a) in [ast.While, ast.If]:
-			# add 1 for while/if
-			weight = 1 + getWeight(a.test, countTokens=countTokens) + \
-					getWeight(a.body, countTokens=countTokens)
-			if len(a.orelse) > 0: # add 1 for else
-				weight += 1 + getWeight(a.orelse, countTokens=countTokens)
-		elif type(a) == ast.With: # add 1 for with
-			weight = 1 + getWeight(a.items, countTokens=countTokens) + \
-					getWeight(a.body, countTokens=countTokens)
-		elif type(a) == ast.Raise: # add 1 for raise
-			weight = 1 + getWeight(a.exc, countTokens=countTokens) + \
-					getWeight(a.cause, countTokens=countTokens)
-		elif type(a) == ast.Try: # add 1 for try
-			weight = 1 + getWeight(a.body, countTokens=countTokens) + \
-					getWeight(a.handlers, countTokens=countTokens)
-			if len(a.orelse) > 0: # add 1 for else
-				weight += 1 + getWeight(a.orelse, countTokens=countTokens)
-			if len(a.finalbody) > 0: # add 1 for finally
-				weight += 1 + getWeight(a.finalbody, countTokens=countTokens)
-		elif type(a) == ast.Assert: # add 1 for assert
-			weight = 1 + getWeight(a.test, countTokens=countTokens) + \
-					getWeight(a.msg, countTokens=countTokens)
-		elif type(a) in [ast.Import, ast.Global]: # add 1 for function name
-			weight = 1 + getWeight(a.names, countTokens=countTokens)
-		elif type(a) == ast.ImportFrom: # add 3 for from module import
-			weight = 3 + getWeight(a.names, countTokens=countTokens)
-		elif type(a) in [ast.Expr, ast.Index]:
-			weight = getWeight(a.value, countTokens=countTokens)
-			if weight == 0:
-				weight = 1
-		elif type(a) == ast.BoolOp: # add 1 for each op
-			weight = (len(a.values) - 1) + \
-					getWeight(a.values, countTokens=countTokens)
-		elif type(a) == ast.BinOp: # add 1 for op
-			weight = 1 + getWeight(a.left, countTokens=countTokens) + \
-					getWeight(a.right, countTokens=countTokens)
-		elif type(a) == ast.UnaryOp: # add 1 for operator
-			weight = 1 + getWeight(a.operand, countTokens=countTokens)
-		elif type(a) == ast.Lambda: # add 1 for lambda
-			weight = 1 + getWeight(a.args, countTokens=countTokens) + \
-					getWeight(a.body, countTokens=countTokens)
-		elif type(a) == ast.IfExp: # add 2 for if and else
-			weight = 2 + getWeight(a.test, countTokens=countTokens) + \
-					getWeight(a.body, countTokens=countTokens) + \
-					getWeight(a.orelse, countTokens=countTokens)
-		elif type(a) == ast.Dict: # return 1 if empty dictionary
-			weight = 1 + getWeight(a.keys, countTokens=countTokens) + \
-					getWeight(a.values, countTokens=countTokens)
-		elif type(a) in [ast.Set, ast.List, ast.Tuple]:
-			weight = 1 + getWeight(a.elts, countTokens=countTokens)
-		elif type(a) in [ast.ListComp, ast.SetComp, ast.GeneratorExp]:
-			weight = 1 + getWeight(a.elt, countTokens=countTokens) + \
-					getWeight(a.generators, countTokens=countTokens)
-		elif type(a) == ast.DictComp:
-			weight = 1 + getWeight(a.key, countTokens=countTokens) + \
-					getWeight(a.value, countTokens=countTokens) + \
-					getWeight(a.generators, countTokens=countTokens)
-		elif type(a) == ast.Compare:
-			weight = len(a.ops) + getWeight(a.left, countTokens=countTokens) + \
-					getWeight(a.comparators, countTokens=countTokens)
-		elif type(a) == ast.Call:
-			functionWeight = getWeight(a.func, countTokens=countTokens)
-			functionWeight = functionWeight if functionWeight > 0 else 1
-			argsWeight = getWeight(a.args, countTokens=countTokens) + \
-					getWeight(a.keywords, countTokens=countTokens)
-			argsWeight = argsWeight if argsWeight > 0 else 1
-			weight = functionWeight + argsWeight
-		elif type(a) == ast.Subscript:
-			valueWeight = getWeight(a.value, countTokens=countTokens)
-			valueWeight = valueWeight if valueWeight > 0 else 1
-			sliceWeight = getWeight(a.slice, countTokens=countTokens)
-			sliceWeight = sliceWeight if sliceWeight > 0 else 1
-			weight = valueWeight + sliceWeight
+	# Otherwise, it's an AST node
+	weight = a.__dict__.get("treeWeight")
+	if weight != None:
+		return weight
+	weigher = nodeWeights.get(type(a))
+	if weigher == None:
+		log("diffAsts\tgetWeight\tMissing type in diffAsts: " + str(type(a)), "bug")
+		return 1
+	weight = weigher(a, countTokens)
+	a.treeWeight = weight
+	return weight
 
-		elif type(a) == ast.Slice:
-			weight = getWeight(a.lower, countTokens=countTokens) + \
-					getWeight(a.upper, countTokens=countTokens) + \
-					getWeight(a.step, countTokens=countTokens)
-			if weight == 0:
-				weight = 1
-		elif type(a) == ast.ExtSlice:
-			weight = getWeight(a.dims, countTokens=countTokens)
+def atLeastOne(weight):
+	return weight if weight > 0 else 1
 
-		elif type(a) == ast.comprehension: # add 2 for for and in
-			# and each of the if tokens
-			weight = 2 + len(a.ifs) + \
-					getWeight(a.target, countTokens=countTokens) + \
-					getWeight(a.iter, countTokens=countTokens) + \
-					getWeight(a.ifs, countTokens=countTokens)
-		elif type(a) == ast.ExceptHandler: # add 1 for except
-			weight = 1 + getWeight(a.type, countTokens=countTokens)
-			# add 1 for as (if needed)
-			weight += (1 if a.name != None else 0) + \
-					getWeight(a.name, countTokens=countTokens)
-			weight += getWeight(a.body, countTokens=countTokens)
-		elif type(a) == ast.arguments:
-			weight = getWeight(a.args, countTokens=countTokens) + \
-					getWeight(a.vararg, countTokens=countTokens) + \
-					getWeight(a.kwonlyargs, countTokens=countTokens) + \
-					getWeight(a.kw_defaults, countTokens=countTokens) + \
-					getWeight(a.kwarg, countTokens=countTokens) + \
-					getWeight(a.defaults, countTokens=countTokens)
-		elif type(a) == ast.arg:
-			weight = 1 + getWeight(a.annotation, countTokens=countTokens)
-		elif type(a) == ast.keyword: # add 1 for identifier
-			weight = 1 + getWeight(a.value, countTokens=countTokens)
-		elif type(a) == ast.alias: # 1 for name, 1 for as, 1 for asname
-			weight = 1 + (2 if a.asname != None else 0)
-		elif type(a) == ast.withitem:
-			weight = getWeight(a.context_expr, countTokens=countTokens) + \
-					 getWeight(a.optional_vars, countTokens=countTokens)
-		elif type(a) == ast.Str:
-			if countTokens:
-				weight = 1
-			elif len(a.s) >= 2 and a.s[0] == "~" and a.s[-1] == "~":
-				weight = 0
-			else:
-				weight = 1
+def weighConditional(a, countTokens):
+	# add 1 for while/if
+	weight = 1 + getWeight(a.test, countTokens) + getWeight(a.body, countTokens)
+	if len(a.orelse) > 0: # add 1 for else
+		weight += 1 + getWeight(a.orelse, countTokens)
+	return weight
 
-		elif type(a) in [ast.Pass, ast.Break, ast.Continue, ast.Num, ast.Bytes, 
-						 ast.NameConstant, ast.Name,
-						 ast.Ellipsis]:
-			weight = 1
-		elif type(a) in [ast.And, ast.Or, 
-						 ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod, ast.Pow,
-						 ast.LShift, ast.RShift, ast.BitOr, ast.BitXor,
-						 ast.BitAnd, ast.FloorDiv,
-						 ast.Invert, ast.Not, ast.UAdd, ast.USub,
-						 ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
-						 ast.Is, ast.IsNot, ast.In, ast.NotIn,
-						 ast.Load, ast.Store, ast.Del, ast.AugLoad,
-						 ast.AugStore, ast.Param ]:
-			weight = 1
-		else:
-			log("diffAsts\tgetWeight\tMissing type in diffAsts: " + str(type(a)), "bug")
-			return 1
-		setattr(a, "treeWeight", weight)
-		return weight
+def weighTry(a, countTokens):
+	# add 1 for try
+	weight = 1 + getWeight(a.body, countTokens) + getWeight(a.handlers, countTokens)
+	if len(a.orelse) > 0: # add 1 for else
+		weight += 1 + getWeight(a.orelse, countTokens)
+	if len(a.finalbody) > 0: # add 1 for finally
+		weight += 1 + getWeight(a.finalbody, countTokens)
+	return weight
+
+def weighStr(a, countTokens):
+	# placeholders like ~name~ don't count as tokens, unless we're counting all the tokens
+	if not countTokens and len(a.s) >= 2 and a.s[0] == "~" and a.s[-1] == "~":
+		return 0
+	return 1
+
+# How to weigh each type of node
+nodeWeights = {
+	ast.Module : lambda a, c : getWeight(a.body, c),
+	ast.Interactive : lambda a, c : getWeight(a.body, c),
+	ast.Suite : lambda a, c : getWeight(a.body, c),
+	ast.Expression : lambda a, c : getWeight(a.body, c),
+	# add 1 for function/class name
+	ast.FunctionDef : lambda a, c : 1 + getWeight(a.args, c) + getWeight(a.body, c) + getWeight(a.decorator_list, c) + getWeight(a.returns, c),
+	ast.ClassDef : lambda a, c : 1 + getWeight(a.bases, c) + getWeight(a.keywords, c) + getWeight(a.body, c) + getWeight(a.decorator_list, c),
+	# add 1 for action name
+	ast.Return : lambda a, c : 1 + getWeight(a.value, c),
+	ast.Yield : lambda a, c : 1 + getWeight(a.value, c),
+	ast.Attribute : lambda a, c : 1 + getWeight(a.value, c),
+	ast.Starred : lambda a, c : 1 + getWeight(a.value, c),
+	ast.Delete : lambda a, c : 1 + getWeight(a.targets, c), # add 1 for del
+	ast.Assign : lambda a, c : 1 + getWeight(a.targets, c) + getWeight(a.value, c), # add 1 for =
+	ast.AugAssign : lambda a, c : getWeight(a.target, c) + getWeight(a.op, c) + getWeight(a.value, c),
+	ast.For : lambda a, c : 2 + getWeight(a.target, c) + getWeight(a.iter, c) + getWeight(a.body, c) + getWeight(a.orelse, c), # add 1 for 'for' and 1 for 'in'
+	ast.While : weighConditional,
+	ast.If : weighConditional,
+	ast.With : lambda a, c : 1 + getWeight(a.items, c) + getWeight(a.body, c), # add 1 for with
+	ast.Raise : lambda a, c : 1 + getWeight(a.exc, c) + getWeight(a.cause, c), # add 1 for raise
+	ast.Try : weighTry,
+	ast.Assert : lambda a, c : 1 + getWeight(a.test, c) + getWeight(a.msg, c), # add 1 for assert
+	ast.Import : lambda a, c : 1 + getWeight(a.names, c), # add 1 for function name
+	ast.Global : lambda a, c : 1 + getWeight(a.names, c),
+	ast.ImportFrom : lambda a, c : 3 + getWeight(a.names, c), # add 3 for from module import
+	ast.Expr : lambda a, c : atLeastOne(getWeight(a.value, c)),
+	ast.Index : lambda a, c : atLeastOne(getWeight(a.value, c)),
+
+	ast.BoolOp : lambda a, c : (len(a.values) - 1) + getWeight(a.values, c), # add 1 for each op
+	ast.BinOp : lambda a, c : 1 + getWeight(a.left, c) + getWeight(a.right, c), # add 1 for op
+	ast.UnaryOp : lambda a, c : 1 + getWeight(a.operand, c), # add 1 for operator
+	ast.Lambda : lambda a, c : 1 + getWeight(a.args, c) + getWeight(a.body, c), # add 1 for lambda
+	ast.IfExp : lambda a, c : 2 + getWeight(a.test, c) + getWeight(a.body, c) + getWeight(a.orelse, c), # add 2 for if and else
+	ast.Dict : lambda a, c : 1 + getWeight(a.keys, c) + getWeight(a.values, c), # return 1 if empty dictionary
+	ast.Set : lambda a, c : 1 + getWeight(a.elts, c),
+	ast.List : lambda a, c : 1 + getWeight(a.elts, c),
+	ast.Tuple : lambda a, c : 1 + getWeight(a.elts, c),
+	ast.ListComp : lambda a, c : 1 + getWeight(a.elt, c) + getWeight(a.generators, c),
+	ast.SetComp : lambda a, c : 1 + getWeight(a.elt, c) + getWeight(a.generators, c),
+	ast.GeneratorExp : lambda a, c : 1 + getWeight(a.elt, c) + getWeight(a.generators, c),
+	ast.DictComp : lambda a, c : 1 + getWeight(a.key, c) + getWeight(a.value, c) + getWeight(a.generators, c),
+	ast.Compare : lambda a, c : len(a.ops) + getWeight(a.left, c) + getWeight(a.comparators, c),
+	ast.Call : lambda a, c : atLeastOne(getWeight(a.func, c)) + atLeastOne(getWeight(a.args, c) + getWeight(a.keywords, c)),
+	ast.Subscript : lambda a, c : atLeastOne(getWeight(a.value, c)) + atLeastOne(getWeight(a.slice, c)),
+
+	ast.Slice : lambda a, c : atLeastOne(getWeight(a.lower, c) + getWeight(a.upper, c) + getWeight(a.step, c)),
+	ast.ExtSlice : lambda a, c : getWeight(a.dims, c),
+
+	# add 2 for for and in, and each of the if tokens
+	ast.comprehension : lambda a, c : 2 + len(a.ifs) + getWeight(a.target, c) + getWeight(a.iter, c) + getWeight(a.ifs, c),
+	# add 1 for except, and 1 for as (if needed)
+	ast.ExceptHandler : lambda a, c : 1 + getWeight(a.type, c) + (1 if a.name != None else 0) + getWeight(a.name, c) + getWeight(a.body, c),
+	ast.arguments : lambda a, c : getWeight(a.args, c) + getWeight(a.vararg, c) + getWeight(a.kwonlyargs, c) + \
+									getWeight(a.kw_defaults, c) + getWeight(a.kwarg, c) + getWeight(a.defaults, c),
+	ast.arg : lambda a, c : 1 + getWeight(a.annotation, c),
+	ast.keyword : lambda a, c : 1 + getWeight(a.value, c), # add 1 for identifier
+	ast.alias : lambda a, c : 1 + (2 if a.asname != None else 0), # 1 for name, 1 for as, 1 for asname
+	ast.withitem : lambda a, c : getWeight(a.context_expr, c) + getWeight(a.optional_vars, c),
+	ast.Str : weighStr,
+}
+# Everything else is a single token
+for t in [	ast.Pass, ast.Break, ast.Continue, ast.Num, ast.Bytes, ast.NameConstant, ast.Name, ast.Ellipsis,
+			ast.And, ast.Or, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod, ast.Pow,
+			ast.LShift, ast.RShift, ast.BitOr, ast.BitXor, ast.BitAnd, ast.FloorDiv,
+			ast.Invert, ast.Not, ast.UAdd, ast.USub,
+			ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+			ast.Is, ast.IsNot, ast.In, ast.NotIn,
+			ast.Load, ast.Store, ast.Del, ast.AugLoad, ast.AugStore, ast.Param ]:
+	nodeWeights[t] = lambda a, c : 1
 
 def matchLists(x, y):
 	"""For each line in x, determine which line it best maps to in y"""
@@ -221,7 +155,7 @@ def matchLists(x, y):
 			j = 0
 			while j < len(ySubset):
 				if xSubset[i][1] == ySubset[j][1]:
-					if compareASTs(xSubset[i][0], ySubset[j][0], checkEquality=True) == 0:
+					if sameAST(xSubset[i][0], ySubset[j][0]):
 						mapSet[ySubset[j][1]] = xSubset[i][1]
 						xSubset.pop(i)
 						ySubset.pop(j)
@@ -234,7 +168,7 @@ def matchLists(x, y):
 		while i < len(xSubset):
 			j = 0
 			while j < len(ySubset):
-				if compareASTs(xSubset[i][0], ySubset[j][0], checkEquality=True) == 0:
+				if sameAST(xSubset[i][0], ySubset[j][0]):
 					mapSet[ySubset[j][1]] = xSubset[i][1]
 					xSubset.pop(i)
 					ySubset.pop(j)
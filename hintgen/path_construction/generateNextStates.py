@@ -2,7 +2,8 @@ import copy
 from ..tools import *
 from ..astTools import *
 from ..display import *
-from ..test import test as codetest
+from ..test import test as codetest, test_many as codetest_many
+from ..problemCache import getProblemData
 from .diffAsts import *
 from ..State import *
 from ..ChangeVector import *
@@ -112,8 +113,9 @@ def updateChangeVectors(changes, oldStart, newStart):
 		newState = change.applyChange()
 	return changes, newState
 
-def applyChangeVectors(s, changes, states, goals):
-	"""Attempt to apply all the changes listed to the solution state s"""
+def applyChangeVectors(s, changes, states, goals, runTests=True):
+	"""Attempt to apply all the changes listed to the solution state s. If runTests is False, a new state
+		is returned untested and unrecorded; test a batch of those with testNewStates."""
 	if len(changes) == 0:
 		return s
 	tup = updateChangeVectors(changes, changes[0].start, s.tree)
@@ -128,19 +130,42 @@ def applyChangeVectors(s, changes, states, goals):
 	if len(matches) > 0:
 		matches = sorted(matches, key=lambda x : getattr(x, "count"))
 		tmpN = matches[-1]
-		tmpN.tree = str_to_tree(tmpN.tree_source)
+		del tmpN.tree # so that it's decoded fresh from tree_source when it's used
 		return tmpN
 	else:
 		n = CanonicalState(code=newFun, problem=s.problem, count=0)
 		n.tree = newState
 		n.tree_source = tree_to_str(newState)
 		n.treeWeight = getWeight(newState)
+		if not runTests:
+			return n
 		n = codetest(n)
 		states.append(n)
 		if n.score == 1:
 			goals.append(n)
 		return n
 
+def testNewStates(newStates, states, threshold=None):
+	"""Test all the new states made by applyChangeVectors(runTests=False) in one batch. If we only need to know
+		whether they reach a threshold score, the tests can stop early (see test.test)."""
+	codetest_many([n for n in newStates if n != None and n.score == None and not any(n is x for x in states)], threshold)
+
+def recordState(n, states, goals):
+	"""Add a state from testNewStates to the known states, unless a state with the same code is
+		already known, in which case that state is returned instead"""
+	if n == None or any(n is x for x in states):
+		return n
+	matches = list(filter(lambda x : x.code==n.code, states))
+	if len(matches) > 0:
+		matches = sorted(matches, key=lambda x : getattr(x, "count"))
+		tmpN = matches[-1]
+		del tmpN.tree # so that it's decoded fresh from tree_source when it's used
+		return tmpN
+	states.append(n)
+	if n.score == 1:
+		goals.append(n)
+	return n
+
 def chooseGoal(s, goals, states):
 	# First, find the closest goal state and the changes required to get to it
 	goalDist = 2 # the max dist is 1
@@ -176,7 +201,7 @@ def chooseGoal(s, goals, states):
 	return goal
 
 def generateHelperDistributions(s, g, goals, states):
-	restricted_names = list(eval(s.problem.arguments).keys())
+	restricted_names = list(getProblemData(s.problem).arguments.keys())
 	sHelpers = gatherAllHelpers(s.tree, restricted_names)
 	gHelpers = gatherAllHelpers(g.tree, restricted_names)
 	nonMappableHelpers = gatherAllFunctionNames(g.tree)
@@ -226,38 +251,41 @@ def generateHelperDistributions(s, g, goals, states):
 			d[tup[1]] = tup[0]
 		allMaps.append(d)
 	allFuns = []
+	newFuns = [] # (state, map) pairs that still need to be tested
 	for map in allMaps:
 		tmpTree = deepcopy(g.tree)
 		tmpTree = applyHelperMap(tmpTree, map)
 		tmpCode = printFunction(tmpTree)
 
-		matches = list(filter(lambda x : x.code==tmpCode, goals))
+		matches = list(filter(lambda x : x.code==tmpCode, goals + [x[0] for x in newFuns]))
 		if len(matches) > 0:
 			matches = sorted(matches, key=lambda s: getattr(s, "count"))
 			tmpG = matches[-1]
-			tmpG.tree = str_to_tree(tmpG.tree_source)
+			del tmpG.tree # so that it's decoded fresh from tree_source when it's used
 			allFuns.append(tmpG)
 		else:
 			tmpG = CanonicalState(code=tmpCode, problem=s.problem, count=0)
 			tmpG.tree = tmpTree
 			tmpG.tree_source = tree_to_str(tmpTree)
 			tmpG.treeWeight = g.treeWeight
-			tmpG = codetest(tmpG)
-			if tmpG.score != 1:
-				log("generateNextStates\tgenerateHelperDistributions\tBad helper remapping: " + str(map), "bug")
-				log(s.code, "bug")
-				log(printFunction(s.orig_tree), "bug")
-				log(g.code, "bug")
-				log(tmpCode, "bug")
 			allFuns.append(tmpG)
-			goals.append(tmpG)
-			states.append(tmpG)
+			newFuns.append((tmpG, map))
+	codetest_many([x[0] for x in newFuns])
+	for (tmpG, map) in newFuns:
+		if tmpG.score != 1:
+			log("generateNextStates\tgenerateHelperDistributions\tBad helper remapping: " + str(map), "bug")
+			log(s.code, "bug")
+			log(printFunction(s.orig_tree), "bug")
+			log(g.code, "bug")
+			log(tmpG.code, "bug")
+		goals.append(tmpG)
+		states.append(tmpG)
 	return allFuns
 
 def generateVariableDistributions(s, g, goals, states):
 	sParameters = gatherAllParameters(s.tree)
 	gParameters = gatherAllParameters(g.tree, keep_orig=False)
-	restricted_names = list(eval(s.problem.arguments).keys()) + getAllImports(s.tree) + getAllImports(g.tree)
+	restricted_names = list(getProblemData(s.problem).arguments.keys()) + getAllImports(s.tree) + getAllImports(g.tree)
 	sHelpers = gatherAllHelpers(s.tree, restricted_names)
 	gHelpers = gatherAllHelpers(g.tree, restricted_names)
 	sVariables = gatherAllVariables(s.tree)
@@ -346,32 +374,35 @@ def generateVariableDistributions(s, g, goals, states):
 		placeholdCount = 0
 		allMaps.append(d)
 	allFuns = []
+	newFuns = [] # (state, map) pairs that still need to be tested
 	for map in allMaps:
 		tmpTree = deepcopy(g.tree)
 		tmpTree = applyVariableMap(tmpTree, map)
 		tmpCode = printFunction(tmpTree)
 
-		matches = list(filter(lambda x : x.code==tmpCode, goals))
+		matches = list(filter(lambda x : x.code==tmpCode, goals + [x[0] for x in newFuns]))
 		if len(matches) > 0:
 			matches = sorted(matches, key=lambda s: getattr(s, "count"))
 			tmpG = matches[-1]
-			tmpG.tree = str_to_tree(tmpG.tree_source)
+			del tmpG.tree # so that it's decoded fresh from tree_source when it's used
 			allFuns.append(tmpG)
 		else:
 			tmpG = CanonicalState(code=tmpCode, problem=s.problem, count=0)
 			tmpG.tree = tmpTree
 			tmpG.tree_source = tree_to_str(tmpTree)
 			tmpG.treeWeight = g.treeWeight
-			tmpG = codetest(tmpG)
-			if tmpG.score != 1:
-				log("generateNextStates\tgenerateVariablesDistributions\tBad variable remapping: " + str(map), "bug")
-				log(s.code, "bug")
-				log(printFunction(s.orig_tree), "bug")
-				log(g.code, "bug")
-				log(tmpCode, "bug")
 			allFuns.append(tmpG)
-			goals.append(tmpG)
-			states.append(tmpG)
+			newFuns.append((tmpG, map))
+	codetest_many([x[0] for x in newFuns])
+	for (tmpG, map) in newFuns:
+		if tmpG.score != 1:
+			log("generateNextStates\tgenerateVariablesDistributions\tBad variable remapping: " + str(map), "bug")
+			log(s.code, "bug")
+			log(printFunction(s.orig_tree), "bug")
+			log(g.code, "bug")
+			log(tmpG.code, "bug")
+		goals.append(tmpG)
+		states.append(tmpG)
 	return allFuns
 
 def generateMappings(s, g):
@@ -402,30 +433,38 @@ def optimizeGoal(s, changes, states, goals):
 	# Until you've run out of possible goal states...
 	while len(treeLevel) != 0:
 		nextLevel = []
-		# Look at each number of combinations of edits
+		# Build every state on this level first, so that they can all be tested in one batch
+		candidates = []
 		for branch in treeLevel:
 			# Apply each possible next edit
 			for i in range(len(branch.next)):
 				newChanges = branch.edits + [branch.next[i]]
 				# If our current best is in this, don't bother
 				if isStrictSubset(currentEdits, newChanges):	continue
+				candidates.append((branch, i, newChanges, applyChangeVectors(s, newChanges, states, goals, runTests=False)))
+		testNewStates([c[3] for c in candidates], states, threshold=1) # we're only looking for new goals
 
-				# Check to see that the state exists and that it isn't too far away
-				newState = applyChangeVectors(s, newChanges, states, goals)
-				if newState == None: # shouldn't happen
-					log("generateNextStates\toptimizeGoal\tBroken edit: " + str(newChanges), "bug")
-					continue
-				newDistance, _ = distance(s, newState, givenChanges=newChanges)
-
-				allChanges.append((newChanges, newState)) # just in case we need the final goal
-
-				if newState.score == 1 and newDistance <= currentDiff: # it's a new goal!
-					# We know that it's closer because we just tested distance
-					currentGoal, currentDiff, currentEdits = newState, newDistance, newChanges
-				else:
-					# Only include changes happening after this one to avoid ordering effects!
-					# We only add a state here if it's closer than the current goal
-					nextLevel.append(Branch(newChanges, branch.next[i+1:], newState))
+		# Look at each number of combinations of edits
+		for (branch, i, newChanges, newState) in candidates:
+			# The current best may have changed since this state was built
+			if isStrictSubset(currentEdits, newChanges):	continue
+
+			# Check to see that the state exists and that it isn't too far away
+			newState = recordState(newState, states, goals)
+			if newState == None: # shouldn't happen
+				log("generateNextStates\toptimizeGoal\tBroken edit: " + str(newChanges), "bug")
+				continue
+			newDistance, _ = distance(s, newState, givenChanges=newChanges)
+
+			allChanges.append((newChanges, newState)) # just in case we need the final goal
+
+			if newState.score == 1 and newDistance <= currentDiff: # it's a new goal!
+				# We know that it's closer because we just tested distance
+				currentGoal, currentDiff, currentEdits = newState, newDistance, newChanges
+			else:
+				# Only include changes happening after this one to avoid ordering effects!
+				# We only add a state here if it's closer than the current goal
+				nextLevel.append(Branch(newChanges, branch.next[i+1:], newState))
 		treeLevel = nextLevel
 
 	if s.goal.code == currentGoal.code:
@@ -437,9 +476,11 @@ def fastOptimizeGoal(s, changes, states, goals, includeSmallSets=False):
 	# Only try out one, two, all but two, all but one
 	fastChanges = fastPowerSet(changes, includeSmallSets)
 	currentGoal, currentDiff, currentEdits = s.goal, s.goalDist, changes
-	for changeSet in fastChanges:
-		if isStrictSubset(currentEdits, changeSet):	continue
-		newState = applyChangeVectors(s, changeSet, states, goals)
+	fastChanges = [changeSet for changeSet in fastChanges if not isStrictSubset(currentEdits, changeSet)]
+	newStates = [applyChangeVectors(s, changeSet, states, goals, runTests=False) for changeSet in fastChanges]
+	testNewStates(newStates, states, threshold=1)
+	for (changeSet, newState) in zip(fastChanges, newStates):
+		newState = recordState(newState, states, goals)
 		if newState == None:	continue
 		newDistance, _ = distance(s, newState, givenChanges=changeSet)
 		if newDistance <= currentDiff and newState.score == 1:
@@ -469,7 +510,7 @@ def isValidNextState(s, n, g):
 		return False # didn't load properly
 
 	# Third: is test.test(n) >= test.test(s)?
-	n = codetest(n)
+	n = codetest(n, threshold=s.score)
 	if n.score < s.score and abs(n.score - s.score) > 0.001:
 		return False
 
@@ -514,8 +555,9 @@ def getAllCombinations(s, changes, states, goals):
 	# Also find the solution states associated with the changes
 	allCombinations = []
 	for x in allChanges:
-		allCombinations.append((x, applyChangeVectors(s, x, states, goals)))
-	return allCombinations
+		allCombinations.append((x, applyChangeVectors(s, x, states, goals, runTests=False)))
+	testNewStates([n for (x, n) in allCombinations], states, threshold=s.score) # see isValidNextState
+	return [(x, recordState(n, states, goals)) for (x, n) in allCombinations]
 
 def getNextState(s, goals, states, given_goal=None):
 	"""Generate the best next state for s, so that it will produce a desirable hint"""
@@ -0,0 +1,125 @@
+"""A cache of the parsed parts of each problem: its tests, its arguments, and its given code.
+Entries are checked against Problem.version, which goes up whenever the problem or its tests
+change, and the least recently used problems are dropped once there are too many."""
+import ast, hashlib, marshal, threading
+from collections import OrderedDict
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Problem, Testcase
+
+PROBLEM_CACHE_SIZE = 100 # the number of problems kept in memory
+
+problemCache = OrderedDict()
+problemLock = threading.Lock()
+
+class ProblemData:
+	"""The parsed parts of one version of a problem, each worked out the first time it's needed.
+		These are shared by everyone working on the problem, so don't modify them."""
+	def __init__(self, problem):
+		self.problem_id = problem.id
+		self.version = problem.version
+		self.problem = problem
+		self._tests = self._suite_version = self._arguments = self._given_tree = self._given_compiled = None
+
+	@property
+	def tests(self):
+		"""The problem's tests, with their input and output interpreted, or a feedback message if one of them is broken"""
+		if self._tests == None:
+			tests = list(self.problem.tests.all())
+			for t in tests:
+				# Need to interpret from repr
+				try:
+					t.input = eval(t.test_input)
+					t.output = eval(t.test_output)
+				except:
+					if not hasattr(t, "input"):
+						self._tests = "Broken test case input: " + t.test_input + "\nExpecting a tuple of values."
+					else:
+						self._tests = "Broken test case output: " + t.test_output + "\nExpecting a legal Python value."
+					return self._tests
+			self._tests = tests
+		return self._tests
+
+	@property
+	def suite_version(self):
+		"""A hash of the test rows, which changes whenever a test is added, removed, or edited. Only for working tests."""
+		if self._suite_version == None:
+			h = hashlib.sha256()
+			for t in self.tests:
+				for field in [str(t.id), t.test_input, t.test_output, t.test_extra]:
+					h.update(field.encode("utf-8"))
+					h.update(b"\0")
+			self._suite_version = h.hexdigest()
+		return self._suite_version
+
+	@property
+	def arguments(self):
+		if self._arguments == None:
+			self._arguments = eval(self.problem.arguments)
+		return self._arguments
+
+	@property
+	def given_tree(self):
+		if self._given_tree == None:
+			self._given_tree = ast.parse(self.problem.given_code)
+		return self._given_tree
+
+	@property
+	def given_compiled(self):
+		"""The given code compiled and marshalled, ready to send to a test process. Empty if there's no given code,
+			and the source itself if it doesn't compile, so that loading it reports the error as usual."""
+		if self._given_compiled == None:
+			if len(self.problem.given_code) == 0:
+				self._given_compiled = b""
+			else:
+				try:
+					self._given_compiled = marshal.dumps(compile(self.given_tree, "<given code>", "exec"))
+				except Exception as e:
+					self._given_compiled = self.problem.given_code
+		return self._given_compiled
+
+def getProblemData(problem):
+	"""Get the cached data for this version of the problem"""
+	with problemLock:
+		data = problemCache.get(problem.id)
+		if data != None and data.version == problem.version:
+			problemCache.move_to_end(problem.id)
+			return data
+		data = ProblemData(problem)
+		problemCache[problem.id] = data
+		while len(problemCache) > PROBLEM_CACHE_SIZE:
+			problemCache.popitem(last=False)
+		return data
+
+def forgetProblem(problemId):
+	with problemLock:
+		problemCache.pop(problemId, None)
+
+def warmProblemCache(problems=None):
+	"""Load and parse everything for the given problems (or all of them, up to the cache size) ahead of time,
+		e.g. before forking server processes, so that the first requests don't have to"""
+	if problems == None:
+		problems = Problem.objects.all()[:PROBLEM_CACHE_SIZE]
+	for problem in problems:
+		data = getProblemData(problem)
+		if type(data.tests) != str:
+			data.suite_version
+		try:
+			data.arguments
+			data.given_compiled
+		except Exception as e:
+			pass # these will fail again when they're used, where the errors are handled
+
+@receiver(pre_save, sender=Problem)
+def problemChanged(sender, instance, **kwargs):
+	if instance.pk != None:
+		instance.version += 1
+		forgetProblem(instance.pk)
+
+@receiver(post_save, sender=Testcase)
+@receiver(post_delete, sender=Testcase)
+def problemTestsChanged(sender, instance, **kwargs):
+	# Use F() and update() so that this doesn't trigger problemChanged as well
+	Problem.objects.filter(id=instance.problem_id).update(version=F("version") + 1)
+	forgetProblem(instance.problem_id)
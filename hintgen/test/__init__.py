@@ -1,56 +1,128 @@
 import ast, traceback
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from .testHarness import *
+from .resultCache import *
+from .testOrder import runOrder, recordResults, forgetOrder
 from ..display import *
 from ..namesets import *
 from ..models import *
+from ..problemCache import getProblemData
 
-loaded_pairs = { } # Keep track of pairs for efficiency
-
-def test(s, forceRetest=False):
+def test(s, forceRetest=False, threshold=None):
 	"""A method for testing solution states, which returns a number between
-		0 (totally wrong) and 1 (correct)"""
+		0 (totally wrong) and 1 (correct). If a threshold is given, only whether the
+		score reaches it matters: the feedback is left empty, and if the tests stopped
+		early because the threshold couldn't be reached, s.score is only an upper bound
+		and s.score_bound is set. Testing the state again without a threshold fills it in."""
 	if forceRetest:
-		if hasattr(s, "loadedFun"):
-			del s.loadedFun
 		s.score = None
 		s.feedback = ""
 	if (s.score != None and s.feedback != ""):
 		return s
+	if threshold != None and s.score != None and not getattr(s, "score_bound", False):
+		return s # the score is exact, which is all a threshold check needs
 
 	if s.tree != None:
 		replaceHazards(s.tree)
 		s.code = printFunction(s.tree, 0)
 
-	# If necessary, load the tests
-	if s.problem.id not in loaded_pairs:
-		tests = s.problem.tests.all()
-		for i in range(len(tests)):
-			# Need to interpret from repr
-			try:
-				tests[i].input = eval(tests[i].test_input)
-				tests[i].output = eval(tests[i].test_output)
-			except:
-				s.score = 0
-				if not hasattr(tests[i], "input"):
-					s.feedback = "Broken test case input: " + tests[i].test_input + "\nExpecting a tuple of values."
-				else:
-					s.feedback = "Broken test case output: " + tests[i].test_output + "\nExpecting a legal Python value."
-				return s
-		loaded_pairs[s.problem.id] = tests
-
-	tests = loaded_pairs[s.problem.id]
+	s.test_results = None
+	s.score_bound = False
+	tests = load_tests(s.problem)
+	if type(tests) == str:
+		s.score, s.feedback = 0, tests
+		return s
 	s.num_pairs = len(tests)
 	try:
 		ast.parse(s.code)
-		s.score, s.feedback = score(s, tests, returnFeedback=True)
+		key = resultKey(s.code, s.problem, getProblemData(s.problem).suite_version)
+		result = None if forceRetest else getResult(key)
+		if result != None:
+			s.score, s.feedback, s.test_results = result
+			return s
+		s.score, s.feedback = score(s, tests, returnFeedback=True, threshold=threshold, order=runOrder(s.problem.id, tests))
+		if s.test_results != None:
+			recordResults(s.problem.id, tests, s.test_results)
+		if threshold != None:
+			s.score_bound = s.test_results != None and TEST_NOT_RUN in s.test_results
+		else:
+			storeResult(key, s.problem, s.score, s.feedback, s.test_results, replace=forceRetest)
 	except Exception as e: # if the code doesn't parse, create a compiler error message
 		s.score = 0
-		trace = traceback.format_exc()
-		lines = trace.split("\n")
-		lines = lines[lines.index("    return compile(source, filename, mode, PyCF_ONLY_AST)")+1:]
-		s.feedback = "COMPILER ERROR:\n" + str("\n".join(lines))
+		s.feedback = compilerError()
 	return s
 
+def test_many(states, threshold=None):
+	"""Test a batch of states for the same problem at once, updating each one like test() does.
+		All the code that needs to run goes to the sandbox together."""
+	states = [s for s in states if s.score == None or (s.feedback == "" and (threshold == None or getattr(s, "score_bound", False)))]
+	if len(states) == 0:
+		return states
+	for s in states:
+		if s.tree != None:
+			replaceHazards(s.tree)
+			s.code = printFunction(s.tree, 0)
+	results = score_many(states[0].problem, [s.code for s in states], threshold)
+	tests = load_tests(states[0].problem)
+	for i in range(len(states)):
+		states[i].score, states[i].feedback, states[i].test_results = results[i]
+		states[i].score_bound = states[i].test_results != None and TEST_NOT_RUN in states[i].test_results
+		if type(tests) != str:
+			states[i].num_pairs = len(tests)
+	return states
+
+def score_many(problem, codes, threshold=None):
+	"""Score many pieces of code for one problem in a single trip to the sandbox, with a separate
+		timeout for each. Returns a list of (score, feedback, test results) triples, in the same order as the code.
+		The test results hold the status of each test, or None if the tests couldn't run.
+		A threshold works the same way as in test()."""
+	tests = load_tests(problem)
+	if type(tests) == str:
+		return [(0, tests, None)] * len(codes)
+	results = [None] * len(codes)
+	keys = { }
+	for i in range(len(codes)):
+		try:
+			ast.parse(codes[i])
+		except Exception as e:
+			results[i] = (0, compilerError(), None)
+			continue
+		keys[i] = resultKey(codes[i], problem, getProblemData(problem).suite_version)
+		results[i] = getResult(keys[i])
+	toRun = { } # only run each piece of code once
+	for i in keys:
+		if results[i] == None:
+			toRun.setdefault(codes[i], []).append(i)
+	runCodes = list(toRun.keys())
+	batch = score_batch(problem, runCodes, tests, threshold, runOrder(problem.id, tests))
+	for (code, result) in zip(runCodes, batch):
+		for i in toRun[code]:
+			results[i] = result
+		if result[2] != None:
+			recordResults(problem.id, tests, result[2])
+		if threshold == None: # threshold runs are missing their feedback
+			storeResult(keys[toRun[code][0]], problem, result[0], result[1], result[2])
+	return results
+
+def load_tests(problem):
+	"""Returns the problem's tests, or a feedback message if one of them is broken"""
+	return getProblemData(problem).tests
+
+def compilerError():
+	"""Turn the exception being handled into a compiler error message"""
+	trace = traceback.format_exc()
+	lines = trace.split("\n")
+	lines = lines[lines.index("    return compile(source, filename, mode, PyCF_ONLY_AST)")+1:]
+	return "COMPILER ERROR:\n" + str("\n".join(lines))
+
+@receiver(post_save, sender=Testcase)
+@receiver(post_delete, sender=Testcase)
+def testsChanged(sender, instance, **kwargs):
+	"""When a problem's tests change, its cached results are out of date"""
+	clearResults(instance.problem_id)
+	forgetOrder(instance.problem_id)
+
 def replaceHazards(a):
 	if not isinstance(a, ast.AST):
 		return
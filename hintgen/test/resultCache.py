@@ -0,0 +1,84 @@
+"""A cache of test results (score, feedback, and the status of each test), so that code we've already tested doesn't get run again.
+Results are keyed on a hash of the code, the problem's given code, and the version of its test suite,
+so identical code in different state tiers (source, cleaned, anon, canonical) shares one entry."""
+import hashlib, threading
+from collections import OrderedDict
+from ..tools import log
+from ..models import TestResult
+from .testHarness import TEST_TIMED_OUT, TEST_OUT_OF_MEMORY
+
+RESULT_CACHE_SIZE = 10000 # the number of results kept in memory
+PERSIST_RESULTS = True # also keep results in the database, so they survive restarts
+
+# Results that can depend on how busy the machine was (or on the test process breaking), rather than on the code alone.
+# These are never cached, so that the code gets another chance the next time it's tested.
+UNSTABLE_FEEDBACK = ["Broken Process", "Infinite loop!", "CPU limit exceeded!", "Out of memory!"]
+UNSTABLE_TESTS = [TEST_TIMED_OUT, TEST_OUT_OF_MEMORY]
+
+resultCache = OrderedDict()
+resultLock = threading.Lock()
+
+def resultKey(code, problem, version):
+	h = hashlib.sha256()
+	for field in [str(problem.id), problem.name, problem.given_code, version, code]:
+		h.update(field.encode("utf-8"))
+		h.update(b"\0")
+	return h.hexdigest()
+
+def getResult(key):
+	"""Look up a result, first in memory, then in the database. Returns None on a miss."""
+	with resultLock:
+		if key in resultCache:
+			resultCache.move_to_end(key)
+			return resultCache[key][1:]
+	if not PERSIST_RESULTS:
+		return None
+	try:
+		row = TestResult.objects.filter(key=key).first()
+	except Exception as e:
+		log("resultCache\tgetResult\tCould not read result: " + str(e), "bug")
+		return None
+	if row == None:
+		return None
+	testResults = None if row.test_results == "" else [int(c) for c in row.test_results]
+	remember(key, row.problem_id, row.score, row.feedback, testResults)
+	return (row.score, row.feedback, testResults)
+
+def isStable(feedback, testResults):
+	"""Whether the result comes from the code alone, so that testing the code again would give the same result"""
+	for message in UNSTABLE_FEEDBACK:
+		if feedback.startswith(message):
+			return False
+	return testResults == None or not any(r in UNSTABLE_TESTS for r in testResults)
+
+def storeResult(key, problem, score, feedback, testResults, replace=False):
+	"""Remember the result, unless it isn't stable. If replace is set, it takes the place of any result already stored."""
+	if not isStable(feedback, testResults):
+		return
+	remember(key, problem.id, score, feedback, testResults)
+	if not PERSIST_RESULTS:
+		return
+	encoded = "" if testResults == None else "".join(str(r) for r in testResults)
+	fields = { "problem" : problem, "score" : score, "feedback" : feedback, "test_results" : encoded }
+	try:
+		if replace:
+			TestResult.objects.update_or_create(key=key, defaults=fields)
+		else:
+			TestResult.objects.get_or_create(key=key, defaults=fields)
+	except Exception as e: # most likely another process stored the same result first
+		log("resultCache\tstoreResult\tCould not save result: " + str(e), "bug")
+
+def remember(key, problemId, score, feedback, testResults):
+	with resultLock:
+		resultCache[key] = (problemId, score, feedback, testResults)
+		resultCache.move_to_end(key)
+		while len(resultCache) > RESULT_CACHE_SIZE:
+			resultCache.popitem(last=False)
+
+def clearResults(problemId):
+	"""Forget every result for the given problem"""
+	with resultLock:
+		for key in [k for k in resultCache if resultCache[k][0] == problemId]:
+			del resultCache[key]
+	if PERSIST_RESULTS:
+		TestResult.objects.filter(problem_id=problemId).delete()
@@ -0,0 +1,216 @@
+"""A pool of pre-forked processes that run student code for the test harness.
+Each worker receives jobs over a pipe and sends the results back, so we don't pay
+for starting up a process on every test run. The jobs themselves run in a child
+forked from the worker, which is cheap (the child shares the worker's memory until
+it writes to it) and means nothing one job does can leak into the next."""
+import io, multiprocessing, os, signal, sys, threading
+from ..tools import log
+
+def workerLoop(conn, handler, setup=None):
+	"""The main loop of a sandbox process. A job of None shuts the worker down, and a list of
+		jobs is a batch, whose results are sent back one at a time as they finish. If there's a
+		setup function, it's called once when the worker starts, before any jobs."""
+	try:
+		os.setpgid(0, 0) # so that killing the worker's group also kills the job it's running
+	except OSError as e:
+		log("sandbox\tworkerLoop\tCould not start process group: " + str(e), "bug")
+	if setup != None:
+		setup()
+	while True:
+		try:
+			job = conn.recv()
+		except (EOFError, OSError):
+			break # the parent went away
+		if job == None:
+			break
+		jobs = job if type(job) == list else [job]
+		try:
+			for job in jobs:
+				conn.send(runForked(handler, job))
+		except (EOFError, OSError):
+			break
+
+def runForked(handler, job):
+	"""Run the job in a fresh child of this process, so that whatever it does to the interpreter (its modules,
+		builtins, and so on) goes away with the child. Returns None if the child died without a result."""
+	reader, writer = multiprocessing.Pipe(duplex=False)
+	pid = os.fork()
+	if pid == 0:
+		try:
+			reader.close()
+			writer.send(runQuietly(handler, job))
+		finally:
+			os._exit(0)
+	writer.close()
+	try:
+		result = reader.recv()
+	except (EOFError, OSError):
+		result = None
+	reader.close()
+	os.waitpid(pid, 0)
+	return result
+
+def runQuietly(handler, job):
+	# Student code likes to print things; keep that out of the server's output
+	out = sys.stdout
+	err = sys.stderr
+	sys.stdout = io.StringIO()
+	sys.stderr = io.StringIO()
+	try:
+		result = handler(job)
+	except BaseException as e:
+		result = None
+	sys.stdout = out
+	sys.stderr = err
+	return result
+
+class SandboxWorker:
+	"""A single sandbox process and the parent's end of its pipe"""
+	def __init__(self, handler, setup=None):
+		self.conn, childConn = multiprocessing.Pipe()
+		self.proc = multiprocessing.Process(target=workerLoop, args=(childConn, handler, setup))
+		self.proc.daemon = True # don't let workers outlive the server
+		self.proc.start()
+		childConn.close()
+		self.runs = 0
+
+	def run(self, job, timeout):
+		"""Send the job to the worker and wait for the result. Returns a (status, result) pair,
+			where the status is 'Success', 'Timeout', or 'Broken'"""
+		self.runs += 1
+		try:
+			self.conn.send(job)
+			if not self.conn.poll(timeout):
+				return "Timeout", None
+			return "Success", self.conn.recv()
+		except (EOFError, OSError):
+			return "Broken", None
+
+	def runMany(self, jobs, timeout):
+		"""Send a batch of jobs to the worker and collect the results as they arrive, giving each job
+			its own timeout. Stops at the first job that doesn't succeed, so the list of (status, result)
+			pairs that comes back may be shorter than the batch."""
+		self.runs += len(jobs)
+		results = []
+		try:
+			self.conn.send(jobs)
+			for job in jobs:
+				if not self.conn.poll(timeout):
+					results.append(("Timeout", None))
+					break
+				result = self.conn.recv()
+				if result == None: # the handler itself fell over
+					results.append(("Broken", None))
+					break
+				results.append(("Success", result))
+		except (EOFError, OSError):
+			results.append(("Broken", None))
+		return results
+
+	def isAlive(self):
+		return self.proc.is_alive()
+
+	def stop(self):
+		"""Ask the worker to exit, and kill it if it doesn't"""
+		try:
+			self.conn.send(None)
+		except (EOFError, OSError):
+			pass
+		self.proc.join(0.1)
+		self.kill()
+
+	def kill(self):
+		if self.proc.is_alive():
+			try:
+				os.killpg(self.proc.pid, signal.SIGKILL) # the worker and the job it's running
+			except OSError:
+				pass # it hasn't set up its group yet
+			try:
+				self.proc.terminate()
+				self.proc.join(0.01)
+				if self.proc.is_alive():
+					os.kill(self.proc.pid, signal.SIGKILL)
+				self.proc.join()
+			except Exception as e:
+				log("sandbox\tkill\tCould not kill worker: " + str(e), "bug")
+		self.conn.close()
+
+class SandboxPool:
+	"""A fixed-size, thread-safe pool of sandbox workers. A worker is thrown away and replaced
+		when it times out, when it crashes, or once it has run maxRuns jobs. Each new worker calls
+		setup (if given) before it takes any jobs."""
+	def __init__(self, handler, size, maxRuns, setup=None):
+		self.handler = handler
+		self.setup = setup
+		self.size = size
+		self.maxRuns = maxRuns
+		self.pid = os.getpid() # a pool can't be shared across a fork
+		self.lock = threading.Condition()
+		self.idle = [SandboxWorker(handler, setup) for i in range(size)]
+		self.count = size # the number of workers that exist, idle or busy
+
+	def acquire(self):
+		with self.lock:
+			while len(self.idle) == 0 and self.count >= self.size:
+				self.lock.wait()
+			if len(self.idle) > 0:
+				return self.idle.pop()
+			self.count += 1 # a worker was lost earlier, so start a new one
+		try:
+			return SandboxWorker(self.handler, self.setup)
+		except:
+			with self.lock:
+				self.count -= 1
+				self.lock.notify()
+			raise
+
+	def release(self, worker, reusable):
+		if reusable and worker.runs < self.maxRuns and worker.isAlive():
+			with self.lock:
+				self.idle.append(worker)
+				self.lock.notify()
+			return
+		if reusable:
+			worker.stop() # recycle it
+		else:
+			worker.kill()
+		# Replace the worker now, so that the next job doesn't have to wait for a fork
+		try:
+			worker = SandboxWorker(self.handler, self.setup)
+		except Exception as e:
+			log("sandbox\trelease\tCould not start worker: " + str(e), "bug")
+			with self.lock:
+				self.count -= 1
+				self.lock.notify()
+			return
+		with self.lock:
+			self.idle.append(worker)
+			self.lock.notify()
+
+	def run(self, job, timeout):
+		"""Run the job on the next free worker. Returns a (status, result) pair"""
+		worker = self.acquire()
+		status, result = worker.run(job, timeout)
+		if status == "Success" and result == None:
+			status = "Broken" # the handler itself fell over
+		self.release(worker, status == "Success")
+		return status, result
+
+	def runMany(self, jobs, timeout):
+		"""Run a batch of jobs on the next free worker, with a separate timeout for each job. If a job
+			times out or breaks its worker, the rest of the batch moves on to another worker.
+			Returns a list of (status, result) pairs, one per job."""
+		results = []
+		while len(results) < len(jobs):
+			worker = self.acquire()
+			batch = worker.runMany(jobs[len(results):], timeout)
+			results += batch
+			self.release(worker, batch[-1][0] == "Success")
+		return results
+
+	def shutdown(self):
+		with self.lock:
+			workers = self.idle
+			self.idle = []
+		for worker in workers:
+			worker.stop()
@@ -1,14 +1,68 @@
-import copy, ctypes, multiprocessing, os, random, io, sys, threading, time, ast
-import importlib.util
+import copy, io, marshal, math, multiprocessing, os, resource, signal, struct, sys, threading, time, types, ast
 from ..tools import log
-from ..paths import TEST_PATH
+from ..problemCache import getProblemData
+from .sandbox import SandboxPool, runQuietly
 
-done = False
-msg_length = 400
+RUN_TIMEOUT = 0.1 # seconds allowed for loading the code and, unless PER_TEST_TIMEOUTS is on, running all the tests
+PER_TEST_TIMEOUTS = True # give each test its own time limit, so that an infinite loop only fails the tests it happens in
+TEST_TIMEOUT = 0.05 # seconds allowed for each test when PER_TEST_TIMEOUTS is on
+TESTS_TIMEOUT = 0.15 # seconds allowed for all of a run's tests together when PER_TEST_TIMEOUTS is on; once they're used up, the rest of the tests time out without running
 
-def timerDone():
-	global done
-	done = True
+# The status of each test after a run
+TEST_FAILED = 0
+TEST_PASSED = 1
+TEST_TIMED_OUT = 2
+TEST_NOT_RUN = 3 # the run stopped before this test because the score couldn't reach its threshold
+TEST_OUT_OF_MEMORY = 4
+TEST_TOO_DEEP = 5 # hit the recursion limit
+TEST_TOO_MUCH_OUTPUT = 6
+
+SCORE_TOLERANCE = 0.001 # scores this close to a threshold count as reaching it
+
+SANDBOX_WORKERS = 4 # number of pre-forked test processes. If 0, a new process is forked for every run
+SANDBOX_MAX_RUNS = 200 # each sandbox process is recycled after this many runs
+sandboxPool = None
+sandboxLock = threading.Lock()
+
+# Limits on the test processes, so that pathological code can't take the server down with it. 0 turns a limit off.
+MEMORY_LIMIT = 256 * 2**20 # bytes of address space a test process can use beyond what it starts with (RLIMIT_AS)
+CPU_LIMIT = 5 # seconds of CPU time each job can use (RLIMIT_CPU); a backstop for when the timers can't run
+RECURSION_LIMIT = 1000 # how deep student code can recurse, reset for every job
+OUTPUT_LIMIT = 100000 # characters that loading the code, or each test, can print
+processLimited = False # whether this is a test process with the limits above
+
+class TestTimeout(BaseException):
+	"""Raised inside a test that has run past its time limit. It isn't an Exception, so that the
+		student's code can't swallow it with a try/except"""
+	pass
+
+def raiseTestTimeout(signum, frame):
+	raise TestTimeout()
+
+class CPULimitExceeded(BaseException):
+	"""Raised when a job has used up its CPU time"""
+	pass
+
+def raiseCPULimitExceeded(signum, frame):
+	raise CPULimitExceeded()
+
+class OutputLimitExceeded(BaseException):
+	"""Raised when student code prints more than OUTPUT_LIMIT characters"""
+	pass
+
+class LimitedOutput(io.TextIOBase):
+	"""Stands in for stdout and stderr while student code runs. It throws away what's printed, but counts it."""
+	def __init__(self):
+		self.written = 0
+
+	def writable(self):
+		return True
+
+	def write(self, s):
+		self.written += len(s)
+		if OUTPUT_LIMIT > 0 and self.written > OUTPUT_LIMIT:
+			raise OutputLimitExceeded()
+		return len(s)
 
 def manageException(e, errors, input, output, actual):
 	if type(e) == AssertionError:
@@ -33,79 +87,25 @@ def checkCopy(f, input):
 	f(*cp)
 	return cp == input
 
-def load_file(tmpFile, tmpFull):
+def load_code(code, instructorFunctions):
+	"""Compile the code (plus the instructor's functions) straight into a fresh module. Nothing touches the disk.
+		The instructor's functions can be source code, or code compiled and marshalled by the problem cache."""
 	failed = False
-	# Then try to load the function
+	source = code
+	if type(instructorFunctions) == str and len(instructorFunctions) != 0:
+		source += "\n\n" + instructorFunctions
 	try:
-		spec = importlib.util.spec_from_file_location(tmpFile, tmpFull + ".py")
-		mod = importlib.util.module_from_spec(spec)
-		spec.loader.exec_module(mod)
+		mod = types.ModuleType("tmp")
+		exec(compile(source, "<student code>", "exec"), mod.__dict__)
+		if type(instructorFunctions) == bytes and len(instructorFunctions) != 0:
+			exec(marshal.loads(instructorFunctions), mod.__dict__) # after the student's code, as if it was appended
+	except (MemoryError, RecursionError):
+		raise # these are reported separately
 	except Exception as e:
 		mod = None
 		failed = True
 	return mod, failed
 
-def textToFunction(s):
-	if s.loadedFun != None:
-		return s.loadedFun
-	instructorFunctions = s.problem.given_code
-	# Create a file that can be loaded, with the function in it
-	tmpFile = "tmp" + str(random.randint(0,100000))
-	tmpPath = TEST_PATH + "tmp"
-	tmpFull = tmpPath + "/" + tmpFile
-	tmpCache = tmpPath + "/" + "__pycache__" + "/" + tmpFile
-	try:
-		f = open(tmpFull + ".py", "w")
-	except:
-		s.feedback = "ERROR: could not write file, please change permissions in the test/tmp folder"
-		return None
-	# Set this up to look like Python 3
-	#f.write("from __future__ import (absolute_import, division, print_function)\n")
-	f.write(s.code)
-	if len(instructorFunctions) != 0:
-		f.write("\n\n" + instructorFunctions)
-	f.close()
-
-	# Try loading the file in a timed thread in case the file calls infinitely-looping code
-	p = multiprocessing.Process(target=load_file, args=(tmpFile, tmpFull))
-	result = run_in_timer(p, 0.1)
-	if result != "Success":
-		log("testHarness\ttextToFunction\tTimer problem: " + result + "\n" + s.code, "bug")
-		s.feedback = result
-		return None
-	else:
-		out = sys.stdout
-		err = sys.stderr
-		sys.stdout = io.StringIO()
-		sys.stderr = io.StringIO()
-		mod, failed = load_file(tmpFile, tmpFull)
-		sys.stdout = out
-		sys.stderr = err
-
-	# Clean up the extra files
-	if os.path.exists(tmpFull + ".py"):
-		os.remove(tmpFull + ".py")
-	if os.path.exists(tmpFull + ".pyc"):
-		os.remove(tmpFull + ".pyc")
-	for version in range(10): # Python 3 caches in a separate folder and includes the version number
-		name = tmpCache + ".cpython-3" + str(version) + ".pyc"
-		if os.path.exists(name):
-			os.remove(name)
-	
-	if failed:
-		s.feedback = "ERROR: could not load function, possibly due to compiler error in instructorFunctions"
-		return None
-
-	# Load the resulting function from the file. It will have references to all necessary helpers
-	if hasattr(mod, s.problem.name):
-		loaded = getattr(mod, s.problem.name)
-		s.loadedFun = loaded
-	else:
-		s.feedback = "ERROR: could not find required function in code"
-		return None
-
-	return s.loadedFun
-
 def __genericTest__(f, input, output):
 	errors = []
 	answer = None
@@ -116,75 +116,323 @@ def __genericTest__(f, input, output):
 			assert(abs(answer - output) < 0.001)
 		else:
 			assert(answer == output)
+	except (MemoryError, RecursionError):
+		raise # these get their own test status
 	except Exception as e:
 		manageException(e, errors, input_copy, output, answer)
 	return errors
 
-def runFunction(s, tests, score, feedback=None):
-	f = textToFunction(s) # first, load the function
+def canTime():
+	"""Timers can only be set up in the main thread, which is where the test processes run"""
+	if PER_TEST_TIMEOUTS and threading.current_thread() == threading.main_thread():
+		signal.signal(signal.SIGALRM, raiseTestTimeout)
+		return True
+	return False
+
+def runTimed(timeout, f, *args):
+	"""Call f, interrupting it with TestTimeout once the timeout passes"""
+	try:
+		# Keep going off every timeout, in case the code catches the first one
+		signal.setitimer(signal.ITIMER_REAL, timeout, timeout)
+		return f(*args)
+	finally:
+		signal.setitimer(signal.ITIMER_REAL, 0)
+
+def runTimedTest(f, input, output, timed, deadline=None):
+	"""Run one test, returning its status and its list of errors. A timed test gets TEST_TIMEOUT seconds,
+		or less if that would take it past the deadline."""
+	if isinstance(sys.stdout, LimitedOutput):
+		sys.stdout.written = 0 # each test can print up to the limit
+	try:
+		if timed:
+			timeout = TEST_TIMEOUT if deadline == None else min(TEST_TIMEOUT, deadline - time.monotonic())
+			if timeout <= 0:
+				return TEST_TIMED_OUT, [] # the run is out of time
+			errors = runTimed(timeout, __genericTest__, f, input, output)
+		else:
+			errors = __genericTest__(f, input, output)
+	except TestTimeout:
+		return TEST_TIMED_OUT, []
+	except MemoryError:
+		return TEST_OUT_OF_MEMORY, []
+	except RecursionError:
+		return TEST_TOO_DEEP, []
+	except OutputLimitExceeded:
+		return TEST_TOO_MUCH_OUTPUT, []
+	return (TEST_PASSED if len(errors) == 0 else TEST_FAILED), errors
+
+def runFunction(f, tests, results, messages, threshold=None):
+	"""Run the loaded function on each (input, output, extra) test, recording whether it passed,
+		failed, timed out, or broke a limit in results and its feedback message in messages. If a threshold is given,
+		no messages are written, and the run stops as soon as the score can no longer reach the threshold.
+		All of the tests together get TESTS_TIMEOUT seconds, so code that loops forever on every test doesn't take n times as long."""
+	timed = canTime()
+	deadline = time.monotonic() + TESTS_TIMEOUT if timed else None
+	passed = 0
 	for i in range(len(tests)):
-		test = tests[i]
-		if test.test_extra == "check_copy":
-			inp = [f] + [test.input]
-		elif test.test_extra == "":
-			inp = test.input
+		if threshold != None and (passed + len(tests) - i) / len(tests) < threshold - SCORE_TOLERANCE:
+			for j in range(i, len(tests)):
+				results[j] = TEST_NOT_RUN
+			return
+		(test_input, test_output, test_extra) = tests[i]
+		if test_extra == "check_copy":
+			inp = [f] + [test_input]
+		elif test_extra == "":
+			inp = test_input
 		else:
-			log("testHarness\trunFunction\tDid not recognize special function " + test.test_extra, "bug")
+			log("testHarness\trunFunction\tDid not recognize special function " + test_extra, "bug")
 			return
 
 		input_copy = copy.deepcopy(inp)
-		errors = __genericTest__(f, inp, test.output)
-		if len(errors) == 0: # if no problems occurred
-			score.value = score.value + 1
-			inp = repr(input_copy)
-			inp = inp if len(inp) < 100 else inp[:97] + "..."
-			inp = inp[1:] if (inp[0] == 'u' and inp[1] == "'" and inp[-1] == "'") else inp
-			o = repr(test.output)
-			o = o if len(o) < 100 else o[:97] + "..."
-			o = o[1:] if (o[0] == 'u' and o[1] == "'" and o[-1] == "'") else o
-			s = "Test passed on input (" + inp[1:-1] + "), expected output " + o + "\n" # 240
+		(results[i], errors) = runTimedTest(f, inp, test_output, timed, deadline)
+		if results[i] == TEST_PASSED:
+			passed += 1
+		if threshold == None:
+			messages[i] = testMessage(results[i], errors, input_copy, test_output)
+
+def testMessage(status, errors, input, output):
+	"""The feedback line for one test"""
+	if status in [TEST_TIMED_OUT, TEST_OUT_OF_MEMORY, TEST_TOO_DEEP, TEST_TOO_MUCH_OUTPUT]:
+		inp = repr(input)
+		inp = inp if len(inp) < 100 else inp[:97] + "..."
+		return limitMessage(status, "Test with input (" + inp[1:-1] + ")") + "\n"
+	elif status == TEST_PASSED:
+		inp = repr(input)
+		inp = inp if len(inp) < 100 else inp[:97] + "..."
+		inp = inp[1:] if (inp[0] == 'u' and inp[1] == "'" and inp[-1] == "'") else inp
+		o = repr(output)
+		o = o if len(o) < 100 else o[:97] + "..."
+		o = o[1:] if (o[0] == 'u' and o[1] == "'" and o[-1] == "'") else o
+		return "Test passed on input (" + inp[1:-1] + "), expected output " + o + "\n" # 240
+	else:
+		return errors[0] + "\n"
+
+def limitMessage(status, what):
+	"""The feedback for code (what) that ran out of time or broke one of the limits"""
+	if status == TEST_TIMED_OUT:
+		return "Infinite loop! " + what + " timed out after " + str(TEST_TIMEOUT) + " seconds"
+	elif status == TEST_OUT_OF_MEMORY:
+		return "Out of memory! " + what + " used more than " + (str(MEMORY_LIMIT // 2**20) + " MB" if MEMORY_LIMIT > 0 else "the memory available")
+	elif status == TEST_TOO_DEEP:
+		return "Recursion too deep! " + what + " went past the recursion limit (" + str(sys.getrecursionlimit()) + ")"
+	else:
+		return "Too much output! " + what + " printed more than " + str(OUTPUT_LIMIT) + " characters"
+
+# A packed test run starts with the number of tests, then has a (status, message length) record for each test,
+# then all of the messages as one UTF-8 string. Lengths are in code points, so the decoded string can be sliced directly.
+COUNT = struct.Struct("<I")
+RECORD = struct.Struct("<BI")
+
+def pack_results(results, messages):
+	"""Pack the results of a test run into bytes, to send back from the test process"""
+	records = b"".join(RECORD.pack(results[i], len(messages[i])) for i in range(len(results)))
+	# Outputs can hold lone surrogates, which strict UTF-8 won't encode
+	return COUNT.pack(len(results)) + records + "".join(messages).encode("utf-8", "surrogatepass")
+
+def unpack_results(data):
+	"""Unpack a test run packed by pack_results into (results, feedback, lengths), where feedback holds every
+		test's message and lengths holds the length of each of them"""
+	numTests = COUNT.unpack_from(data)[0]
+	start = COUNT.size + numTests * RECORD.size
+	results, lengths = [], []
+	for (status, length) in RECORD.iter_unpack(data[COUNT.size:start]):
+		results.append(status)
+		lengths.append(length)
+	return results, data[start:].decode("utf-8", "surrogatepass"), lengths
+
+def restore_order(order, results, feedback, lengths):
+	"""Put the results and feedback of tests that were run in the given order back into their original order"""
+	if order == None:
+		return results, feedback
+	origResults = [None] * len(order)
+	messages = [None] * len(order)
+	start = 0
+	for i in range(len(order)):
+		origResults[order[i]] = results[i]
+		messages[order[i]] = feedback[start:start + lengths[i]]
+		start += lengths[i]
+	return origResults, "".join(messages)
+
+def run_job(job):
+	"""Handle a job sent to a sandbox process. Jobs are tuples that start with their type:
+		('test', code, instructorFunctions, funName, tests, threshold) loads the code, runs the tests on it
+			(see runFunction) and returns them packed by pack_results, or an error message if they couldn't run.
+		Student code is only ever run here, in the test process, and is only loaded once per job."""
+	if job[0] == "test":
+		out = sys.stdout
+		err = sys.stderr
+		sys.stdout = sys.stderr = LimitedOutput()
+		if processLimited:
+			limit_job()
+		try:
+			return run_test(*job[1:])
+		except CPULimitExceeded:
+			return "CPU limit exceeded! Code used more than " + str(CPU_LIMIT) + " seconds of CPU time"
+		finally:
+			if processLimited:
+				unlimit_job()
+			sys.stdout = out
+			sys.stderr = err
+
+def run_test(code, instructorFunctions, funName, tests, threshold):
+	"""Load the code and run the tests on it, for run_job"""
+	try:
+		if canTime(): # catch code that loops forever while loading
+			mod, failed = runTimed(RUN_TIMEOUT, load_code, code, instructorFunctions)
+		else:
+			mod, failed = load_code(code, instructorFunctions)
+	except TestTimeout:
+		return "Infinite loop! Code timed out after " + str(RUN_TIMEOUT) + " seconds"
+	except MemoryError:
+		return limitMessage(TEST_OUT_OF_MEMORY, "Code")
+	except RecursionError:
+		return limitMessage(TEST_TOO_DEEP, "Code")
+	except OutputLimitExceeded:
+		return limitMessage(TEST_TOO_MUCH_OUTPUT, "Code")
+	except CPULimitExceeded:
+		raise
+	except BaseException as e:
+		mod, failed = None, True
+	if failed:
+		return "ERROR: could not load function, possibly due to compiler error in instructorFunctions"
+	if not hasattr(mod, funName):
+		return "ERROR: could not find required function in code"
+	results = [TEST_FAILED] * len(tests)
+	messages = [""] * len(tests)
+	try:
+		runFunction(getattr(mod, funName), tests, results, messages, threshold)
+	except CPULimitExceeded:
+		raise
+	except BaseException as e:
+		pass # the student's code exited early; keep what we have so far
+	return pack_results(results, messages)
+
+def address_space():
+	"""The size of this process's address space in bytes, or None if we can't tell"""
+	try:
+		with open("/proc/self/statm") as f:
+			return int(f.read().split()[0]) * resource.getpagesize()
+	except (OSError, ValueError, IndexError):
+		return None
+
+def limit_process():
+	"""Set up the limits of a test process, before it runs any student code. The memory limit can
+		only go down from here, so the student's code can't raise it again."""
+	global processLimited
+	processLimited = True
+	try:
+		size = address_space()
+		if MEMORY_LIMIT > 0 and size != None:
+			hard = resource.getrlimit(resource.RLIMIT_AS)[1]
+			limit = size + MEMORY_LIMIT
+			if hard != resource.RLIM_INFINITY:
+				limit = min(limit, hard)
+			resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+		if CPU_LIMIT > 0:
+			signal.signal(signal.SIGXCPU, raiseCPULimitExceeded)
+	except (ValueError, OSError) as e:
+		log("testHarness\tlimit_process\tCould not limit test process: " + str(e), "bug")
+
+def limit_job():
+	"""Reset the recursion limit and start the job's CPU allowance. RLIMIT_CPU counts all of the
+		time the process has used, so the allowance goes on top of what's been used so far."""
+	if RECURSION_LIMIT > 0:
+		sys.setrecursionlimit(RECURSION_LIMIT)
+	if CPU_LIMIT > 0:
+		usage = resource.getrusage(resource.RUSAGE_SELF)
+		hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+		limit = math.ceil(usage.ru_utime + usage.ru_stime) + CPU_LIMIT
+		if hard != resource.RLIM_INFINITY:
+			limit = min(limit, hard)
+		resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+
+def unlimit_job():
+	"""Lift the CPU allowance between jobs, so that it can't go off in the worker's own code"""
+	if CPU_LIMIT > 0:
+		hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+		resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+def getSandboxPool():
+	global sandboxPool
+	with sandboxLock:
+		if sandboxPool == None or sandboxPool.pid != os.getpid():
+			sandboxPool = SandboxPool(run_job, SANDBOX_WORKERS, SANDBOX_MAX_RUNS, limit_process)
+		return sandboxPool
+
+def run_in_sandbox(job, timerTime):
+	"""Run the job in one of the pooled sandbox processes. Returns 'Success', a timeout message, or
+		'Broken Process', along with the job's result"""
+	status, result = getSandboxPool().run(job, timerTime)
+	if status == "Timeout":
+		return "Infinite loop! Code timed out after " + str(timerTime) + " seconds", None
+	elif status == "Broken":
+		log("testHarness\trun_in_sandbox\tBroken process", "bug")
+		return "Broken Process", None
+	return "Success", result
+
+def run_many_in_sandbox(jobs, timerTime):
+	"""Run a batch of jobs in a single trip to the sandbox pool, giving each job its own timeout.
+		Returns a (message, result) pair for each job, like run_in_sandbox"""
+	results = []
+	for (status, result) in getSandboxPool().runMany(jobs, timerTime):
+		if status == "Timeout":
+			results.append(("Infinite loop! Code timed out after " + str(timerTime) + " seconds", None))
+		elif status == "Broken":
+			log("testHarness\trun_many_in_sandbox\tBroken process", "bug")
+			results.append(("Broken Process", None))
 		else:
-			s = errors[0] + "\n"
-		if feedback != None:
-			for j in range(len(s)):
-				feedback[i*msg_length + j] = ord(s[j]) # add the string into the array
-
-def run_in_timer(proc, timerTime):
-	global done
-	out = sys.stdout
-	err = sys.stderr
-	sys.stdout = io.StringIO()
-	sys.stderr = io.StringIO()
-	timer = threading.Timer(timerTime, timerDone)
-	timeout = False
+			results.append(("Success", result))
+	return results
+
+def run_in_process(job, timerTime):
+	"""Run the job in a newly forked process, for when there's no sandbox pool. Returns the same
+		messages as run_in_sandbox, along with the job's result"""
+	conn, childConn = multiprocessing.Pipe(duplex=False)
+	proc = multiprocessing.Process(target=send_result, args=(childConn, job))
 	try:
 		proc.start()
-		timer.start()
-		while (proc.is_alive()) and (not done):
-			continue
-		timer.cancel()
-		# If the process is still running, kill it
-		if proc.is_alive():
-			timeout = True
-			try:
-				proc.terminate()
-				time.sleep(0.01)
-				if proc.is_alive():
-					os.system('kill -9 ' + str(proc.pid))
-			except:
-				log("testHarness\tscore\tThread is still alive!", "bug")
-			while proc.is_alive():
-				time.sleep(0.01)
-		sys.stdout = out
-		sys.stderr = err
-		done = False
-	except Exception as e:
-		log("testHarness\tscore\tBroken process: " + str(e), "bug")
-		return "Broken Process"
-	if timeout:
-		return "Infinite loop! Code timed out after " + str(timerTime) + " seconds"
-	else:
-		return "Success"
+		childConn.close()
+		# Read the result as soon as it's ready; the child can't exit until a large one has been read
+		if conn.poll(timerTime):
+			result = conn.recv()
+			status = "Success" if result != None else "Broken Process"
+		else:
+			result = None
+			status = "Infinite loop! Code timed out after " + str(timerTime) + " seconds"
+	except (EOFError, OSError) as e: # the process died without sending anything
+		result = None
+		status = "Broken Process"
+	if status == "Broken Process":
+		log("testHarness\trun_in_process\tBroken process", "bug")
+	if proc.is_alive():
+		try:
+			proc.terminate()
+			proc.join(0.01)
+			if proc.is_alive():
+				os.kill(proc.pid, signal.SIGKILL)
+		except:
+			log("testHarness\trun_in_process\tProcess is still alive!", "bug")
+	proc.join()
+	conn.close()
+	return status, result
+
+def send_result(conn, job):
+	"""Process target for run_in_process"""
+	limit_process()
+	conn.send(runQuietly(run_job, job))
+	conn.close()
+
+def run_timeout(numTests):
+	"""How long the parent waits for a run of numTests tests before giving up on it"""
+	if PER_TEST_TIMEOUTS:
+		return round(RUN_TIMEOUT + min(numTests * TEST_TIMEOUT, TESTS_TIMEOUT), 3)
+	return RUN_TIMEOUT
+
+def results_score(results):
+	"""The fraction of tests that passed. If the run stopped early, this is an upper bound, which counts
+		the tests that weren't run as passing."""
+	results = list(results)
+	return (results.count(TEST_PASSED) + results.count(TEST_NOT_RUN)) / len(results)
 
 def contains_function(a, problem_name):
 	for line in a.body:
@@ -192,50 +440,74 @@ def contains_function(a, problem_name):
 			return True
 	return False
 
-def score(s, tests, returnFeedback=False):
-	# Note that now, infinite loops will break all test cases that come after that. We're OK with this as long as we order test cases properly.
-	if not hasattr(s, "loadedFun"):
-		if not hasattr(s, "tree") or s.tree == None:
-			try:
-				tmpTree = ast.parse(s.code)
-			except:
-				s.feedback = "Could not load code"
-				return (0, s.feedback) if returnFeedback else 0
-		else:
-			tmpTree = s.tree
-
-		if contains_function(tmpTree, s.problem.name):
-			s.loadedFun = None
-			s.loadedFun = textToFunction(s)
-		else:
-			s.feedback = "ERROR: could not find required function in code"
+def score(s, tests, returnFeedback=False, threshold=None, order=None):
+	"""Score the state on the tests, also setting s.test_results to the status of each test (or None if the tests couldn't run).
+		If a threshold is given, the run skips the feedback and stops early once the score can't reach it (see runFunction).
+		If an order is given (a list of indices into tests), the tests run in that order, but the results and feedback
+		still come back in the original order."""
+	# Note that unless PER_TEST_TIMEOUTS is on, infinite loops will break all test cases that come after that. We're OK with this as long as we order test cases properly.
+	s.test_results = None
+	if not hasattr(s, "tree") or s.tree == None:
+		try:
+			tmpTree = ast.parse(s.code)
+		except:
+			s.feedback = "Could not load code"
 			return (0, s.feedback) if returnFeedback else 0
-	f = s.loadedFun
-
-	if f == None:
+	else:
+		tmpTree = s.tree
+	if not contains_function(tmpTree, s.problem.name):
+		s.feedback = "ERROR: could not find required function in code"
 		return (0, s.feedback) if returnFeedback else 0
 
-	score = multiprocessing.Value(ctypes.c_float, 0.0, lock=False)
-	if returnFeedback:
-		# Allocate 250 chars for each feedback line
-		feedback = multiprocessing.Array(ctypes.c_int, msg_length * len(tests), lock=False)
-		p = multiprocessing.Process(target=runFunction, args=(s, tests, score, feedback))
+	tests = [(test.input, test.output, test.test_extra) for test in tests]
+	if order != None:
+		tests = [tests[i] for i in order]
+	job = ("test", s.code, getProblemData(s.problem).given_compiled, s.problem.name, tests, threshold)
+	if SANDBOX_WORKERS > 0:
+		test_result, job_result = run_in_sandbox(job, run_timeout(len(tests)))
 	else:
-		p = multiprocessing.Process(target=runFunction, args=(s, tests, score))
-	
-	test_result = run_in_timer(p, 0.1)
+		test_result, job_result = run_in_process(job, run_timeout(len(tests)))
 	if test_result != "Success":
 		#log("testHarness\tscore\tTimer problem: " + test_result, "bug")
-		result = 0
-		msg = test_result
-	else:
-		if returnFeedback:
-			msg = ""
-			for i in range(len(tests)):
-				j = 0
-				while j < msg_length and feedback[i*msg_length + j] != 0:
-					msg += chr(int(feedback[i*msg_length + j]))
-					j += 1
-		result = score.value / len(tests)
+		return (0, test_result) if returnFeedback else 0
+	if type(job_result) == str: # the code couldn't be run
+		return (0, job_result) if returnFeedback else 0
+	(s.test_results, msg) = restore_order(order, *unpack_results(job_result))
+	result = results_score(s.test_results)
 	return (result, msg) if returnFeedback else result
 
+def score_batch(problem, codes, tests, threshold=None, order=None):
+	"""Score each piece of code on the tests, returning a list of (score, feedback, test results) triples. With the
+		sandbox pool, the whole batch is sent to a worker at once and each piece of code gets its own timeout."""
+	if SANDBOX_WORKERS == 0:
+		results = []
+		for code in codes:
+			s = types.SimpleNamespace(code=code, problem=problem, tree=None, feedback="")
+			results.append(score(s, tests, returnFeedback=True, threshold=threshold, order=order) + (s.test_results,))
+		return results
+	results = [None] * len(codes)
+	tests = [(test.input, test.output, test.test_extra) for test in tests]
+	if order != None:
+		tests = [tests[i] for i in order]
+	given = getProblemData(problem).given_compiled
+	jobs, indices = [], []
+	for i in range(len(codes)):
+		try:
+			tmpTree = ast.parse(codes[i])
+		except:
+			results[i] = (0, "Could not load code", None)
+			continue
+		if contains_function(tmpTree, problem.name):
+			jobs.append(("test", codes[i], given, problem.name, tests, threshold))
+			indices.append(i)
+		else:
+			results[i] = (0, "ERROR: could not find required function in code", None)
+	for (i, (test_result, job_result)) in zip(indices, run_many_in_sandbox(jobs, run_timeout(len(tests)))):
+		if test_result != "Success":
+			results[i] = (0, test_result, None)
+		elif type(job_result) == str:
+			results[i] = (0, job_result, None)
+		else:
+			(testResults, msg) = restore_order(order, *unpack_results(job_result))
+			results[i] = (results_score(testResults), msg, testResults)
+	return results
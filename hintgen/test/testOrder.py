@@ -0,0 +1,76 @@
+"""Keeps track of how often each test fails, so that the tests most likely to fail can be run first.
+With a threshold, the run can then stop after as few tests as possible. The counts are gathered
+in memory and added to the Testcase rows every STATS_FLUSH_RUNS runs."""
+import threading
+from django.db.models import F
+from ..tools import log
+from ..models import Testcase
+from .testHarness import TEST_PASSED, TEST_NOT_RUN
+
+STATS_FLUSH_RUNS = 100 # how many runs to gather before saving the counts
+
+testStats = { } # problem id -> test id -> [runs, failures], including the counts that haven't been saved yet
+pendingStats = { } # test id -> [runs, failures] that haven't been saved yet
+pendingRuns = 0
+testOrders = { } # problem id -> (the ids of the tests the order was made for, the order to run them in)
+statsLock = threading.Lock()
+
+def runOrder(problemId, tests):
+	"""The order to run the tests in (as a list of indices), most likely to fail first. The order is made again
+		whenever the tests aren't the ones it was made for, since another process can change them."""
+	testIds = [t.id for t in tests]
+	with statsLock:
+		(orderIds, order) = testOrders.get(problemId, (None, None))
+		if orderIds != testIds:
+			stats = problemStats(problemId, tests)
+			# Smooth the failure rate, so that new tests start in the middle
+			rates = [(stats[t.id][1] + 1) / (stats[t.id][0] + 2) for t in tests]
+			order = sorted(range(len(tests)), key=lambda i : -rates[i]) # stable, so ties stay in id order
+			testOrders[problemId] = (testIds, order)
+		return order
+
+def problemStats(problemId, tests):
+	if problemId not in testStats:
+		testStats[problemId] = { }
+	stats = testStats[problemId]
+	for t in tests:
+		if t.id not in stats:
+			stats[t.id] = [t.runs, t.failures]
+	return stats
+
+def recordResults(problemId, tests, results):
+	"""Count the results of one run of the tests, given in their original order"""
+	global pendingRuns
+	with statsLock:
+		stats = problemStats(problemId, tests)
+		for i in range(len(tests)):
+			if results[i] == TEST_NOT_RUN:
+				continue
+			failed = 0 if results[i] == TEST_PASSED else 1 # timing out and breaking a limit count as failing
+			for counts in [stats[tests[i].id], pendingStats.setdefault(tests[i].id, [0, 0])]:
+				counts[0] += 1
+				counts[1] += failed
+		pendingRuns += 1
+		if pendingRuns < STATS_FLUSH_RUNS:
+			return
+		pending = pendingStats.copy()
+		pendingStats.clear()
+		pendingRuns = 0
+		testOrders.clear() # reorder with the new numbers
+	flushStats(pending)
+
+def flushStats(stats):
+	try:
+		for testId in stats:
+			(runs, failures) = stats[testId]
+			# Use F() so that counts from other processes aren't overwritten. update() doesn't send post_save,
+			# so this doesn't throw away the loaded tests.
+			Testcase.objects.filter(id=testId).update(runs=F("runs") + runs, failures=F("failures") + failures)
+	except Exception as e:
+		log("testOrder\tflushStats\tCould not save test statistics: " + str(e), "bug")
+
+def forgetOrder(problemId):
+	"""The problem's tests have changed, so start again from the saved counts"""
+	with statsLock:
+		testStats.pop(problemId, None)
+		testOrders.pop(problemId, None)